@@ -6,18 +6,34 @@ import os
 import time
 import uuid
 import re
+import hmac
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
-from time import sleep
 import json
 from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 import logging
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from dotenv import load_dotenv
 
+try:
+    # orjson 序列化比标准库 json 快数倍；未安装时回退
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+except ImportError:
+    FastJSONResponse = JSONResponse
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
 # 加载 .env 文件
 load_dotenv()
 
@@ -39,12 +55,40 @@ else:
 
 # ============ 导入 wrapper ============
 try:
-    from scripts.qa_enhanced_wrapper import answer_enhanced
+    from scripts.qa_enhanced_wrapper import (
+        answer_enhanced, answer_enhanced_stream, answer_from_plan, corpus_info, reload_corpus,
+        retrieve_batch, warmup
+    )
     logger.info("✅ Loaded qa_enhanced_wrapper")
 except Exception as e:
     logger.error(f"❌ 导入 wrapper 失败: {e}")
     def answer_enhanced(*a, **k): 
         return {"intent": "error", "answer": "后端加载失败", "citations": []}
+    def answer_enhanced_stream(*a, **k):
+        yield {"event": "token", "data": {"text": "后端加载失败"}}
+    def retrieve_batch(queries, *a, **k):
+        return [{"query": q} for q in queries]
+    def answer_from_plan(*a, **k):
+        return {"intent": "error", "answer": "后端加载失败", "citations": []}
+    def warmup(*a, **k):
+        raise RuntimeError("qa_enhanced_wrapper 未加载")
+    def reload_corpus(*a, **k):
+        raise RuntimeError("qa_enhanced_wrapper 未加载")
+    def corpus_info():
+        return None
+
+from scripts.admission import Overloaded, get_admission_controller
+from scripts.answer_cache import get_answer_cache
+from scripts.deadline import LLM_MIN_BUDGET, Deadline
+from scripts.feedback_store import get_feedback_store
+from scripts.field_index import parse_filters
+from scripts.metrics import CACHE_REQUESTS, ERRORS, REQUESTS, render_metrics, timed
+from scripts.rate_limit import RATE_LIMIT_ENABLED, RateLimitMiddleware, get_rate_limiter
+from scripts.qa_executor import (
+    ClientDisconnected, iterate_in_pool, run_in_pool, run_on_all_workers, shutdown_executor
+)
+from scripts.singleflight import SingleFlight
+from scripts.static_files import REVALIDATE_CACHE, SHORT_CACHE, StaticCache
 
 # ============ 基础配置 ============
 APP_START_TS = time.time()
@@ -52,12 +96,105 @@ DEFAULT_TOP_K = 5
 MAX_TOP_K = 30
 MAX_QUERY_LENGTH = 1200
 RETRY_MAX = 2
+# Server-Timing 中展示的阶段分组（值为流水线内 timed() 的阶段名）
+SERVER_TIMING_GROUPS = {
+    "retrieval": ("detect_language", "analyze_query", "load_documents", "smart_search"),
+    "web": ("web_search",),
+    "prompt": ("format_context", "prompt_build"),
+    "llm": ("llm",),
+}
+MAX_BATCH_SIZE = 200
+# 批量接口同时进行的 LLM 调用数
+BATCH_LLM_CONCURRENCY = max(1, int(os.getenv("QA_BATCH_CONCURRENCY", "4")))
+# 启动预热时是否预计算语义向量（需要 sentence-transformers，较慢）；
+# 默认跟随检索模式：hybrid / semantic 时预计算，keyword 时不需要
+RETRIEVAL_MODE = os.getenv("QA_RETRIEVAL_MODE", "hybrid").lower()
+WARMUP_EMBEDDINGS = os.getenv("QA_WARMUP_EMBEDDINGS", "0" if RETRIEVAL_MODE == "keyword" else "1") == "1"
+# 语料热重载：管理接口的令牌（未设置时接口关闭），以及源文件轮询间隔（秒，0 = 不轮询）
+ADMIN_TOKEN = os.getenv("QA_ADMIN_TOKEN", "")
+CORPUS_WATCH_INTERVAL = float(os.getenv("QA_CORPUS_WATCH_INTERVAL", "30"))
 
 LOGS_DIR = Path("logs")
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
-FEEDBACK_LOG = LOGS_DIR / "feedback.log"
 
-app = FastAPI(title="UCL AI QA API", version="3.0")
+answer_cache = get_answer_cache()
+qa_flights = SingleFlight()
+admission = get_admission_controller()
+feedback_store = get_feedback_store()
+rate_limiter = get_rate_limiter()
+
+# 预热状态（/api/ready）
+warmup_state: Dict[str, Any] = {"ready": False, "report": None, "error": None, "duration": None}
+
+async def _run_warmup():
+    """在执行池的每个 worker 中预热语料 / 索引 / jieba（进程池模式下每个子进程一份），全部完成后才报告就绪"""
+    start = time.time()
+    try:
+        reports = await run_on_all_workers(warmup, precompute_embeddings=WARMUP_EMBEDDINGS)
+        warmup_state["report"] = reports[0]
+        warmup_state["ready"] = True
+        logger.info(f"✅ 预热完成，实例就绪: {time.time() - start:.2f}s")
+    except Exception as e:
+        warmup_state["error"] = str(e)[:200]
+        logger.error(f"❌ 预热失败: {e}")
+    finally:
+        warmup_state["duration"] = f"{time.time() - start:.2f}s"
+
+def _merge_reload_reports(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """各 worker 的热重载报告 -> 一份（任一 worker 切换了快照即视为已重载）"""
+    report = next((r for r in reports if r.get("reloaded")), reports[0])
+    if len(reports) > 1:
+        report = {**report, "workers": len(reports)}
+    return report
+
+async def _watch_corpus(interval: float):
+    """定期检查源文件指纹，变化时在执行池中构建新快照并原子替换（无需重启）"""
+    while True:
+        await asyncio.sleep(interval)
+        if not warmup_state["ready"]:
+            continue
+        try:
+            report = _merge_reload_reports(await run_on_all_workers(reload_corpus))
+            if report.get("reloaded"):
+                logger.info(f"🔄 检测到语料变化，已切换到版本 {report.get('version')}")
+        except Exception as e:
+            logger.error(f"❌ 语料热重载失败，继续使用当前版本: {e}")
+
+def _warm_static_files() -> None:
+    """预加载前端页面与静态资源，生成缺少的 gzip / brotli 版本"""
+    try:
+        # 路由里的路径经过 StaticCache.resolve()，预热时使用同样的绝对路径
+        n = static_cache.warm(d.resolve() for d in ASSET_DIRS + [PUBLIC_DIR])
+        if FRONTEND_FILE is not None:
+            n += static_cache.warm([FRONTEND_FILE], REVALIDATE_CACHE)
+        logger.info(f"🗜️ 静态文件预热完成: {n} 个文件")
+    except Exception as e:
+        logger.warning(f"⚠️ 静态文件预热失败: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 静态文件在线程中预加载并压缩，请求路径上不再压缩
+    static_warm = asyncio.create_task(asyncio.to_thread(_warm_static_files))
+    # 反馈写入线程随服务启动（日志回放在该线程中进行，不占用事件循环）
+    feedback_store.start()
+    # 预热在后台进行：/api/health 立即可用，/api/ready 在预热完成前返回 503
+    task = asyncio.create_task(_run_warmup())
+    watcher = asyncio.create_task(_watch_corpus(CORPUS_WATCH_INTERVAL)) if CORPUS_WATCH_INTERVAL > 0 else None
+    yield
+    task.cancel()
+    static_warm.cancel()
+    if watcher is not None:
+        watcher.cancel()
+    shutdown_executor(wait=False)
+    # 写完队列中剩余的反馈
+    feedback_store.close()
+
+app = FastAPI(title="UCL AI QA API", version="3.0", lifespan=lifespan)
+
+# ============ 限流 ============
+# 先于 CORS 注册，使 429 响应同样带 CORS 头
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, paths=("/api/qa", "/api/feedback"))
 
 # ============ CORS ============
 app.add_middleware(
@@ -70,10 +207,10 @@ app.add_middleware(
 
 BASE_DIR = Path(__file__).parent
 
-# ============ 静态资源挂载 ============
-if (BASE_DIR / "public").exists():
-    app.mount("/public", StaticFiles(directory=str(BASE_DIR / "public")), name="public")
-    logger.info("✅ Mounted /public")
+PUBLIC_DIR = BASE_DIR / "public"
+# 构建产物目录（带哈希的 js / css），按顺序查找
+ASSET_DIRS = [d for d in (BASE_DIR / "dist" / "assets", PUBLIC_DIR / "assets") if d.is_dir()]
+static_cache = StaticCache()
 
 # ============ 🔥 语言自动检测 ============
 def detect_language(text: str) -> str:
@@ -88,22 +225,142 @@ def detect_language(text: str) -> str:
 def new_request_id() -> str:
     return uuid.uuid4().hex
 
+def _validate_query(req_id: str, query: str) -> None:
+    """输入验证，不合法时抛出 400"""
+    if not query.strip():
+        raise HTTPException(status_code=400, detail={
+            "msg": "query is required",
+            "request_id": req_id
+        })
+    
+    if len(query) > MAX_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail={
+            "msg": f"query too long (max {MAX_QUERY_LENGTH})",
+            "request_id": req_id
+        })
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == bare:
+            return True
+    return False
+
+def _timing_breakdown(result: Dict[str, Any], start: float, cache_hit: bool) -> Dict[str, Any]:
+    """把流水线记录的阶段耗时归并为 retrieval / web / prompt / llm"""
+    total_ms = round((time.time() - start) * 1000, 2)
+    if cache_hit:
+        return {"cache_hit": True, "total_ms": total_ms}
+
+    trace = result.get("timings") or {}
+    stages = trace.get("stages_ms", {})
+    breakdown = {
+        name: round(sum(stages.get(stage, 0.0) for stage in group), 2)
+        for name, group in SERVER_TIMING_GROUPS.items()
+    }
+    breakdown.update({
+        "docs_scored": trace.get("docs_scored", 0),
+        "candidates": trace.get("candidates", 0),
+        "stages_ms": stages,
+        "total_ms": total_ms
+    })
+    return breakdown
+
+def _server_timing(breakdown: Dict[str, Any]) -> str:
+    """Server-Timing 响应头"""
+    if breakdown.get("cache_hit"):
+        parts = ['cache;desc="hit"']
+    else:
+        parts = [f"{name};dur={breakdown[name]:.1f}" for name in SERVER_TIMING_GROUPS]
+    parts.append(f"total;dur={breakdown['total_ms']:.1f}")
+    return ", ".join(parts)
+
+def _overloaded_response(req_id: str, exc: Overloaded) -> JSONResponse:
+    """准入控制拒绝 -> 503 + Retry-After"""
+    logger.warning(f"[{req_id}] 🚦 过载拒绝 ({exc.reason})，Retry-After: {exc.retry_after}s")
+    return JSONResponse(
+        status_code=503,
+        content={
+            "intent": "error",
+            "answer": "服务繁忙，请稍后重试",
+            "citations": [],
+            "reason": exc.reason,
+            "retry_after": exc.retry_after,
+            "request_id": req_id
+        },
+        headers={"Retry-After": str(exc.retry_after), "X-Request-ID": req_id}
+    )
+
+def _check_llm_budget(request: Request, req_id: str):
+    """
+    检查 expensive 档（LLM 调用）额度
+
+    返回 (限流决策, 超限时的 429 响应)；未启用限流时均为 None。
+    """
+    if not RATE_LIMIT_ENABLED:
+        return None, None
+    key = getattr(request.state, "rate_limit_key", None)
+    if key is None:
+        return None, None
+    decision = rate_limiter.check(key, "expensive")
+    if decision.allowed:
+        return decision, None
+    logger.warning(f"[{req_id}] 🚫 LLM 调用额度已用完: {key}")
+    return decision, JSONResponse(
+        status_code=429,
+        content={
+            "intent": "error",
+            "answer": "请求过于频繁，请稍后再试",
+            "citations": [],
+            "request_id": req_id
+        },
+        headers={**decision.headers(), "X-Request-ID": req_id}
+    )
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条 server-sent event"""
+    return f"event: {event}\ndata: {_dumps(data)}\n\n"
+
 # ============ 数据模型 ============
 class QARequest(BaseModel):
     query: str
     top_k: Optional[int] = DEFAULT_TOP_K
     language: Optional[str] = "auto"  # 🔥 默认自动检测
+    fields: Optional[str] = None      # 逗号分隔，只返回这些字段
+    verbose: Optional[bool] = False   # True 时 reranked 包含完整文档
+    # 结构化过滤（逗号分隔表示"或"）：如 level="msc"、type="service"
+    degree: Optional[str] = None
+    level: Optional[str] = None
+    school: Optional[str] = None
+    type: Optional[str] = None
+    category: Optional[str] = None
+
+class BatchQARequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = DEFAULT_TOP_K
+    language: Optional[str] = "auto"
 
 class Feedback(BaseModel):
     request_id: str
     helpful: Optional[bool] = None
+    intent: Optional[str] = None
     timestamp: Optional[str] = None
     note: Optional[str] = None
 
 # ============ 🔥 智能前端查找 ============
 def _find_frontend_file():
-    """查找前端文件 - 你已经确认是 index.html"""
+    """查找前端文件 - 你已经确认是 index.html（启动时调用一次）"""
     candidates = [
+        BASE_DIR / "dist/index.html",      # vite build 产物
         BASE_DIR / "index.html",           # 🔥 你说的正确位置
         BASE_DIR / "demo_qa.html",
         BASE_DIR / "public/demo_qa.html",
@@ -118,6 +375,30 @@ def _find_frontend_file():
     logger.error("❌ 未找到前端文件")
     return None
 
+FRONTEND_FILE = _find_frontend_file()
+
+def _static_response(request: Request, entry) -> Response:
+    """静态文件响应：ETag 命中返回 304，否则按 Accept-Encoding 返回预压缩内容"""
+    encoding, body = entry.select(request.headers.get("accept-encoding", ""))
+    headers = entry.headers(encoding)
+    # 每个编码版本有各自的 ETag
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=entry.content_type, headers=headers)
+
+async def _static_entry(root: Path, relative: str, cache_control: Optional[str] = None):
+    """解析路径并取缓存条目；stat / 读文件（未命中或文件已修改时）在线程池中执行"""
+    def lookup():
+        target = StaticCache.resolve(root, relative)
+        return static_cache.get(target, cache_control) if target else None
+    return await run_in_threadpool(lookup)
+
+async def _serve_index(request: Request) -> Optional[Response]:
+    if FRONTEND_FILE is None:
+        return None
+    entry = await run_in_threadpool(static_cache.get, FRONTEND_FILE, REVALIDATE_CACHE)
+    return _static_response(request, entry) if entry else None
+
 # ============ API 路由 ============
 
 @app.get("/api/health")
@@ -129,8 +410,32 @@ async def health():
         "uptime_seconds": f"{uptime:.2f}",
         "version": "3.0",
         "groq_configured": bool(GROQ_API_KEY),
-        "frontend": str(_find_frontend_file())
+        "frontend": str(FRONTEND_FILE),
+        "static_cache": static_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "inflight_queries": qa_flights.inflight(),
+        "coalesced_queries": qa_flights.shared,
+        "admission": admission.stats(),
+        "corpus": corpus_info()
+    }
+
+@app.get("/api/ready")
+async def ready():
+    """就绪检查：预热完成前返回 503，平台只把流量发给已预热的实例"""
+    body = {
+        "ready": warmup_state["ready"],
+        "warmup": warmup_state["report"],
+        "duration": warmup_state["duration"],
+        "error": warmup_state["error"]
     }
+    if not warmup_state["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/api/metrics")
+async def metrics():
+    """Prometheus 指标（文本格式）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/api/qa")
 async def api_qa_get(
@@ -138,33 +443,59 @@ async def api_qa_get(
     response: Response,
     query: str = Query(..., min_length=1),
     top_k: int = DEFAULT_TOP_K,
-    language: str = "auto"  # 🔥 自动检测
+    language: str = "auto",  # 🔥 自动检测
+    fields: Optional[str] = None,
+    verbose: bool = False,
+    degree: Optional[str] = None,
+    level: Optional[str] = None,
+    school: Optional[str] = None,
+    doc_type: Optional[str] = Query(None, alias="type"),
+    category: Optional[str] = None
 ):
-    return await _handle_qa(request, response, query, top_k, language)
+    filters = parse_filters({
+        "degree": degree, "level": level, "school": school, "type": doc_type, "category": category
+    })
+    return await _handle_qa(request, response, query, top_k, language, fields, verbose, filters)
 
 @app.post("/api/qa")
 async def api_qa_post(req: QARequest, response: Response, request: Request):
-    return await _handle_qa(request, response, req.query, req.top_k, req.language)
+    filters = parse_filters({
+        "degree": req.degree, "level": req.level, "school": req.school, "type": req.type, "category": req.category
+    })
+    return await _handle_qa(
+        request, response, req.query, req.top_k, req.language, req.fields, bool(req.verbose), filters
+    )
 
 async def _handle_qa(
     request: Request, 
     response: Response, 
     query: str, 
     top_k: int, 
-    language: str
+    language: str,
+    fields: Optional[str] = None,
+    verbose: bool = False,
+    filters: Optional[Dict[str, Tuple[str, ...]]] = None
 ):
-    """统一的 QA 处理逻辑"""
+    """统一的 QA 处理逻辑（filters: 结构化字段过滤，检索前先按字段索引求允许的文档）"""
     req_id = new_request_id()
     response.headers["X-Request-ID"] = req_id
     start = time.time()
+    # 端到端截止时间：排队、重试、网络搜索与 LLM 共用同一份预算
+    deadline = Deadline()
+    debug_timings = request.query_params.get("debug") == "timings"
     
+    REQUESTS.inc(endpoint="qa")
+
     # 🔥 自动检测语言
     if language == "auto" or not language:
-        language = detect_language(query)
+        with timed("detect_language"):
+            language = detect_language(query)
         logger.info(f"[{req_id}] 🌐 自动检测语言: {language}")
     
     logger.info(f"[{req_id}] 📝 Query: {query[:100]}")
     logger.info(f"[{req_id}] 🎯 Language: {language} | Top-K: {top_k}")
+    if filters:
+        logger.info(f"[{req_id}] 🏷️ Filters: {filters}")
 
     # 🔥 检查 API Key
     if not GROQ_API_KEY:
@@ -184,42 +515,56 @@ async def _handle_qa(
         }
 
     # 输入验证
-    if not query.strip():
-        raise HTTPException(status_code=400, detail={
-            "msg": "query is required",
-            "request_id": req_id
-        })
-    
-    if len(query) > MAX_QUERY_LENGTH:
-        raise HTTPException(status_code=400, detail={
-            "msg": f"query too long (max {MAX_QUERY_LENGTH})",
-            "request_id": req_id
-        })
+    _validate_query(req_id, query)
 
     top_k = max(1, min(top_k, MAX_TOP_K))
 
-    # 🔥 重试机制
-    last_exc = None
-    result = None
-    
-    for attempt in range(1, RETRY_MAX + 1):
-        try:
-            logger.info(f"[{req_id}] 🔄 尝试 {attempt}/{RETRY_MAX}")
-            result = answer_enhanced(query, top_k=top_k, language=language)
-            logger.info(f"[{req_id}] ✅ 成功")
-            break
-        except Exception as e:
-            last_exc = e
-            logger.error(f"[{req_id}] ❌ 尝试 {attempt} 失败: {e}")
-            if attempt < RETRY_MAX:
-                sleep(0.5 * (2 ** (attempt - 1)))
-    
-    if result is None:
-        logger.error(f"[{req_id}] 💥 所有尝试失败: {last_exc}")
+    # 🔥 答案缓存（温度为 0，相同问题答案一致）
+    cache_key = answer_cache.make_key(query, language, top_k, filters)
+    cached = answer_cache.get(cache_key)
+    CACHE_REQUESTS.inc(result="hit" if cached is not None else "miss")
+    if cached is not None:
+        result, etag = cached
+        logger.info(f"[{req_id}] ⚡ 缓存命中")
+        timings = _timing_breakdown(result, start, cache_hit=True)
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={
+                "ETag": etag, "X-Request-ID": req_id, "Server-Timing": _server_timing(timings)
+            })
+        response.headers["ETag"] = etag
+        response.headers["Server-Timing"] = _server_timing(timings)
+        return _json_response(response, _build_qa_response(
+            result, req_id, language, start, cache_hit=True,
+            timings=timings if debug_timings else None, verbose=verbose, fields=fields
+        ))
+
+    # 🚫 LLM 额度：只有会真正发起新计算的请求才消耗（加入进行中的相同请求不计）
+    if cache_key not in qa_flights:
+        decision, limited = _check_llm_budget(request, req_id)
+        if limited is not None:
+            return limited
+        if decision is not None:
+            response.headers.update(decision.headers())
+
+    # 🔥 相同问题并发到达时只计算一次（single-flight）
+    try:
+        (result, etag), shared = await qa_flights.do(
+            cache_key,
+            lambda: _compute_answer(req_id, cache_key, query, top_k, language, deadline, filters),
+            request.is_disconnected
+        )
+    except ClientDisconnected:
+        logger.warning(f"[{req_id}] 🔌 客户端已断开，取消请求")
+        return Response(status_code=499)
+    except Overloaded as e:
+        return _overloaded_response(req_id, e)
+    except Exception as e:
+        ERRORS.inc(stage="pipeline")
+        logger.error(f"[{req_id}] 💥 所有尝试失败: {e}")
         # 🔥 降级：返回友好错误而不是抛出异常
         return {
             "intent": "error",
-            "answer": f"抱歉，服务暂时不可用。错误信息：{str(last_exc)[:200]}",
+            "answer": f"抱歉，服务暂时不可用。错误信息：{str(e)[:200]}",
             "citations": [],
             "reranked": [],
             "rewritten_queries": [],
@@ -231,6 +576,69 @@ async def _handle_qa(
             "language": language
         }
 
+    if shared:
+        logger.info(f"[{req_id}] 🔗 复用进行中的相同请求结果")
+
+    timings = _timing_breakdown(result, start, cache_hit=False)
+    response.headers["Server-Timing"] = _server_timing(timings)
+    if etag:
+        response.headers["ETag"] = etag
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={
+                "ETag": etag, "X-Request-ID": req_id, "Server-Timing": _server_timing(timings)
+            })
+
+    return _json_response(response, _build_qa_response(
+        result, req_id, language, start, cache_hit=False,
+        timings=timings if debug_timings else None, verbose=verbose, fields=fields
+    ))
+
+def _cacheable(result: Dict[str, Any]) -> bool:
+    """LLM 降级（返回上下文原文）、因截止时间缩减过或出错的结果不缓存"""
+    return not result.get("degraded") and not result.get("skipped_stages") and result.get("intent") != "error"
+
+async def _compute_answer(
+    req_id: str,
+    cache_key: str,
+    query: str,
+    top_k: int,
+    language: str,
+    deadline: Deadline,
+    filters: Optional[Dict[str, Tuple[str, ...]]] = None
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    执行 answer_enhanced（带重试）并写入缓存，返回 (结果, ETag)；过载时抛出 Overloaded
+
+    排队与重试都受 deadline 约束：剩余时间不够再跑一次时不再重试。
+    """
+    # 🔥 重试机制
+    last_exc = None
+    result = None
+    
+    # 🚦 准入控制：排队超时或队列已满时直接拒绝，不再调用 Groq
+    async with admission.admit(timeout=min(admission.queue_timeout, deadline.remaining())):
+        for attempt in range(1, RETRY_MAX + 1):
+            try:
+                logger.info(f"[{req_id}] 🔄 尝试 {attempt}/{RETRY_MAX}")
+                # 🔥 在执行池中运行，事件循环不被阻塞
+                result = await run_in_pool(
+                    answer_enhanced, query, top_k=top_k, language=language, deadline=deadline, filters=filters
+                )
+                logger.info(f"[{req_id}] ✅ 成功")
+                break
+            except Exception as e:
+                last_exc = e
+                logger.error(f"[{req_id}] ❌ 尝试 {attempt} 失败: {e}")
+                backoff = 0.5 * (2 ** (attempt - 1))
+                if attempt < RETRY_MAX:
+                    if not deadline.allows(backoff + LLM_MIN_BUDGET):
+                        deadline.skip("retry")
+                        break
+                    await asyncio.sleep(backoff)
+    
+    if result is None:
+        raise last_exc
+
     # 🔥 确保返回格式完整
     if not isinstance(result, dict):
         result = {
@@ -246,23 +654,349 @@ async def _handle_qa(
     result.setdefault("reranked", [])
     result.setdefault("rewritten_queries", [])
 
+    etag = answer_cache.set(cache_key, result) if _cacheable(result) else None
+
+    return result, etag
+
+def _slim_reranked(reranked: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """检索结果只保留标题 / 链接 / 分数，不带完整文档与章节"""
+    slim = []
+    for item in reranked:
+        doc = item.get("doc") or {}
+        slim.append({
+            "title": doc.get("title", ""),
+            "url": doc.get("url", ""),
+            "score": item.get("score", 0)
+        })
+    return slim
+
+def _json_response(response: Response, payload: Dict[str, Any]) -> Response:
+    """直接返回序列化好的响应（跳过 jsonable_encoder），并带上已设置的响应头"""
+    headers = {
+        k: v for k, v in response.headers.items()
+        if k not in ("content-length", "content-type")
+    }
+    return FastJSONResponse(payload, headers=headers)
+
+def _build_qa_response(
+    result: Dict[str, Any],
+    req_id: str,
+    language: str,
+    start: float,
+    cache_hit: bool,
+    timings: Optional[Dict[str, Any]] = None,
+    verbose: bool = False,
+    fields: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    answer_enhanced 结果 -> /api/qa 响应
+
+    默认 reranked 只含标题 / 链接 / 分数，verbose=True 时返回完整文档；
+    fields="answer,citations" 只返回指定字段（request_id 始终保留）；
+    timings 仅在 ?debug=timings 时附带。
+    """
     rt = f"{time.time() - start:.2f}s"
     logger.info(f"[{req_id}] ⏱️  完成: {rt}")
+    # 反馈只带 request_id，记下意图供统计归类
+    feedback_store.remember_intent(req_id, result.get("intent", "general"))
 
     # 🔥 返回完整响应（包含 num_queries）
-    return {
+    payload = {
         "intent": result.get("intent", "general"),
         "answer": result.get("answer", ""),
         "citations": result.get("citations", []),
-        "reranked": result.get("reranked", []),
+        "reranked": result.get("reranked", []) if verbose else _slim_reranked(result.get("reranked", [])),
         "rewritten_queries": result.get("rewritten_queries", []),
         "num_docs": len(result.get("reranked", [])),
         "num_queries": len(result.get("rewritten_queries", [])),
         "response_time": rt,
         "request_id": req_id,
         "model": os.getenv("MODEL_PROVIDER", "groq"),
-        "language": language
+        "language": language,
+        "cache_hit": cache_hit
+    }
+    if result.get("skipped_stages"):
+        # 为赶上截止时间跳过 / 缩减的阶段（如 web_search、llm）
+        payload["skipped_stages"] = result["skipped_stages"]
+    if timings is not None:
+        payload["timings"] = timings
+    if fields:
+        wanted = {f.strip() for f in fields.split(",") if f.strip()}
+        wanted.add("request_id")
+        payload = {k: v for k, v in payload.items() if k in wanted}
+    return payload
+
+@app.get("/api/qa/stream")
+async def api_qa_stream(
+    request: Request,
+    query: str = Query(..., min_length=1),
+    top_k: int = DEFAULT_TOP_K,
+    language: str = "auto"
+):
+    """
+    流式问答 (SSE)：先推送本地检索引用，再逐段推送 LLM 输出，最后推送元数据
+
+    事件：citations -> token ... -> done（出错时为 error）
+    """
+    req_id = new_request_id()
+    REQUESTS.inc(endpoint="qa_stream")
+    _validate_query(req_id, query)
+    top_k = max(1, min(top_k, MAX_TOP_K))
+    deadline = Deadline()
+
+    if language == "auto" or not language:
+        with timed("detect_language"):
+            language = detect_language(query)
+
+    logger.info(f"[{req_id}] 📡 Stream query: {query[:100]} | {language} | Top-K: {top_k}")
+
+    cached = None
+    if GROQ_API_KEY:
+        cached = answer_cache.get(answer_cache.make_key(query, language, top_k))
+        CACHE_REQUESTS.inc(result="hit" if cached is not None else "miss")
+
+    # 🚫 / 🚦 需要实际计算时先检查 LLM 额度与准入控制，在开始推流前返回 429 / 503
+    stream_headers = {
+        "X-Request-ID": req_id,
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
     }
+    admitted = False
+    if GROQ_API_KEY and cached is None:
+        decision, limited = _check_llm_budget(request, req_id)
+        if limited is not None:
+            return limited
+        if decision is not None:
+            stream_headers.update(decision.headers())
+        try:
+            await admission.acquire(timeout=min(admission.queue_timeout, deadline.remaining()))
+        except Overloaded as e:
+            return _overloaded_response(req_id, e)
+        admitted = True
+    admitted_at = time.monotonic()
+
+    def release_slot():
+        # 生成器的 finally 与响应结束后的后台任务都会调用，只释放一次
+        nonlocal admitted
+        if admitted:
+            admitted = False
+            admission.release(time.monotonic() - admitted_at)
+
+    async def event_stream():
+        start = time.time()
+        if not GROQ_API_KEY:
+            yield _sse("error", {
+                "msg": "⚠️ AI 服务未配置，请联系管理员设置 GROQ_API_KEY 环境变量",
+                "request_id": req_id
+            })
+            return
+
+        if cached is not None:
+            result = cached[0]
+            feedback_store.remember_intent(req_id, result.get("intent", "general"))
+            yield _sse("citations", {
+                "intent": result.get("intent", "general"),
+                "language": language,
+                "source": "cache",
+                "citations": result.get("citations", [])
+            })
+            yield _sse("token", {"text": result.get("answer", "")})
+            yield _sse("done", {
+                "intent": result.get("intent", "general"),
+                "language": language,
+                "num_docs": len(result.get("reranked", [])),
+                "web_search_used": result.get("web_search_used", False),
+                "cache_hit": True,
+                "request_id": req_id,
+                "response_time": f"{time.time() - start:.2f}s",
+                "model": os.getenv("MODEL_PROVIDER", "groq")
+            })
+            return
+
+        try:
+            async for item in iterate_in_pool(
+                answer_enhanced_stream, query, top_k=top_k, language=language, deadline=deadline
+            ):
+                data = item.get("data", {})
+                if item.get("event") == "done":
+                    feedback_store.remember_intent(req_id, data.get("intent", "general"))
+                    data["request_id"] = req_id
+                    data["response_time"] = f"{time.time() - start:.2f}s"
+                    data["model"] = os.getenv("MODEL_PROVIDER", "groq")
+                yield _sse(item.get("event", "message"), data)
+        except Exception as e:
+            ERRORS.inc(stage="pipeline")
+            logger.error(f"[{req_id}] ❌ Stream 失败: {e}")
+            yield _sse("error", {"msg": f"抱歉，服务暂时不可用。错误信息：{str(e)[:200]}", "request_id": req_id})
+        finally:
+            release_slot()
+            logger.info(f"[{req_id}] ⏱️  Stream 结束: {time.time() - start:.2f}s")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=stream_headers,
+        background=BackgroundTask(release_slot)
+    )
+
+@app.post("/api/qa/batch")
+async def api_qa_batch(req: BatchQARequest, request: Request):
+    """
+    批量问答：一次检索遍历处理所有问题，LLM 调用并发受限，结果按完成顺序以 NDJSON 流式返回
+
+    每行一个结果（带 index 与各自的 request_id），最后一行为 {"done": true, ...}
+    检索与每次 LLM 调用都经准入控制，且共用一个请求预算；检索时过载直接返回 503，
+    生成时排不上队的问题返回错误行。
+    """
+    req_id = new_request_id()
+    REQUESTS.inc(endpoint="qa_batch")
+    queries = req.queries or []
+
+    if not queries:
+        raise HTTPException(status_code=400, detail={"msg": "queries is required", "request_id": req_id})
+    if len(queries) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail={
+            "msg": f"too many queries (max {MAX_BATCH_SIZE})",
+            "request_id": req_id
+        })
+    for query in queries:
+        _validate_query(req_id, query)
+
+    if not GROQ_API_KEY:
+        raise HTTPException(status_code=503, detail={
+            "msg": "⚠️ AI 服务未配置，请联系管理员设置 GROQ_API_KEY 环境变量",
+            "request_id": req_id
+        })
+
+    top_k = max(1, min(req.top_k or DEFAULT_TOP_K, MAX_TOP_K))
+    language = req.language or "auto"
+    languages = [detect_language(q) if language == "auto" else language for q in queries]
+
+    # 批内相同问题只算一次
+    groups: Dict[str, List[int]] = {}
+    for i, (query, lang) in enumerate(zip(queries, languages)):
+        groups.setdefault(answer_cache.make_key(query, lang, top_k), []).append(i)
+
+    logger.info(f"[{req_id}] 📦 Batch: {len(queries)} 个问题 ({len(groups)} 个不同) | Top-K: {top_k}")
+
+    def _line(i: int, result: Dict[str, Any], start: float, cache_hit: bool) -> str:
+        item = _build_qa_response(result, f"{req_id}-{i}", languages[i], start, cache_hit=cache_hit)
+        item["index"] = i
+        item["query"] = queries[i]
+        return _dumps(item) + "\n"
+
+    def _error_line(i: int, exc: Exception) -> str:
+        return _dumps({
+            "index": i,
+            "query": queries[i],
+            "intent": "error",
+            "answer": f"抱歉，服务暂时不可用。错误信息：{str(exc)[:200]}",
+            "citations": [],
+            "request_id": f"{req_id}-{i}",
+            "language": languages[i]
+        }) + "\n"
+
+    start = time.time()
+    # 整个批次共用一个请求预算：排队、检索与各问题的生成都受它约束
+    deadline = Deadline()
+
+    # 1. 缓存查找
+    hits: List[Tuple[List[int], Dict[str, Any]]] = []
+    misses = []
+    for key, indices in groups.items():
+        cached = answer_cache.get(key)
+        CACHE_REQUESTS.inc(result="hit" if cached is not None else "miss")
+        if cached is None:
+            misses.append((key, indices))
+        else:
+            hits.append((indices, cached[0]))
+
+    # 2. 一次遍历完成所有未命中问题的检索（经准入控制；过载时整个请求返回 503）
+    plans: List[Dict[str, Any]] = []
+    retrieval_error: Optional[Exception] = None
+    if misses:
+        try:
+            async with admission.admit(timeout=min(admission.queue_timeout, deadline.remaining())):
+                plans = await run_in_pool(
+                    retrieve_batch,
+                    [queries[indices[0]] for _, indices in misses],
+                    top_k,
+                    [languages[indices[0]] for _, indices in misses],
+                    deadline
+                )
+        except Overloaded as e:
+            return _overloaded_response(req_id, e)
+        except Exception as e:
+            ERRORS.inc(stage="pipeline")
+            logger.error(f"[{req_id}] ❌ 批量检索失败: {e}")
+            retrieval_error = e
+
+    async def results():
+        for indices, result in hits:
+            for i in indices:
+                yield _line(i, result, start, cache_hit=True)
+
+        if retrieval_error is not None:
+            for _, indices in misses:
+                for i in indices:
+                    yield _error_line(i, retrieval_error)
+            pending = []
+        else:
+            # 🚫 每个需要生成的问题逐个消耗一个 LLM 额度：额度内的照常生成，超出的部分直接返回错误
+            pending = []
+            for (key, indices), plan in zip(misses, plans):
+                _, limited = _check_llm_budget(request, req_id)
+                if limited is None:
+                    pending.append((key, indices, plan))
+                    continue
+                exc = RuntimeError("rate limited: " + limited.headers.get("retry-after", "") + "s")
+                for i in indices:
+                    yield _error_line(i, exc)
+
+        if pending:
+            # 3. 并发受限地生成答案（每次 LLM 调用都经准入控制），谁先完成谁先返回
+            sem = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+            async def generate(key: str, indices: List[int], plan: Dict[str, Any]):
+                async with sem:
+                    try:
+                        async with admission.admit(timeout=min(admission.queue_timeout, deadline.remaining())):
+                            # 每个问题单独记录跳过的阶段，截止时间与整个批次一致
+                            result = await run_in_pool(
+                                answer_from_plan, {**plan, "deadline": Deadline(deadline.remaining())}
+                            )
+                    except Overloaded as e:
+                        return indices, None, e
+                    except Exception as e:
+                        ERRORS.inc(stage="pipeline")
+                        return indices, None, e
+                if _cacheable(result):
+                    answer_cache.set(key, result)
+                return indices, result, None
+
+            tasks = [asyncio.ensure_future(generate(*item)) for item in pending]
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    indices, result, err = await fut
+                    for i in indices:
+                        yield _error_line(i, err) if err else _line(i, result, start, cache_hit=False)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        logger.info(f"[{req_id}] ⏱️  Batch 完成: {time.time() - start:.2f}s")
+        yield _dumps({
+            "done": True,
+            "request_id": req_id,
+            "count": len(queries),
+            "response_time": f"{time.time() - start:.2f}s"
+        }) + "\n"
+
+    return StreamingResponse(
+        results(),
+        media_type="application/x-ndjson",
+        headers={"X-Request-ID": req_id, "Cache-Control": "no-cache"}
+    )
 
 @app.post("/api/feedback")
 async def feedback(payload: Feedback):
@@ -274,25 +1008,71 @@ async def feedback(payload: Feedback):
             time.gmtime()
         )
         
-        with open(FEEDBACK_LOG, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-        
-        logger.info(f"📝 Feedback: {entry.get('request_id')} - {entry.get('helpful')}")
-        return {"status": "ok"}
-    
+        # 🔥 只入队，由后台线程批量写盘
+        accepted = feedback_store.submit(entry)
     except Exception as e:
         logger.error(f"❌ Feedback 失败: {e}")
         raise HTTPException(status_code=500, detail="Failed to save feedback")
 
+    if not accepted:
+        raise HTTPException(status_code=503, detail="Feedback queue is full", headers={"Retry-After": "1"})
+    logger.info(f"📝 Feedback: {entry.get('request_id')} - {entry.get('helpful')}")
+    return {"status": "ok"}
+
+@app.get("/api/feedback/stats")
+async def feedback_stats(worst: int = Query(10, ge=0, le=100)):
+    """反馈统计：各意图的有用率与差评最多的请求（增量维护，不扫描日志）"""
+    return feedback_store.snapshot(worst)
+
+@app.post("/api/admin/reload-corpus")
+async def admin_reload_corpus(request: Request, force: bool = Query(False)):
+    """
+    热重载语料：后台构建新快照与索引后原子替换，进行中的查询继续使用旧快照
+
+    需要请求头 X-Admin-Token 与环境变量 QA_ADMIN_TOKEN 一致；未配置令牌时接口关闭。
+    """
+    token = request.headers.get("x-admin-token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        return _merge_reload_reports(await run_on_all_workers(reload_corpus, force=force))
+    except Exception as e:
+        logger.error(f"❌ 语料热重载失败: {e}")
+        raise HTTPException(status_code=500, detail="Corpus reload failed")
+
 # ============ 前端路由 ============
 
+@app.get("/assets/{path:path}")
+async def serve_assets(path: str, request: Request):
+    """构建产物：带哈希的文件长期缓存（immutable）"""
+    for root in ASSET_DIRS:
+        entry = await _static_entry(root, path)
+        if entry:
+            return _static_response(request, entry)
+    raise HTTPException(status_code=404, detail="Not found")
+
+@app.get("/public/data/{name}")
+async def serve_public_data(name: str, request: Request):
+    """语料 JSON：短缓存 + ETag，文件更新后自动失效"""
+    entry = await _static_entry(PUBLIC_DIR / "data", name, SHORT_CACHE) if name.endswith(".json") else None
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return _static_response(request, entry)
+
+@app.get("/public/{path:path}")
+async def serve_public(path: str, request: Request):
+    """public/ 下的其他静态文件"""
+    entry = await _static_entry(PUBLIC_DIR, path)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return _static_response(request, entry)
+
 @app.get("/")
-async def serve_frontend():
+async def serve_frontend(request: Request):
     """根路径：返回前端页面"""
-    frontend_file = _find_frontend_file()
-    
-    if frontend_file:
-        return FileResponse(str(frontend_file))
+    response = await _serve_index(request)
+    if response is not None:
+        return response
     
     return {
         "message": "UCL AI Assistant API",
@@ -303,15 +1083,15 @@ async def serve_frontend():
     }
 
 @app.get("/{full_path:path}")
-async def catch_all(full_path: str):
+async def catch_all(full_path: str, request: Request):
     """SPA 支持"""
     # 跳过 API 和静态资源
     if full_path.startswith(("api/", "assets/", "public/", "docs", "openapi.json")):
         raise HTTPException(status_code=404, detail="Not found")
     
-    frontend_file = _find_frontend_file()
-    if frontend_file:
-        return FileResponse(str(frontend_file))
+    response = await _serve_index(request)
+    if response is not None:
+        return response
     
     raise HTTPException(status_code=404, detail="Frontend not found")
 
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+admission.py - QA 准入控制（过载保护）
+并发上限 + 有界等待队列 + 排队截止时间：队列已满或在截止时间内拿不到名额的请求
+直接以 Overloaded 拒绝（API 层返回 503 + Retry-After），不再为已放弃的用户消耗 Groq 调用。
+导出：AdmissionController, Overloaded, get_admission_controller
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from scripts.metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTIONS
+from scripts.qa_executor import QA_MAX_INFLIGHT
+
+logger = logging.getLogger("admission")
+
+# ============ 配置 ============
+# 同时执行的 QA 计算数（默认与执行池 inflight 上限一致）
+QA_MAX_CONCURRENT = max(1, int(os.getenv("QA_MAX_CONCURRENT", str(QA_MAX_INFLIGHT))))
+# 等待队列长度；超过后新请求立即被拒绝
+QA_MAX_QUEUE = max(0, int(os.getenv("QA_MAX_QUEUE", str(QA_MAX_CONCURRENT * 4))))
+# 排队截止时间（秒）：超过后放弃等待
+QA_QUEUE_TIMEOUT = float(os.getenv("QA_QUEUE_TIMEOUT", "5"))
+# 平均处理时长的平滑系数（用于估算 Retry-After）
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(f"overloaded ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    异步准入控制器（单事件循环内使用）
+
+    名额释放时直接交给队首等待者（FIFO），不会被新到达的请求插队。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = QA_MAX_CONCURRENT,
+        max_queue: int = QA_MAX_QUEUE,
+        queue_timeout: float = QA_QUEUE_TIMEOUT,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+        self._service_time = 1.0  # 秒，EWMA
+        self.admitted = 0
+        self.rejected = 0
+
+    # ---------- 状态 ----------
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _update_gauges(self) -> None:
+        ADMISSION_ACTIVE.set(self._active)
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+
+    def retry_after(self) -> int:
+        """按当前队列长度与平均处理时长估算的重试等待（秒）"""
+        backlog = len(self._waiters) + self._active
+        return max(1, math.ceil(self._service_time * backlog / self.max_concurrent))
+
+    def _reject(self, reason: str) -> Overloaded:
+        self.rejected += 1
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        logger.warning(
+            f"🚦 拒绝请求 ({reason}): active={self._active} queue={len(self._waiters)}"
+        )
+        return Overloaded(reason, self.retry_after())
+
+    # ---------- 获取 / 释放 ----------
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """获取执行名额；无法在截止时间内获取时抛出 Overloaded"""
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self.admitted += 1
+            self._update_gauges()
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full")
+
+        timeout = self.queue_timeout if timeout is None else timeout
+        fut: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            if fut.done():
+                # 名额恰好在超时瞬间移交过来，照常使用
+                self.admitted += 1
+                return
+            fut.cancel()
+            raise self._reject("timeout")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已拿到名额但调用方被取消：交还
+                self.release(observe=False)
+            fut.cancel()
+            raise
+        finally:
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+            self._update_gauges()
+        self.admitted += 1
+
+    def release(self, elapsed: Optional[float] = None, observe: bool = True) -> None:
+        """释放名额（优先移交给等待者）；elapsed 用于更新平均处理时长"""
+        if observe and elapsed is not None:
+            self._service_time += SERVICE_TIME_ALPHA * (elapsed - self._service_time)
+
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                self._update_gauges()
+                return
+        self._active -= 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def admit(self, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """async with controller.admit(): ... —— 拿到名额后执行，结束后释放"""
+        await self.acquire(timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "queue_depth": len(self._waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_service_seconds": round(self._service_time, 3),
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """全局准入控制器（按环境变量配置）"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+answer_cache.py - QA 答案缓存
+进程内 LRU + TTL，可选 SQLite 磁盘层（重启后仍然有效）。
+键 = 规范化查询 + 语言 + top_k；public/data/*.json 变化时缓存整体失效。
+导出：AnswerCache, get_answer_cache, normalize_query, corpus_fingerprint
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+logger = logging.getLogger("answer_cache")
+
+# ============ 配置 ============
+ROOT = Path(__file__).resolve().parents[1]
+DATA_DIR = ROOT / "public" / "data"
+QA_CACHE_SIZE = int(os.getenv("QA_CACHE_SIZE", "1024"))
+QA_CACHE_TTL = float(os.getenv("QA_CACHE_TTL", "3600"))
+# 留空则不启用磁盘层，例如 QA_CACHE_SQLITE=logs/answer_cache.sqlite3
+QA_CACHE_SQLITE = os.getenv("QA_CACHE_SQLITE", "")
+# 检查语料指纹的最小间隔（秒），避免每次请求都 stat 文件
+FINGERPRINT_CHECK_INTERVAL = 5.0
+
+_TRAILING_PUNCT = re.compile(r"[\s?？!！。.,，、~～]+$")
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询：全角转半角、小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize("NFKC", query or "").lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    return _TRAILING_PUNCT.sub("", text)
+
+
+def corpus_fingerprint(data_dir: Path = DATA_DIR) -> str:
+    """语料指纹：data_dir 下所有 *.json 的文件名 / 大小 / 修改时间"""
+    h = hashlib.sha1()
+    for path in sorted(Path(data_dir).glob("*.json")):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        h.update(f"{path.name}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class AnswerCache:
+    """LRU + TTL 答案缓存（线程安全），可选 SQLite 持久层"""
+
+    def __init__(
+        self,
+        max_size: int = QA_CACHE_SIZE,
+        ttl: float = QA_CACHE_TTL,
+        sqlite_path: Optional[str] = None,
+        data_dir: Path = DATA_DIR,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data_dir = Path(data_dir)
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self._corpus = corpus_fingerprint(self.data_dir)
+        self._corpus_checked_at = time.monotonic()
+
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._open_sqlite(sqlite_path)
+
+    # ---------- SQLite 层 ----------
+    def _open_sqlite(self, sqlite_path: str) -> None:
+        try:
+            Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY, corpus TEXT NOT NULL, created REAL NOT NULL,"
+                " etag TEXT NOT NULL, value TEXT NOT NULL)"
+            )
+            # 清理旧语料版本的条目
+            db.execute("DELETE FROM answers WHERE corpus != ?", (self._corpus,))
+            self._db = db
+            logger.info(f"✅ 答案缓存磁盘层: {sqlite_path}")
+        except Exception as e:
+            logger.warning(f"⚠️ 答案缓存磁盘层不可用: {e}")
+            self._db = None
+
+    def _db_get(self, key: str) -> Optional[Tuple[float, str, Dict[str, Any]]]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT created, etag, value FROM answers WHERE key = ? AND corpus = ?",
+                (key, self._corpus),
+            ).fetchone()
+        except Exception as e:
+            logger.warning(f"⚠️ 读取磁盘缓存失败: {e}")
+            return None
+        if row is None:
+            return None
+        created, etag, value = row
+        # 磁盘中保存的是墙钟时间，转换为 monotonic 时间戳
+        age = time.time() - created
+        if age > self.ttl:
+            return None
+        return time.monotonic() - age, etag, json.loads(value)
+
+    def _db_set(self, key: str, etag: str, value: Dict[str, Any]) -> None:
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers (key, corpus, created, etag, value) VALUES (?, ?, ?, ?, ?)",
+                (key, self._corpus, time.time(), etag, json.dumps(value, ensure_ascii=False)),
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ 写入磁盘缓存失败: {e}")
+
+    # ---------- 失效 ----------
+    def _check_corpus(self) -> None:
+        """语料文件变化时清空缓存（调用方需持有锁）"""
+        now = time.monotonic()
+        if now - self._corpus_checked_at < FINGERPRINT_CHECK_INTERVAL:
+            return
+        self._corpus_checked_at = now
+
+        fingerprint = corpus_fingerprint(self.data_dir)
+        if fingerprint == self._corpus:
+            return
+
+        logger.info(f"🔄 语料已变化 ({self._corpus} -> {fingerprint})，清空答案缓存")
+        self._corpus = fingerprint
+        self._entries.clear()
+        if self._db is not None:
+            try:
+                self._db.execute("DELETE FROM answers WHERE corpus != ?", (fingerprint,))
+            except Exception as e:
+                logger.warning(f"⚠️ 清理磁盘缓存失败: {e}")
+
+    # ---------- 公共接口 ----------
+    @staticmethod
+    def make_key(query: str, language: str, top_k: int, filters: Optional[Mapping[str, Sequence[str]]] = None) -> str:
+        raw = f"{normalize_query(query)}\x1f{language}\x1f{top_k}"
+        if filters:
+            # 结构化字段过滤改变检索结果，需要进入缓存键（无过滤时键与之前一致）
+            raw += "\x1f" + ";".join(f"{field}={','.join(sorted(values))}" for field, values in sorted(filters.items()))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_etag(value: Dict[str, Any]) -> str:
+        payload = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+        # 弱 ETag：响应体中的 request_id / response_time 每次不同，但答案内容一致
+        return 'W/"' + hashlib.sha1(payload.encode("utf-8")).hexdigest()[:20] + '"'
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """命中时返回 (结果, ETag)"""
+        with self._lock:
+            self._check_corpus()
+
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._db_get(key)
+                if entry is not None:
+                    self._store(key, entry)
+
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2], entry[1]
+
+    def set(self, key: str, value: Dict[str, Any]) -> str:
+        """写入缓存并返回 ETag"""
+        etag = self.make_etag(value)
+        with self._lock:
+            self._check_corpus()
+            self._store(key, (time.monotonic(), etag, value))
+            self._db_set(key, etag, value)
+        return etag
+
+    def _store(self, key: str, entry: Tuple[float, str, Dict[str, Any]]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "corpus": self._corpus,
+                "disk": self._db is not None,
+            }
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """全局答案缓存（按环境变量配置）"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(sqlite_path=QA_CACHE_SQLITE or None)
+    return _answer_cache
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+corpus_store.py - 只读内存映射语料（多 worker 共享）
+语料与专业索引只构建一次，写成只读二进制文件；各 uvicorn worker 通过 mmap 打开，
+原始字节由操作系统页缓存共享，而不是每个进程各持一份文档列表与专业索引。
+
+每次构建写入一个新的世代目录（ARTIFACT_DIR/gen-<时间戳>/），完成后用 os.replace 原子替换
+指针文件 ARTIFACT_DIR/CURRENT；打开制品时解析一次指针，并在构建锁内映射该世代的全部文件，
+因此一个进程看到的文档、专业索引与附加表总是同一次构建的产物。旧世代保留 KEEP_GENERATIONS 个。
+
+世代目录内的文件：
+    docs.bin         每个文档的 UTF-8 JSON，首尾相接
+    doc_offsets.bin  int64 x (N+1)，第 i 个文档 = docs.bin[off[i]:off[i+1]]
+    keys.json        索引关键词（已排序）
+    post_offsets.bin int64 x (K+1)，关键词 k 的倒排 = postings[off[k]:off[k+1]]
+    postings.bin     int32 文档编号
+    embeddings.npy   可选，float32 N x D（需要 numpy，按 mmap_mode="r" 加载）
+    <附加表>          可选，由 ensure_artifact(extra=...) 通过 ArtifactWriter 写入：
+                     表（关键词 -> 若干等长数值列）、数值列、字符串序列、小型 JSON
+    manifest.json    源文件指纹与计数（含附加表的类型描述）
+
+附加表让检索索引（BM25F 倒排、段落、字段索引等）也随制品构建一次、各 worker 以 mmap 共享。
+导出：MappedCorpus, MappedTable, MappedStrings, ArtifactWriter, ensure_artifact, build_artifact,
+      source_fingerprint
+"""
+
+import os
+import json
+import mmap
+import shutil
+import hashlib
+import logging
+import time
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence
+
+try:
+    import fcntl
+    HAVE_FCNTL = True
+except ImportError:  # Windows：不加锁，由调用方保证只有一个进程构建
+    HAVE_FCNTL = False
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+logger = logging.getLogger("corpus_store")
+
+# ============ 配置 ============
+ROOT = Path(__file__).resolve().parents[1]
+ARTIFACT_DIR = Path(os.getenv("QA_CORPUS_ARTIFACT", str(ROOT / ".cache" / "corpus")))
+# 每个 worker 缓存的已解码文档数（解码后的对象不共享，用它限制单进程内存）
+DOC_CACHE_SIZE = int(os.getenv("QA_CORPUS_DOC_CACHE", "256"))
+# 保留的世代数（含当前）：刚解析到旧指针、还没来得及打开的进程仍能读到完整的旧世代
+KEEP_GENERATIONS = int(os.getenv("QA_CORPUS_GENERATIONS", "2"))
+FORMAT_VERSION = 4
+
+_POINTER = "CURRENT"
+
+
+def source_fingerprint(paths: Sequence[Path]) -> str:
+    """源文件指纹：文件名 / 大小 / 修改时间 + 格式版本"""
+    h = hashlib.sha1(f"v{FORMAT_VERSION};".encode("utf-8"))
+    for path in paths:
+        try:
+            st = Path(path).stat()
+        except OSError:
+            continue
+        h.update(f"{Path(path).name}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+_ITEMSIZE = {"q": 8, "i": 4, "f": 4, "b": 1}
+
+
+def _write_int_array(path: Path, typecode: str, values: Sequence[Any]) -> None:
+    arr = array(typecode, values)
+    if arr.itemsize != _ITEMSIZE[typecode]:
+        raise RuntimeError(f"unexpected itemsize for {typecode}: {arr.itemsize}")
+    with open(path, "wb") as f:
+        arr.tofile(f)
+
+
+class ArtifactWriter:
+    """
+    向构建目录写附加的只读数据（build_artifact 调用 extra(docs, writer)）
+
+    写入的文件与制品的其余部分在同一个世代目录中一起生效；describe() 的结果存进 manifest，打开时据此还原类型。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.files: List[str] = []
+        self._tables: Dict[str, str] = {}
+        self._columns: Dict[str, str] = {}
+        self._strings: List[str] = []
+        self._json: List[str] = []
+
+    def _file(self, name: str) -> Path:
+        self.files.append(name)
+        return self.path / name
+
+    def table(self, name: str, rows: Mapping[str, Sequence[Sequence[Any]]], typecodes: str) -> None:
+        """关键词 -> 每列一个序列（同一行的各列等长）；typecodes 每列一个类型码"""
+        keys = sorted(rows)
+        offsets = [0]
+        columns: List[array] = [array(tc) for tc in typecodes]
+        for key in keys:
+            values = rows[key]
+            for column, value in zip(columns, values):
+                column.extend(value)
+            offsets.append(len(columns[0]))
+        self._file(f"{name}.keys.json").write_text(json.dumps(keys, ensure_ascii=False), encoding="utf-8")
+        _write_int_array(self._file(f"{name}.offsets.bin"), "q", offsets)
+        for i, (tc, column) in enumerate(zip(typecodes, columns)):
+            _write_int_array(self._file(f"{name}.{i}.bin"), tc, column)
+        self._tables[name] = typecodes
+
+    def column(self, name: str, typecode: str, values: Sequence[Any]) -> None:
+        _write_int_array(self._file(f"{name}.bin"), typecode, values)
+        self._columns[name] = typecode
+
+    def strings(self, name: str, values: Sequence[str]) -> None:
+        offsets = [0]
+        with open(self._file(f"{name}.bin"), "wb") as f:
+            for value in values:
+                blob = value.encode("utf-8")
+                f.write(blob)
+                offsets.append(offsets[-1] + len(blob))
+        _write_int_array(self._file(f"{name}.offsets.bin"), "q", offsets)
+        self._strings.append(name)
+
+    def json(self, name: str, value: Any) -> None:
+        self._file(f"{name}.json").write_text(json.dumps(value, ensure_ascii=False), encoding="utf-8")
+        self._json.append(name)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"tables": self._tables, "columns": self._columns, "strings": self._strings, "json": self._json}
+
+
+def build_artifact(
+    docs: List[Dict],
+    index: Mapping[str, List[Dict]],
+    out_dir: Path,
+    fingerprint: str,
+    embeddings: Optional[Any] = None,
+    extra: Optional[Callable[[List[Dict], ArtifactWriter], None]] = None,
+) -> None:
+    """
+    把文档与索引写成一个新的世代目录，写完后原子替换 CURRENT 指针
+
+    index 的值是文档对象本身（与 _build_program_index 的输出一致），这里按对象身份换算成编号。
+    extra(docs, writer) 可写入附加表（见 ArtifactWriter）。
+    已打开旧世代的进程继续读旧文件，不受替换影响。
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=".build-", dir=out_dir))
+
+    try:
+        positions = {id(doc): i for i, doc in enumerate(docs)}
+
+        offsets = [0]
+        with open(tmp / "docs.bin", "wb") as f:
+            for doc in docs:
+                blob = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                f.write(blob)
+                offsets.append(offsets[-1] + len(blob))
+        _write_int_array(tmp / "doc_offsets.bin", "q", offsets)
+
+        keys = sorted(index)
+        post_offsets = [0]
+        postings: List[int] = []
+        for key in keys:
+            postings.extend(positions[id(doc)] for doc in index[key])
+            post_offsets.append(len(postings))
+        (tmp / "keys.json").write_text(json.dumps(keys, ensure_ascii=False), encoding="utf-8")
+        _write_int_array(tmp / "post_offsets.bin", "q", post_offsets)
+        _write_int_array(tmp / "postings.bin", "i", postings)
+
+        has_embeddings = embeddings is not None and HAVE_NUMPY
+        if has_embeddings:
+            np.save(tmp / "embeddings.npy", np.asarray(embeddings, dtype=np.float32))
+
+        writer = ArtifactWriter(tmp)
+        if extra is not None:
+            extra(docs, writer)
+
+        manifest = {
+            "version": FORMAT_VERSION,
+            "fingerprint": fingerprint,
+            "num_docs": len(docs),
+            "num_keys": len(keys),
+            "num_postings": len(postings),
+            "embeddings": has_embeddings,
+            "extra": writer.describe() if extra is not None else None,
+        }
+
+        (tmp / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+
+        # 整个目录改名为新世代，再原子替换指针：其他进程看到的要么是旧世代，要么是完整的新世代
+        generation = f"gen-{time.time_ns()}"
+        os.rename(tmp, out_dir / generation)
+        pointer = out_dir / f".{_POINTER}.tmp"
+        pointer.write_text(generation, encoding="utf-8")
+        os.replace(pointer, out_dir / _POINTER)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    _prune_generations(out_dir)
+
+    logger.info(f"📦 语料制品已构建: {out_dir} ({len(docs)} 文档, {len(keys)} 个索引键)")
+
+
+def _current_generation(out_dir: Path) -> Optional[Path]:
+    """CURRENT 指针指向的世代目录（尚未构建时为 None）"""
+    try:
+        name = (Path(out_dir) / _POINTER).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return Path(out_dir) / name if name else None
+
+
+def _read_manifest(generation: Optional[Path]) -> Optional[Dict[str, Any]]:
+    if generation is None:
+        return None
+    try:
+        return json.loads((generation / "manifest.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _prune_generations(out_dir: Path, keep: int = KEEP_GENERATIONS) -> None:
+    """删除最旧的世代目录（只保留最新的 keep 个；已映射的文件在进程解除映射前仍可读）"""
+    generations = sorted(
+        (p for p in Path(out_dir).glob("gen-*") if p.is_dir()),
+        key=lambda p: int(p.name[4:]) if p.name[4:].isdigit() else 0
+    )
+    for old in generations[:-max(1, keep)]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+@contextmanager
+def _build_lock(out_dir: Path) -> Iterator[None]:
+    """跨进程互斥：同一时间只有一个 worker 构建制品，其余等待后直接打开"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if not HAVE_FCNTL:
+        yield
+        return
+    with open(out_dir / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def ensure_artifact(
+    sources: Sequence[Path],
+    load_docs: Callable[[], List[Dict]],
+    build_index: Callable[[List[Dict]], Mapping[str, List[Dict]]],
+    out_dir: Path = ARTIFACT_DIR,
+    embed: Optional[Callable[[List[Dict]], Any]] = None,
+    extra: Optional[Callable[[List[Dict], ArtifactWriter], None]] = None,
+) -> "MappedCorpus":
+    """
+    打开与源文件匹配的制品；不存在或已过期时（持锁）重新构建
+
+    embed(docs) 返回 N x D 向量时一并写入 embeddings.npy；extra 见 build_artifact。
+    需要 embeddings / 附加表而现有制品没有时同样重建（重建时两者都要传入，否则会丢失）。
+    制品在锁内打开（映射全部文件），不会与其他 worker 的重建交错。
+    """
+    out_dir = Path(out_dir)
+    fingerprint = source_fingerprint(sources)
+
+    with _build_lock(out_dir):
+        manifest = _read_manifest(_current_generation(out_dir))
+        stale = manifest is None or manifest.get("fingerprint") != fingerprint
+        missing_embeddings = embed is not None and not (manifest or {}).get("embeddings")
+        missing_extra = extra is not None and not (manifest or {}).get("extra")
+        if stale or missing_embeddings or missing_extra:
+            docs = load_docs()
+            embeddings = None
+            if embed is not None:
+                try:
+                    embeddings = embed(docs)
+                except Exception as e:
+                    logger.warning(f"⚠️ 语义向量计算失败，制品不含 embeddings: {e}")
+            build_artifact(docs, build_index(docs), out_dir, fingerprint, embeddings, extra)
+        return MappedCorpus(out_dir)
+
+
+class MappedDocs(Sequence):
+    """按编号懒解码的文档序列（只读）；已解码文档放在有界 LRU 中"""
+
+    def __init__(self, blob: mmap.mmap, offsets: memoryview, cache_size: int = DOC_CACHE_SIZE) -> None:
+        self._blob = blob
+        self._offsets = offsets
+        self._cache: "OrderedDict[int, Dict]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        with self._lock:
+            doc = self._cache.get(i)
+            if doc is not None:
+                self._cache.move_to_end(i)
+                return doc
+
+        doc = json.loads(self._blob[self._offsets[i]:self._offsets[i + 1]])
+        if self._cache_size > 0:
+            with self._lock:
+                self._cache[i] = doc
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return doc
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class MappedStrings(Sequence):
+    """按编号懒解码的字符串序列（只读，不缓存）"""
+
+    def __init__(self, blob, offsets: memoryview) -> None:
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+
+class MappedTable(Mapping):
+    """关键词 -> 各列在该关键词下的切片（memoryview 元组），与内存中的 {关键词: (array, ...)} 用法一致"""
+
+    def __init__(self, keys: List[str], offsets: memoryview, columns: Sequence[memoryview]) -> None:
+        self._keys = keys
+        self._offsets = offsets
+        self._columns = tuple(columns)
+
+    def _position(self, key: str) -> int:
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return -1
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self._position(key) >= 0
+
+    def __getitem__(self, key: str) -> tuple:
+        i = self._position(key)
+        if i < 0:
+            raise KeyError(key)
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return tuple(column[start:end] for column in self._columns)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class MappedIndex(Mapping):
+    """关键词 -> 文档列表；倒排表为 mmap 中的 int32 编号，取值时才换成文档"""
+
+    def __init__(self, keys: List[str], offsets: memoryview, postings: memoryview, docs: MappedDocs) -> None:
+        self._keys = keys
+        self._offsets = offsets
+        self._postings = postings
+        self._docs = docs
+
+    def _position(self, key: str) -> int:
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return -1
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self._position(key) >= 0
+
+    def __getitem__(self, key: str) -> List[Dict]:
+        i = self._position(key)
+        if i < 0:
+            raise KeyError(key)
+        return [self._docs[d] for d in self._postings[self._offsets[i]:self._offsets[i + 1]]]
+
+    def ids(self, key: str) -> List[int]:
+        """关键词对应的文档编号（不解码文档）"""
+        i = self._position(key)
+        if i < 0:
+            return []
+        return list(self._postings[self._offsets[i]:self._offsets[i + 1]])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class MappedCorpus:
+    """
+    只读打开制品的当前世代
+
+    构造时解析一次 CURRENT 指针（path 为该世代目录），并立即映射其中全部 .bin、读入全部 .json，
+    之后的 table / column / strings / json 都只读这些已打开的数据，不再按文件名访问磁盘。
+    """
+
+    def __init__(self, out_dir: Path = ARTIFACT_DIR) -> None:
+        self.root = Path(out_dir)
+        self.path = _current_generation(self.root)
+        self.manifest = _read_manifest(self.path)
+        if self.manifest is None:
+            raise FileNotFoundError(f"corpus artifact not built: {self.root}")
+
+        self._maps: Dict[str, Any] = {}
+        self._texts: Dict[str, str] = {}
+        for name in os.listdir(self.path):
+            if name.endswith(".bin"):
+                self._maps[name] = self._map(name)
+            elif name.endswith(".json"):
+                self._texts[name] = (self.path / name).read_text(encoding="utf-8")
+
+        self.docs = MappedDocs(self._maps["docs.bin"], self._view("doc_offsets.bin", "q"))
+        keys = json.loads(self._texts["keys.json"])
+        self.index = MappedIndex(keys, self._view("post_offsets.bin", "q"), self._view("postings.bin", "i"), self.docs)
+
+        self.embeddings = None
+        if self.manifest.get("embeddings") and HAVE_NUMPY:
+            self.embeddings = np.load(self.path / "embeddings.npy", mmap_mode="r")
+
+    @property
+    def extra(self) -> Optional[Dict[str, Any]]:
+        """附加表的描述（构建时未传 extra 则为 None）"""
+        return self.manifest.get("extra")
+
+    def _view(self, name: str, typecode: str) -> memoryview:
+        return memoryview(self._maps[name]).cast(typecode)
+
+    def table(self, name: str) -> MappedTable:
+        typecodes = self.extra["tables"][name]
+        keys = json.loads(self._texts[f"{name}.keys.json"])
+        columns = [self._view(f"{name}.{i}.bin", tc) for i, tc in enumerate(typecodes)]
+        return MappedTable(keys, self._view(f"{name}.offsets.bin", "q"), columns)
+
+    def column(self, name: str) -> memoryview:
+        return self._view(f"{name}.bin", self.extra["columns"][name])
+
+    def strings(self, name: str) -> MappedStrings:
+        return MappedStrings(self._maps[f"{name}.bin"], self._view(f"{name}.offsets.bin", "q"))
+
+    def json(self, name: str) -> Any:
+        return json.loads(self._texts[f"{name}.json"])
+
+    def _map(self, name: str):
+        with open(self.path / name, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+deadline.py - 端到端请求截止时间与各阶段时间预算
+请求进入 API 时创建一个 Deadline，沿 answer_enhanced -> search_web / chat_with_groq 传递。
+每个阶段开始前按剩余时间决定自己的超时：剩余不足时跳过网络搜索、缩短上下文，
+最终来不及调用 LLM 时直接返回上下文原文（degraded），保证整个请求有确定的上限。
+导出：Deadline, DeadlineExceeded, REQUEST_BUDGET
+"""
+
+import os
+import time
+import logging
+from typing import Callable, List, Optional
+
+from scripts.metrics import DEADLINE_SKIPS, count
+
+logger = logging.getLogger("deadline")
+
+# ============ 配置 ============
+# 单个请求的总时间预算（秒）：从进入 API（含排队）到返回答案
+REQUEST_BUDGET = float(os.getenv("QA_REQUEST_BUDGET", "12"))
+# 网络搜索最多使用的时间（秒）；同时要给 LLM 留出 LLM_RESERVE
+WEB_SEARCH_MAX = float(os.getenv("QA_WEB_SEARCH_BUDGET", "4"))
+WEB_SEARCH_MIN = 1.0
+# 为 LLM 预留的时间：剩余时间少于它时不再做网络搜索
+LLM_RESERVE = float(os.getenv("QA_LLM_RESERVE", "5"))
+# 一次 LLM 调用至少需要的时间；不足时不再调用 / 不再重试
+LLM_MIN_BUDGET = float(os.getenv("QA_LLM_MIN_BUDGET", "2"))
+# 剩余时间低于该值时缩短上下文与输出长度
+LLM_TIGHT_BUDGET = float(os.getenv("QA_LLM_TIGHT_BUDGET", "5"))
+
+
+class DeadlineExceeded(Exception):
+    """剩余时间不足以执行某个阶段"""
+
+    def __init__(self, stage: str, remaining: float) -> None:
+        super().__init__(f"deadline exceeded before {stage} ({remaining:.2f}s left)")
+        self.stage = stage
+        self.remaining = remaining
+
+
+class Deadline:
+    """绝对截止时间（monotonic）；skipped 记录本请求被跳过 / 降级的阶段"""
+    __slots__ = ("expires_at", "budget", "skipped", "_clock")
+
+    def __init__(self, budget: float = REQUEST_BUDGET, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self.budget = budget
+        self.expires_at = clock() + budget
+        self.skipped: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, needed: float) -> bool:
+        return self.remaining() >= needed
+
+    def timeout(self, cap: Optional[float] = None, reserve: float = 0.0) -> float:
+        """本阶段可用的超时：剩余时间减去留给后续阶段的 reserve，不超过 cap"""
+        available = self.remaining() - reserve
+        if cap is not None:
+            available = min(available, cap)
+        return max(0.0, available)
+
+    def check(self, stage: str, needed: float = 0.0) -> None:
+        """剩余时间不足 needed 时抛出 DeadlineExceeded"""
+        remaining = self.remaining()
+        if remaining <= needed:
+            raise DeadlineExceeded(stage, remaining)
+
+    def skip(self, stage: str) -> None:
+        """记录一次因时间不足而跳过 / 降级的阶段"""
+        self.skipped.append(stage)
+        DEADLINE_SKIPS.inc(stage=stage)
+        count(f"skipped_{stage}")
+        logger.warning(f"⏳ 剩余 {self.remaining():.2f}s，跳过 {stage}")
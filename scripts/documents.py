@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+documents.py - 文档的规范化表示（加载时计算一次）
+专业（title + sections）与服务（name / service_name + description + services ...）两种结构
+统一成 NormDoc：清理空白后的原文、预先小写的标题与章节标题、分词结果与学位级别。
+检索热路径直接读这些字段，不再逐个查询重复 lower() / isinstance() / 分词。
+导出：NormDoc, NormSection, normalize_document, unify_document, document_title, detect_degree, domain_vocab
+"""
+
+import re
+from collections import Counter
+from typing import Any, Dict, FrozenSet, Iterable, List, Set, Tuple
+
+from scripts.text_index import tokenize
+
+# ============ 配置 ============
+# 标题末尾的学位缩写 -> 学位类别（MEng 等集成硕士按本科入学）
+DEGREE_SUFFIXES = {
+    "msc": "master", "ma": "master", "masc": "master", "mres": "master", "mphil": "master",
+    "march": "master", "mba": "master", "llm": "master", "mpa": "master", "mph": "master",
+    "bsc": "bachelor", "ba": "bachelor", "beng": "bachelor", "llb": "bachelor", "meng": "bachelor",
+    "mbbs": "bachelor", "mci": "bachelor", "msci": "bachelor", "bfa": "bachelor",
+    "phd": "doctorate", "mphil/phd": "doctorate", "edd": "doctorate", "engd": "doctorate",
+}
+_WHITESPACE = re.compile(r"\s+")
+_TITLE_WORD = re.compile(r"\b\w+\b|[\u4e00-\u9fff]+")
+# 服务文档中按顺序转成章节的字段
+_SERVICE_FIELDS = (
+    ("description", "Description"),
+    ("services", "Services"),
+    ("booking", "Booking"),
+    ("hours", "Opening hours"),
+    ("contact", "Contact"),
+)
+
+
+def _clean(text: Any) -> str:
+    if not isinstance(text, str):
+        return ""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _flatten(value: Any) -> str:
+    """服务字段（字符串 / 列表 / 字典）-> 一段文本"""
+    if isinstance(value, dict):
+        return "; ".join(f"{k.replace('_', ' ')}: {_flatten(v)}" for k, v in value.items() if v)
+    if isinstance(value, (list, tuple)):
+        return "; ".join(_flatten(v) for v in value if v)
+    return _clean(str(value)) if value is not None else ""
+
+
+def detect_degree(title: str, level: str = "") -> Tuple[str, str]:
+    """从 level 字段或标题首尾的缩写识别学位，返回 (缩写, 类别)，识别不出时为 ("", "")"""
+    for source in (level, title):
+        words = source.lower().split()
+        for word in words[-1:] + words[:1]:
+            if word in DEGREE_SUFFIXES:
+                return word, DEGREE_SUFFIXES[word]
+
+    level_lower = level.lower()
+    if "master" in level_lower or "postgraduate" in level_lower:
+        return "", "master"
+    if "bachelor" in level_lower or "undergraduate" in level_lower:
+        return "", "bachelor"
+    return "", ""
+
+
+class NormSection:
+    """一个章节：原文（已清理空白）+ 小写标题 + 词项"""
+    __slots__ = ("heading", "text", "heading_lower", "heading_tokens", "text_tokens", "heading_terms", "text_terms")
+
+    def __init__(self, heading: str, text: str) -> None:
+        self.heading = heading
+        self.text = text
+        self.heading_lower = heading.lower()
+        self.heading_tokens: Tuple[str, ...] = tuple(tokenize(heading, cache=False))
+        self.text_tokens: Tuple[str, ...] = tuple(tokenize(text, cache=False))
+        self.heading_terms: FrozenSet[str] = frozenset(self.heading_tokens)
+        self.text_terms: FrozenSet[str] = frozenset(self.text_tokens)
+
+
+class NormDoc:
+    """
+    规范化后的文档
+
+    doc 是统一结构的字典（title / url / type / sections，服务文档会生成这些字段），
+    检索结果与引用仍然返回它；其余字段只供检索使用。
+    """
+    __slots__ = ("doc", "title", "title_lower", "title_tokens", "url", "kind", "level", "degree", "sections")
+
+    def __init__(self, doc: Dict, title: str, sections: List[NormSection]) -> None:
+        self.doc = doc
+        self.title = title
+        self.title_lower = title.lower()
+        self.title_tokens: Tuple[str, ...] = tuple(tokenize(title, cache=False))
+        self.url = doc.get("url") or ""
+        self.kind = doc.get("type") or ""
+        self.level, self.degree = detect_degree(title, str(doc.get("level") or ""))
+        self.sections: Tuple[NormSection, ...] = tuple(sections)
+
+    def index_record(self) -> Dict[str, List[str]]:
+        """BM25F 建索引用的各字段词项（已分词）"""
+        headings: List[str] = []
+        texts: List[str] = []
+        for section in self.sections:
+            headings.extend(section.heading_tokens)
+            texts.extend(section.text_tokens)
+        return {"title": list(self.title_tokens), "heading": headings, "text": texts}
+
+
+def document_title(doc: Dict) -> str:
+    return _clean(doc.get("title") or doc.get("service_name") or doc.get("name") or "")
+
+
+def unify_document(doc: Dict) -> Dict:
+    """
+    原始文档 -> 统一结构（title / url / type / sections），不分词
+
+    专业文档原样返回（缺标题时补上）；服务文档把描述、服务项目、预约方式等字段转成已清理空白的章节。
+    """
+    title = document_title(doc)
+    if isinstance(doc.get("sections"), list):
+        return doc if doc.get("title") else {**doc, "title": title}
+
+    sections = []
+    for field, heading in _SERVICE_FIELDS:
+        text = _flatten(doc.get(field))
+        if text:
+            sections.append({"heading": heading, "text": text})
+    return {**doc, "title": title, "type": doc.get("type") or "service", "sections": sections}
+
+
+def normalize_document(doc: Dict) -> NormDoc:
+    """原始文档（专业或服务）-> NormDoc"""
+    unified = unify_document(doc)
+    sections = [
+        NormSection(_clean(s.get("heading") or ""), _clean(s.get("text") or ""))
+        for s in unified["sections"] if isinstance(s, dict)
+    ]
+    return NormDoc(unified, document_title(unified), sections)
+
+
+def domain_vocab(docs: Iterable[Dict]) -> Set[str]:
+    """领域词汇：在多个标题中出现、长度大于 2 的标题词（含中文词）"""
+    counter: Counter = Counter()
+    for doc in docs:
+        if not doc or not isinstance(doc, dict):
+            continue
+        title = doc.get("title") or doc.get("service_name") or doc.get("name") or ""
+        if isinstance(title, str):
+            counter.update(_TITLE_WORD.findall(title.lower()))
+    return {token for token, freq in counter.items() if freq > 1 and len(token) > 2}
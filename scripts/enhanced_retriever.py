@@ -11,15 +11,21 @@ enhanced_retriever.py - 启动时预计算版本
 
 import os
 import json
+import heapq
 import logging
 import math
 import re
 import time
-from collections import Counter
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 import numpy as np
 
+from scripts.documents import NormDoc, NormSection, domain_vocab, normalize_document
+from scripts.segmenter import HAVE_JIEBA, get_segmenter
+from scripts.text_index import tokenize
+
 # ============================================================================
 # 日志配置
 # ============================================================================
@@ -38,17 +44,18 @@ except Exception as e:
     HAVE_SEMANTIC = False
     logger.warning(f"⚠️ sentence-transformers 不可用: {e}")
 
-try:
-    import jieba
-    HAVE_JIEBA = True
+if HAVE_JIEBA:
     logger.info("✅ jieba 加载成功")
-except Exception:
-    HAVE_JIEBA = False
+else:
     logger.warning("⚠️ jieba 不可用，使用正则分词")
 
 # ============================================================================
 # 配置常量
 # ============================================================================
+# 规范化文档缓存的条目上限（LRU；mmap 模式下每次访问都会解码出新的 dict）
+NORM_CACHE_SIZE = int(os.getenv("QA_NORM_CACHE_SIZE", "4096"))
+
+
 class ScoringConfig:
     """评分权重配置"""
     KEYWORD_IN_TITLE = 14
@@ -81,9 +88,50 @@ class CommonPhrases:
     }
 
 
+# 各意图优先的章节标题关键词（关键词检索用）
+INTENT_HEADINGS = {
+    "modules": ("module", "curriculum", "syllabus", "compulsory", "optional"),
+    "requirements": ("entry", "requirement", "admission", "qualification"),
+    "fees": ("fee", "tuition", "cost", "scholarship"),
+    "career": ("career", "employment", "prospect"),
+    "services": ("service", "support", "counseling"),
+}
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """得分最高的 k 个下标（降序）：argpartition 选出 k 个再只对它们排序，O(n + k log k)"""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.size:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
 # ============================================================================
 # 主类 - 启动时预计算版本
 # ============================================================================
+class _KeyedDocs(Mapping):
+    """url -> 文档（按需从 documents 中取出，不在进程内展开）"""
+
+    def __init__(self, documents: Sequence[Dict], positions: Dict[str, int]) -> None:
+        self._documents = documents
+        self._positions = positions
+
+    def __getitem__(self, url: str) -> Dict:
+        return self._documents[self._positions[url]]
+
+    def __contains__(self, url) -> bool:
+        return url in self._positions
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
 class EnhancedRetriever:
     """增强版检索器 - 启动时预计算版本"""
 
@@ -109,6 +157,12 @@ class EnhancedRetriever:
         # 文档索引（用于快速查找）
         self._doc_index: Dict[str, Dict] = {}  # key: doc_url, value: doc
         
+        # 外部提供的文档向量矩阵（如多 worker 共享的 mmap），(urls, matrix)
+        self._doc_matrix: Optional[Tuple[List[str], np.ndarray]] = None
+        
+        # 规范化文档缓存（LRU）：url（无 url 时用标题）-> (doc, NormDoc)
+        self._norm_cache: "OrderedDict[str, Tuple[Dict, NormDoc]]" = OrderedDict()
+        
         # 领域词汇
         self.domain_vocab = self._build_domain_vocab()
         
@@ -186,9 +240,10 @@ class EnhancedRetriever:
                 normalize_embeddings=True  # L2 归一化，加速相似度计算
             )
             
-            # 存入缓存
+            # 存入缓存（矩阵在下次检索时重建）
             for url, emb in zip(urls, embeddings):
                 self._doc_embeddings_cache[url] = emb
+            self._doc_matrix = None
             
             elapsed = time.time() - start_time
             logger.info(f"✅ 预计算完成: {len(self._doc_embeddings_cache)} 个文档，耗时 {elapsed:.2f}s")
@@ -197,6 +252,85 @@ class EnhancedRetriever:
         except Exception as e:
             logger.error(f"❌ 批量预计算失败: {e}", exc_info=True)
 
+    def embed_documents(self, documents: List[Dict], batch_size: int = 32) -> Optional[np.ndarray]:
+        """
+        计算与 documents 逐行对齐的 N x D 向量（L2 归一化），用于写入共享语料制品
+
+        语义模型不可用时返回 None。
+        """
+        if not self.enable_semantic or self.semantic_model is None:
+            return None
+        texts = [self._extract_doc_text(doc) if isinstance(doc, dict) else "" for doc in documents]
+        return self.semantic_model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            normalize_embeddings=True
+        )
+
+    def attach_embeddings(
+        self,
+        documents: Sequence[Dict],
+        matrix: np.ndarray,
+        keys: Optional[Sequence[str]] = None
+    ) -> None:
+        """
+        🔥 直接使用外部向量矩阵（行与 documents 对齐），不再逐文档复制
+
+        矩阵可以是 np.load(..., mmap_mode="r") 的结果，多个 worker 共享同一份物理内存。
+        keys 为各文档的 url（缺省为标题）；给出时不遍历 documents，文档按需取出
+        （documents 可以是共享语料制品的 MappedDocs）。
+        """
+        if keys is None:
+            keys = [
+                (doc.get("url", "") or doc.get("title", "")) if isinstance(doc, dict) else ""
+                for doc in documents
+            ]
+        urls = list(keys)
+        positions = {}
+        for i, (url, emb) in enumerate(zip(urls, matrix)):
+            if url:
+                positions[url] = i
+                self._doc_embeddings_cache[url] = emb
+        self._doc_index = _KeyedDocs(documents, positions)
+        self._doc_matrix = (urls, matrix)
+        logger.info(f"✅ 已挂载共享 embeddings: {matrix.shape}")
+
+    def _embedding_matrix(self) -> Tuple[List[str], np.ndarray]:
+        """(urls, 文档向量矩阵)；优先使用挂载的共享矩阵，否则由缓存构建一次"""
+        if self._doc_matrix is None:
+            urls = list(self._doc_embeddings_cache.keys())
+            self._doc_matrix = (urls, np.array([self._doc_embeddings_cache[url] for url in urls]))
+        return self._doc_matrix
+
+    @property
+    def semantic_ready(self) -> bool:
+        """语义模型已加载且文档向量已就绪"""
+        return self.enable_semantic and self.semantic_model is not None and bool(self._doc_embeddings_cache)
+
+    def semantic_scores(self, queries: List[str], top_k: int) -> List[List[Tuple[str, float]]]:
+        """
+        批量语义检索，只返回 [(文档 url, 余弦相似度)]（不提取章节），供与关键词检索融合
+
+        一次矩阵乘法算出所有查询对所有文档的相似度；语义不可用的查询返回空列表。
+        """
+        all_hits: List[List[Tuple[str, float]]] = [[] for _ in queries]
+        if not queries or not self.semantic_ready:
+            return all_hits
+        
+        query_embeddings = self.encode_queries(queries)
+        valid = [i for i, emb in enumerate(query_embeddings) if emb is not None]
+        if not valid:
+            return all_hits
+        
+        urls, doc_matrix = self._embedding_matrix()
+        # (num_queries, dim) x (dim, num_docs) -> (num_queries, num_docs)
+        similarities = np.stack([query_embeddings[i] for i in valid]) @ doc_matrix.T
+        for row, qi in enumerate(valid):
+            all_hits[qi] = self._semantic_hits(similarities[row], urls, top_k)
+        return all_hits
+
     def search_with_context(
         self, 
         query: str, 
@@ -262,34 +396,16 @@ class EnhancedRetriever:
                 return []
             
             # 2. 计算所有文档的相似度（向量化计算，极快）
-            urls = list(self._doc_embeddings_cache.keys())
-            doc_embeddings = np.array([self._doc_embeddings_cache[url] for url in urls])
+            urls, doc_embeddings = self._embedding_matrix()
             
             # 🔥 批量计算余弦相似度（已归一化，直接点积）
             similarities = np.dot(doc_embeddings, query_embedding)
             
             # 3. 获取 top_k
-            top_indices = np.argsort(similarities)[::-1][:top_k * 2]  # 取 2 倍，过滤后再截断
-            
-            results = []
-            for idx in top_indices:
-                sim = float(similarities[idx])
-                if sim < 0.1:  # 过滤低分
-                    continue
-                
-                url = urls[idx]
-                doc = self._doc_index.get(url)
-                if not doc:
-                    continue
-                
-                results.append({
-                    'doc': doc,
-                    'score': sim * 100,  # 归一化到 0-100
-                    'matched_sections': self._find_relevant_sections(doc, query)
-                })
+            results = self._semantic_results(similarities, urls, query, top_k)
             
             logger.info(f"✅ 缓存语义搜索完成: {len(results)} 个结果")
-            return results[:top_k]
+            return results
         
         except Exception as e:
             logger.error(f"❌ 缓存语义搜索失败: {e}", exc_info=True)
@@ -315,6 +431,86 @@ class EnhancedRetriever:
             logger.error(f"❌ 查询编码失败: {e}")
             return None
 
+    def encode_queries(self, queries: List[str], batch_size: int = 32) -> List[Optional[np.ndarray]]:
+        """
+        🔥 批量编码查询（带缓存）：未命中缓存的查询一次性送入模型
+
+        Returns:
+            与 queries 对齐的 embedding 列表（失败为 None）
+        """
+        if not self.enable_semantic or self.semantic_model is None:
+            return [None] * len(queries)
+        
+        missing = [q for q in dict.fromkeys(queries) if q not in self._query_embedding_cache]
+        if missing:
+            try:
+                embeddings = self.semantic_model.encode(
+                    missing,
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=False
+                )
+                for q, emb in zip(missing, embeddings):
+                    self._query_embedding_cache[q] = emb
+            except Exception as e:
+                logger.error(f"❌ 批量查询编码失败: {e}")
+        
+        return [self._query_embedding_cache.get(q) for q in queries]
+
+    def batch_search(self, queries: List[str], top_k: int = 5) -> List[List[Dict]]:
+        """
+        🔥 批量语义搜索：一次矩阵乘法算出所有查询对所有文档的相似度
+
+        Returns:
+            与 queries 对齐的结果列表（语义不可用时为空列表）
+        """
+        if not queries:
+            return []
+        
+        all_results = [
+            [
+                {
+                    'doc': self._doc_index[url],
+                    'score': sim * 100,
+                    'matched_sections': self._find_relevant_sections(self._doc_index[url], query)
+                }
+                for url, sim in hits
+            ]
+            for query, hits in zip(queries, self.semantic_scores(queries, top_k))
+        ]
+        
+        logger.info(f"✅ 批量语义搜索完成: {len(queries)} 个查询")
+        return all_results
+
+    def _semantic_results(self, similarities: np.ndarray, urls: List[str], query: str, top_k: int) -> List[Dict]:
+        """
+        相似度 -> 前 top_k 个结果（只为最终结果提取相关章节）
+        """
+        results = []
+        for url, sim in self._semantic_hits(similarities, urls, top_k):
+            doc = self._doc_index[url]
+            results.append({
+                'doc': doc,
+                'score': sim * 100,  # 归一化到 0-100
+                'matched_sections': self._find_relevant_sections(doc, query)
+            })
+        return results
+
+    def _semantic_hits(self, similarities: np.ndarray, urls: List[str], top_k: int) -> List[Tuple[str, float]]:
+        """相似度 -> 前 top_k 个 (url, 相似度)；argpartition 取 2 倍候选，过滤低分与缺失文档后截断"""
+        hits = []
+        for idx in _top_indices(similarities, top_k * 2):
+            sim = float(similarities[idx])
+            if sim < 0.1:  # 过滤低分（候选已降序，后面的更低）
+                break
+            if urls[idx] not in self._doc_index:
+                continue
+            hits.append((urls[idx], sim))
+            if len(hits) == top_k:
+                break
+        return hits
+
     def _extract_doc_text(self, doc: Dict) -> str:
         """提取文档文本用于 embedding"""
         text_parts = []
@@ -344,30 +540,38 @@ class EnhancedRetriever:
         
         return " ".join(text_parts)
 
+    def _normalized(self, doc: Dict) -> NormDoc:
+        """
+        文档的规范化表示
+
+        按 url 缓存而不是 id(doc)：mmap 模式下同一文档每次访问都是新解码的 dict。
+        命中时再比较文档内容，语料重载后同一 url 的旧记录不会被复用。
+        """
+        key = doc.get("url") or doc.get("title") or ""
+        cached = self._norm_cache.get(key)
+        if cached is not None and (cached[0] is doc or cached[0] == doc):
+            self._norm_cache.move_to_end(key)
+            return cached[1]
+        norm = normalize_document(doc)
+        self._norm_cache[key] = (doc, norm)
+        self._norm_cache.move_to_end(key)
+        while len(self._norm_cache) > NORM_CACHE_SIZE:
+            self._norm_cache.popitem(last=False)
+        return norm
+
     def _find_relevant_sections(self, doc: Dict, query: str) -> List[Dict]:
-        """找到相关的 sections"""
+        """找到相关的 sections（按预先分好的章节词项匹配）"""
         relevant = []
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
-        
-        sections = doc.get("sections", [])
-        if not sections or not isinstance(sections, list):
-            return []
+        query_terms = set(tokenize(query))
         
-        for section in sections[:20]:
-            if not isinstance(section, dict):
-                continue
-            
-            heading = section.get("heading", "").lower()
-            text = section.get("text", "").lower()
-            
+        for section in self._normalized(doc).sections[:20]:
             # 计算关键词匹配度
-            matches = sum(1 for word in query_words if len(word) > 2 and (word in heading or word in text))
+            matches = sum(1 for term in query_terms if term in section.heading_terms or term in section.text_terms)
             
             if matches > 0:
                 relevant.append({
-                    "heading": section.get("heading", ""),
-                    "text": section.get("text", "")[:500],
+                    "heading": section.heading,
+                    "text": section.text[:500],
                     "score": matches
                 })
         
@@ -385,21 +589,33 @@ class EnhancedRetriever:
             logger.warning("⚠️ 未提取到有效关键词")
             return []
         
-        scored_docs = []
-        for doc in documents:
+        # 每个关键词（可能是短语）分词一次，供所有文档复用
+        keyword_terms = [(kw, tuple(tokenize(kw))) for kw in keywords]
+        
+        # 有界最小堆保留前 top_k：(得分, -序号, 文档, 章节得分)，序号保证同分时先出现的优先
+        heap: List[Tuple[float, int, Dict, List[Tuple[float, int]]]] = []
+        for position, doc in enumerate(documents):
             if not doc or not isinstance(doc, dict):
                 continue
             
-            score_result = self._score_document(doc, keywords, intent)
-            if score_result["score"] > 0:
-                scored_docs.append({
-                    "doc": doc,
-                    "score": score_result["score"],
-                    "matched_sections": score_result.get("matched_sections", [])
-                })
-        
-        scored_docs.sort(key=lambda x: x["score"], reverse=True)
-        return scored_docs[:top_k]
+            score, section_scores = self._score_document(doc, keyword_terms, intent)
+            if score <= 0:
+                continue
+            entry = (score, -position, doc, section_scores)
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+        
+        # 只为最终结果生成章节片段
+        return [
+            {
+                "doc": doc,
+                "score": score,
+                "matched_sections": self._matched_sections(doc, section_scores)
+            }
+            for score, _, doc, section_scores in sorted(heap, key=lambda e: e[:2], reverse=True)
+        ]
 
     def _extract_keywords(self, query: str) -> List[str]:
         """提取查询关键词"""
@@ -419,10 +635,11 @@ class EnhancedRetriever:
             # 中文关键词
             chinese_keywords = []
             chinese_matches = re.findall(r"[\u4e00-\u9fff]+", query)
+            segmenter = get_segmenter()
             for chunk in chinese_matches:
                 if HAVE_JIEBA:
                     chinese_keywords.extend([
-                        token for token in jieba.cut(chunk) 
+                        token for token in segmenter.cut(chunk)
                         if len(token) > 1 and token not in stopwords
                     ])
                 else:
@@ -452,69 +669,71 @@ class EnhancedRetriever:
             logger.error(f"❌ 关键词提取失败: {e}")
             return []
 
-    def _score_document(self, doc: Dict, keywords: List[str], intent: str) -> Dict[str, Any]:
-        """为文档打分"""
+    @staticmethod
+    def _section_has(section: NormSection, terms: Tuple[str, ...]) -> bool:
+        """
+        章节是否包含关键词的全部词项
+
+        按词项（小写、词干化）集合匹配，不再做子串查找：例如 "fee" 不再命中 "coffee"，
+        而 "modules" 与 "module" 词干相同仍能命中；短语关键词要求每个词都出现。
+        """
+        return bool(terms) and all(t in section.heading_terms or t in section.text_terms for t in terms)
+
+    def _score_document(
+        self,
+        doc: Dict,
+        keyword_terms: List[Tuple[str, Tuple[str, ...]]],
+        intent: str
+    ) -> Tuple[float, List[Tuple[float, int]]]:
+        """
+        为文档打分（keyword_terms: [(关键词, 关键词的词项)]）
+
+        Returns:
+            (总分, [(章节得分, 章节序号)])；章节片段由 _matched_sections 按需生成
+        """
         score = 0.0
-        matched_sections = []
+        section_scores = []
+        norm = self._normalized(doc)
         
         # 标题匹配
-        title = (doc.get("title") or "").lower()
-        title_hits = 0
-        for kw in keywords:
-            if kw and kw.lower() in title:
+        title = norm.title_lower
+        for kw, _ in keyword_terms:
+            if kw and kw in title:
                 score += ScoringConfig.KEYWORD_IN_TITLE
-                title_hits += 1
         
         # Level 匹配
-        level = str(doc.get("level", "")).lower()
-        if any(x in level for x in ["msc", "master", "postgraduate"]):
+        if norm.degree == "master":
             score += ScoringConfig.LEVEL_BOOST
         
         # Section 匹配
-        sections = doc.get("sections", [])
-        if sections and isinstance(sections, list):
-            intent_headings = {
-                "modules": ["module", "curriculum", "syllabus", "compulsory", "optional"],
-                "requirements": ["entry", "requirement", "admission", "qualification"],
-                "fees": ["fee", "tuition", "cost", "scholarship"],
-                "career": ["career", "employment", "prospect"],
-                "services": ["service", "support", "counseling"],
-            }.get(intent, [])
+        intent_headings = INTENT_HEADINGS.get(intent, ())
+        for i, section in enumerate(norm.sections[:30]):
+            sec_score = 0.0
             
-            for section in sections[:30]:
-                if not isinstance(section, dict):
-                    continue
-                
-                heading = (section.get("heading") or "").lower()
-                text = (section.get("text") or "").lower()
-                
-                sec_score = 0.0
-                
-                if any(h in heading for h in intent_headings):
-                    sec_score += ScoringConfig.INTENT_HEADING_MATCH
-                
-                matches = 0
-                for kw in keywords[:20]:
-                    if kw and (kw.lower() in heading or kw.lower() in text):
-                        matches += 1
-                
-                sec_score += min(matches * ScoringConfig.KEYWORD_IN_HEADING, ScoringConfig.MAX_KEYWORD_TEXT_SCORE)
-                
-                if sec_score > 0:
-                    matched_sections.append({
-                        "heading": section.get("heading", ""),
-                        "text": section.get("text", "")[:500],
-                        "score": sec_score
-                    })
-                    score += sec_score
-        
-        matched_sections.sort(key=lambda x: x["score"], reverse=True)
-        
-        return {
-            "score": score,
-            "title_hits": title_hits,
-            "matched_sections": matched_sections[:5]
-        }
+            if any(h in section.heading_lower for h in intent_headings):
+                sec_score += ScoringConfig.INTENT_HEADING_MATCH
+            
+            matches = 0
+            for _, terms in keyword_terms[:20]:
+                if self._section_has(section, terms):
+                    matches += 1
+            
+            sec_score += min(matches * ScoringConfig.KEYWORD_IN_HEADING, ScoringConfig.MAX_KEYWORD_TEXT_SCORE)
+            
+            if sec_score > 0:
+                section_scores.append((sec_score, i))
+                score += sec_score
+        
+        return score, section_scores
+
+    def _matched_sections(self, doc: Dict, section_scores: List[Tuple[float, int]]) -> List[Dict]:
+        """得分最高的 5 个章节片段"""
+        sections = self._normalized(doc).sections
+        top = heapq.nlargest(5, section_scores, key=lambda x: x[0])
+        return [
+            {"heading": sections[i].heading, "text": sections[i].text[:500], "score": sec_score}
+            for sec_score, i in top
+        ]
 
     def _build_domain_vocab(self) -> set:
         """构建领域词汇表"""
@@ -525,27 +744,19 @@ class EnhancedRetriever:
                 repo_root / "public" / "data" / "ucl_services.json",
             ]
             
-            words = []
+            items = []
             for path in data_paths:
                 if not path.exists():
                     continue
                 try:
                     with path.open("r", encoding="utf-8") as fh:
                         data = json.load(fh)
-                        if not data or not isinstance(data, list):
-                            continue
-                        for item in data:
-                            if not item or not isinstance(item, dict):
-                                continue
-                            title = item.get("title", "")
-                            if title and isinstance(title, str):
-                                tokens = re.findall(r"\b\w+\b|[\u4e00-\u9fff]+", title.lower())
-                                words.extend(tokens)
+                        if data and isinstance(data, list):
+                            items.extend(data)
                 except Exception as e:
                     logger.debug(f"读取文件失败: {e}")
             
-            counter = Counter(words)
-            vocab = {token for token, freq in counter.items() if freq > 1 and len(token) > 2}
+            vocab = domain_vocab(items)
             
             logger.info(f"📚 领域词汇表构建完成: {len(vocab)} 个词")
             return vocab
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+feedback_store.py - 用户反馈的异步批量写入与增量统计
+请求线程只把条目放进内存队列；后台线程按条数或时间间隔批量追加到日志，
+文件超过大小上限时 gzip 轮转。统计在入队时增量更新，不再重扫日志；
+启动时恢复统计的那一次日志读取也在后台线程中进行（服务在 lifespan 中调用 start()）。
+
+多个 worker 进程共用同一个日志：追加与轮转都持有文件锁（fcntl.flock），
+每个 worker 记住自己读到的位置，持锁时读入其他 worker 追加的条目，
+因此每个 worker 的统计都覆盖全部 worker（其他 worker 的条目最多延迟一个刷新间隔）。
+导出：FeedbackStore, FeedbackStats, get_feedback_store
+"""
+
+import os
+import gzip
+import json
+import time
+import queue
+import shutil
+import heapq
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+    HAVE_FCNTL = True
+except ImportError:
+    HAVE_FCNTL = False
+
+logger = logging.getLogger("feedback_store")
+
+# ============ 配置 ============
+ROOT = Path(__file__).resolve().parents[1]
+FEEDBACK_LOG = Path(os.getenv("QA_FEEDBACK_LOG", str(ROOT / "logs" / "feedback.log")))
+FLUSH_SIZE = int(os.getenv("QA_FEEDBACK_FLUSH_SIZE", "50"))
+FLUSH_INTERVAL = float(os.getenv("QA_FEEDBACK_FLUSH_INTERVAL", "2"))
+MAX_BYTES = int(os.getenv("QA_FEEDBACK_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUP_COUNT = int(os.getenv("QA_FEEDBACK_BACKUPS", "5"))
+QUEUE_SIZE = 10000
+# 记住最近多少个请求的意图（反馈只带 request_id）
+RECENT_REQUESTS = 20000
+
+_STOP = object()
+
+
+class FeedbackStats:
+    """按意图的有用率与差评最多的请求（线程安全，增量更新）"""
+
+    def __init__(self, max_requests: int = RECENT_REQUESTS) -> None:
+        self._lock = threading.Lock()
+        self.max_requests = max_requests
+        self.total = 0
+        # intent -> [有用, 没用]
+        self._by_intent: Dict[str, List[int]] = {}
+        # request_id -> [有用, 没用]，只保留最近的请求
+        self._by_request: "OrderedDict[str, List[int]]" = OrderedDict()
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        helpful = entry.get("helpful")
+        if helpful is None:
+            return
+        slot = 0 if helpful else 1
+        intent = entry.get("intent") or "unknown"
+        request_id = entry.get("request_id") or ""
+
+        with self._lock:
+            self.total += 1
+            self._by_intent.setdefault(intent, [0, 0])[slot] += 1
+
+            votes = self._by_request.get(request_id)
+            if votes is None:
+                votes = self._by_request[request_id] = [0, 0]
+                if len(self._by_request) > self.max_requests:
+                    self._by_request.popitem(last=False)
+            else:
+                self._by_request.move_to_end(request_id)
+            votes[slot] += 1
+
+    def snapshot(self, worst: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            by_intent = {
+                intent: {
+                    "helpful": up,
+                    "not_helpful": down,
+                    "total": up + down,
+                    "helpful_rate": round(up / (up + down), 4) if up + down else None
+                }
+                for intent, (up, down) in sorted(self._by_intent.items())
+            }
+            rated = [(rid, up, down) for rid, (up, down) in self._by_request.items() if down]
+            worst_rated = heapq.nlargest(worst, rated, key=lambda r: (r[2] - r[1], r[2]))
+
+        up_total = sum(v["helpful"] for v in by_intent.values())
+        return {
+            "total": self.total,
+            "helpful_rate": round(up_total / self.total, 4) if self.total else None,
+            "by_intent": by_intent,
+            "worst_rated": [
+                {"request_id": rid, "helpful": up, "not_helpful": down}
+                for rid, up, down in worst_rated
+            ]
+        }
+
+
+class FeedbackStore:
+    """后台线程批量写入反馈日志，并维护统计"""
+
+    def __init__(
+        self,
+        path: Path = FEEDBACK_LOG,
+        flush_size: int = FLUSH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_bytes: int = MAX_BYTES,
+        backup_count: int = BACKUP_COUNT,
+    ) -> None:
+        self.path = Path(path)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self.stats = FeedbackStats()
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=QUEUE_SIZE)
+        self._intents: "OrderedDict[str, str]" = OrderedDict()
+        self._intents_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # 启动时的日志回放完成后置位
+        self.replayed = threading.Event()
+        # 已读入统计的日志位置（inode, 字节偏移）；自己追加的内容读入前就已计入统计
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self.written = 0
+        self.dropped = 0
+
+    # ---------- 请求侧 ----------
+    def remember_intent(self, request_id: str, intent: str) -> None:
+        """记录请求的意图，之后的反馈按它归类"""
+        with self._intents_lock:
+            self._intents[request_id] = intent
+            self._intents.move_to_end(request_id)
+            if len(self._intents) > RECENT_REQUESTS:
+                self._intents.popitem(last=False)
+
+    def submit(self, entry: Dict[str, Any]) -> bool:
+        """非阻塞入队；队列已满时返回 False（后台线程尚未启动时只启动线程，不读日志）"""
+        if not entry.get("intent"):
+            with self._intents_lock:
+                intent = self._intents.get(entry.get("request_id", ""))
+            if intent:
+                entry["intent"] = intent
+
+        self.start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"⚠️ 反馈队列已满，丢弃: {entry.get('request_id')}")
+            return False
+        self.stats.add(entry)
+        return True
+
+    # ---------- 后台写入 ----------
+    def start(self) -> None:
+        """启动后台写入线程（不阻塞：日志回放在该线程中进行）"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self._thread.start()
+
+    @contextmanager
+    def _locked_log(self, exclusive: bool, create: bool) -> Iterator[Optional[BinaryIO]]:
+        """
+        打开当前日志并加锁；日志不存在且 create=False 时给出 None
+
+        拿到锁后确认打开的仍是 path 指向的文件（等锁期间可能已被其他 worker 轮转），否则重新打开。
+        """
+        while True:
+            if create:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                f = open(self.path, "a+b" if create else "rb")
+            except FileNotFoundError:
+                yield None
+                return
+            try:
+                if HAVE_FCNTL:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    current = os.stat(self.path).st_ino
+                except FileNotFoundError:
+                    current = None
+                if current == os.fstat(f.fileno()).st_ino:
+                    yield f
+                    return
+            finally:
+                f.close()  # 关闭即释放锁
+
+    def _catch_up(self, f: Optional[BinaryIO]) -> None:
+        """（持锁）把上次读到的位置之后的条目计入统计：其他 worker 追加的，或启动时的已有日志"""
+        inode = os.fstat(f.fileno()).st_ino if f is not None else None
+        if self._inode is not None and inode != self._inode:
+            # 其他 worker 已把我们读过一部分的文件轮转成 .1.gz：读完其中剩余的条目
+            self._add_lines(self._read_rotated()[self._offset:])
+            self._offset = 0
+        self._inode = inode
+        if f is None:
+            return
+        size = os.fstat(f.fileno()).st_size
+        if size < self._offset:
+            self._offset = 0
+        if size > self._offset:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+            self._offset += len(data)
+            self._add_lines(data)
+
+    def _read_rotated(self) -> bytes:
+        rotated = self.path.with_name(f"{self.path.name}.1.gz")
+        try:
+            with gzip.open(rotated, "rb") as f:
+                return f.read()
+        except OSError as e:
+            logger.warning(f"⚠️ 读取已轮转的反馈日志失败: {e}")
+            return b""
+
+    def _add_lines(self, data: bytes) -> None:
+        for line in data.splitlines():
+            try:
+                self.stats.add(json.loads(line))
+            except ValueError:
+                continue
+
+    def _sync(self) -> None:
+        """只读入其他 worker 的新条目（启动回放与空闲时调用）"""
+        try:
+            with self._locked_log(exclusive=False, create=False) as f:
+                self._catch_up(f)
+        except OSError as e:
+            logger.warning(f"⚠️ 读取反馈日志失败: {e}")
+
+    def _run(self) -> None:
+        if not self.replayed.is_set():
+            self._sync()
+            self.replayed.set()
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.flush_size or time.monotonic() >= deadline:
+                if batch:
+                    self._flush(batch)
+                else:
+                    self._sync()
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch).encode("utf-8")
+        try:
+            with self._locked_log(exclusive=True, create=True) as f:
+                # 先读入其他 worker 的条目，再追加自己的（已在入队时计入统计）
+                self._catch_up(f)
+                f.write(data)
+                f.flush()
+                self._offset += len(data)
+                self.written += len(batch)
+                if self._offset >= self.max_bytes:
+                    self._rotate(f)
+        except Exception as e:
+            logger.error(f"❌ 写入反馈日志失败 ({len(batch)} 条): {e}")
+
+    def _rotate(self, f: BinaryIO) -> None:
+        """（持锁）feedback.log -> feedback.log.1.gz，依次后移，最多保留 backup_count 个"""
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}.gz")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}.gz"))
+
+        rotated = self.path.with_name(f"{self.path.name}.1.gz")
+        f.seek(0)
+        with gzip.open(rotated, "wb") as dst:
+            shutil.copyfileobj(f, dst)
+        # 仍持有锁时删除：等锁的 worker 拿到锁后发现 inode 已变，会重新打开新文件
+        self.path.unlink()
+        self._inode = None
+        self._offset = 0
+        logger.info(f"🗜️ 反馈日志已轮转: {rotated.name}")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """写完队列中剩余条目后停止后台线程"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("⚠️ 反馈队列已满，关闭时可能丢失部分条目")
+        self._thread.join(timeout)
+        self._thread = None
+
+    def snapshot(self, worst: int = 10) -> Dict[str, Any]:
+        data = self.stats.snapshot(worst)
+        data["queued"] = self._queue.qsize()
+        data["written"] = self.written
+        data["dropped"] = self.dropped
+        data["replayed"] = self.replayed.is_set()
+        return data
+
+
+_store: Optional[FeedbackStore] = None
+
+
+def get_feedback_store() -> FeedbackStore:
+    """全局反馈存储（按环境变量配置）"""
+    global _store
+    if _store is None:
+        _store = FeedbackStore()
+    return _store
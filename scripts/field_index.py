@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+field_index.py - 结构化字段索引（学位类别 / 学位缩写 / 学校 / 文档类型 / 服务类别）
+语料加载时为每个字段建立 取值 -> 文档编号（递增的 array('i')）的索引。
+"只看 MSc"、"只看服务" 这类过滤在打分之前求交集得到允许的文档编号，检索只为这些文档打分。
+导出：FieldIndex, FILTER_FIELDS, parse_filters
+"""
+
+import logging
+from array import array
+from typing import Dict, FrozenSet, Iterable, Mapping, Optional, Sequence, Tuple
+
+from scripts.documents import NormDoc
+
+logger = logging.getLogger("field_index")
+
+# ============ 配置 ============
+# 可过滤的字段：degree（master / bachelor / doctorate）、level（msc / ma / bsc ...）、
+# school、type（program / service / library / news）、category（服务类别）
+FILTER_FIELDS = ("degree", "level", "school", "type", "category")
+
+_EMPTY = array("i")
+
+
+def _field_values(norm: NormDoc) -> Dict[str, str]:
+    doc = norm.doc
+    return {
+        "degree": norm.degree,
+        "level": norm.level,
+        "school": str(doc.get("school") or ""),
+        "type": norm.kind,
+        "category": str(doc.get("category") or ""),
+    }
+
+
+def _key(field: str, value: str) -> str:
+    return f"{field}\x1f{value.lower()}"
+
+
+def parse_filters(raw: Mapping[str, Optional[str]]) -> Dict[str, Tuple[str, ...]]:
+    """
+    请求参数 -> 过滤条件：字段 -> 取值元组（小写、逗号分隔表示"或"，空参数忽略）
+
+    未知字段抛出 ValueError。
+    """
+    filters: Dict[str, Tuple[str, ...]] = {}
+    for field, value in raw.items():
+        if value is None:
+            continue
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"unknown filter field: {field}")
+        values = tuple(sorted({v.strip().lower() for v in str(value).split(",") if v.strip()}))
+        if values:
+            filters[field] = values
+    return filters
+
+
+class FieldIndex:
+    """
+    只读字段索引：postings["字段\x1f取值"] = (递增的文档编号,)
+
+    同一字段的多个取值取并集，不同字段之间取交集。postings 可以是共享语料制品中的 MappedTable。
+    """
+
+    def __init__(self, postings: Mapping[str, Tuple[Sequence[int]]], num_docs: int) -> None:
+        self.postings = postings
+        self.num_docs = num_docs
+
+    @classmethod
+    def build(cls, norm_docs: Sequence[NormDoc]) -> "FieldIndex":
+        postings: Dict[str, Tuple[array]] = {}
+        for doc_id, norm in enumerate(norm_docs):
+            for field, value in _field_values(norm).items():
+                if value:
+                    postings.setdefault(_key(field, value), (array("i"),))[0].append(doc_id)
+        index = cls(postings, len(norm_docs))
+        logger.info(
+            f"🏷️ 字段索引: {len(norm_docs)} 个文档, "
+            + ", ".join(f"{field} {len(values)}" for field, values in index.values().items())
+        )
+        return index
+
+    def export(self, writer, name: str = "fields") -> None:
+        """写入共享语料制品（writer 为 corpus_store.ArtifactWriter）"""
+        writer.table(name, self.postings, "i")
+        writer.json(f"{name}.meta", {"num_docs": self.num_docs})
+
+    @classmethod
+    def from_artifact(cls, corpus, name: str = "fields") -> "FieldIndex":
+        return cls(corpus.table(name), corpus.json(f"{name}.meta")["num_docs"])
+
+    def ids(self, field: str, value: str) -> Sequence[int]:
+        """字段取值为 value 的文档编号"""
+        entry = self.postings.get(_key(field, value))
+        return entry[0] if entry is not None else _EMPTY
+
+    def allowed(self, filters: Optional[Mapping[str, Iterable[str]]]) -> Optional[FrozenSet[int]]:
+        """过滤条件 -> 允许的文档编号；没有过滤条件时返回 None（不限制）"""
+        if not filters:
+            return None
+        groups = []
+        for field, values in filters.items():
+            ids = set()
+            for value in values:
+                ids.update(self.ids(field, value))
+            groups.append(ids)
+        groups.sort(key=len)
+        result = groups[0]
+        for ids in groups[1:]:
+            if not result:
+                break
+            result = result & ids
+        return frozenset(result)
+
+    def values(self) -> Dict[str, Dict[str, int]]:
+        """各字段的取值与文档数"""
+        values: Dict[str, Dict[str, int]] = {field: {} for field in FILTER_FIELDS}
+        for key, (ids,) in self.postings.items():
+            field, value = key.split("\x1f", 1)
+            values.setdefault(field, {})[value] = len(ids)
+        return values
+
+    def __len__(self) -> int:
+        return self.num_docs
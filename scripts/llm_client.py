@@ -2,13 +2,16 @@
 # -*- coding: utf-8 -*-
 """
 llm_client.py - Groq 客户端（完全修复版）
-导出：chat_with_groq, is_configured
+导出：chat_with_groq, stream_chat_with_groq, is_configured
 """
 
 import os
 import time
 import logging
 
+from scripts.deadline import LLM_MIN_BUDGET, DeadlineExceeded
+from scripts.metrics import LLM_RETRIES
+
 # ============ 日志配置（必须在最前面）============
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("llm_client")
@@ -30,7 +33,8 @@ def _init_client():
     
     try:
         from groq import Groq
-        _groq_client = Groq(api_key=api_key)
+        # 重试由下面的调用循环按截止时间控制，关闭 SDK 自带的重试
+        _groq_client = Groq(api_key=api_key, max_retries=0)
         logger.info("✅ Groq client initialized")
         return _groq_client
     except Exception as e:
@@ -41,11 +45,24 @@ def is_configured() -> bool:
     """检查 GROQ_API_KEY 是否配置"""
     return bool(os.getenv("GROQ_API_KEY"))
 
+def _attempt_timeout(deadline):
+    """本次调用的超时；剩余时间不足一次调用时抛出 DeadlineExceeded"""
+    if deadline is None:
+        return {}
+    deadline.check("llm", LLM_MIN_BUDGET)
+    return {"timeout": deadline.timeout()}
+
+def _can_retry(deadline, wait: float) -> bool:
+    """退避等待后是否还来得及再调用一次"""
+    return deadline is None or deadline.allows(wait + LLM_MIN_BUDGET)
+
 def chat_with_groq(
     messages, 
     temperature=0.1, 
     max_retries=2, 
-    model="llama-3.3-70b-versatile"
+    model="llama-3.3-70b-versatile",
+    max_tokens=1024,
+    deadline=None
 ):
     """
     调用 Groq API
@@ -55,11 +72,14 @@ def chat_with_groq(
         temperature: 温度参数 (0-1)
         max_retries: 最大重试次数
         model: 模型名称
+        max_tokens: 最大输出 token 数
+        deadline: 可选 Deadline；每次调用的超时取剩余时间，来不及时不再重试
     
     Returns:
         str: LLM 返回的文本
     
     Raises:
+        DeadlineExceeded: 剩余时间不足一次调用
         Exception: API 调用失败
     """
     # 检查配置
@@ -74,30 +94,113 @@ def chat_with_groq(
     # 重试逻辑
     for attempt in range(max_retries):
         try:
+            options = _attempt_timeout(deadline)
             logger.info(f"🤖 Groq (model={model}, T={temperature}, try={attempt+1}/{max_retries})")
             
             response = groq_client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=temperature,
-                max_tokens=1024,
+                max_tokens=max_tokens,
                 top_p=0.95,
+                **options
             )
             
             content = response.choices[0].message.content
             logger.info(f"✅ Success: {len(content)} chars")
             return content
         
+        except DeadlineExceeded:
+            raise
+        
         except Exception as e:
             logger.warning(f"⚠️  Try {attempt+1} failed: {e}")
             
-            if attempt == max_retries - 1:
-                logger.error(f"❌ All {max_retries} attempts failed")
-                raise Exception(f"Groq API failed: {str(e)[:200]}")
-            
             # 指数退避
             wait = 1 * (2 ** attempt)
+            if attempt == max_retries - 1 or not _can_retry(deadline, wait):
+                logger.error(f"❌ Groq failed after {attempt+1} attempts")
+                raise Exception(f"Groq API failed: {str(e)[:200]}")
+            
             logger.info(f"⏳ Retry in {wait}s...")
+            LLM_RETRIES.inc()
             time.sleep(wait)
     
     return None
+
+def stream_chat_with_groq(
+    messages,
+    temperature=0.1,
+    max_retries=2,
+    model="llama-3.3-70b-versatile",
+    max_tokens=1024,
+    deadline=None
+):
+    """
+    流式调用 Groq API，逐段产出模型生成的文本
+
+    只在收到第一个 token 之前重试；一旦开始输出，中途失败直接抛出，
+    避免向客户端重复发送内容。deadline 限制的是建立连接 / 首个 token 之前的时间
+    （超时取剩余时间，来不及时不再重试）。
+
+    Yields:
+        str: 增量文本片段
+
+    Raises:
+        Exception: API 调用失败
+    """
+    if not is_configured():
+        raise Exception("❌ GROQ_API_KEY not set. Run: export GROQ_API_KEY='your_key'")
+
+    groq_client = _init_client()
+    if groq_client is None:
+        raise Exception("❌ Failed to initialize Groq client")
+
+    for attempt in range(max_retries):
+        started = False
+        try:
+            options = _attempt_timeout(deadline)
+            logger.info(f"🤖 Groq stream (model={model}, T={temperature}, try={attempt+1}/{max_retries})")
+
+            stream = groq_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=0.95,
+                stream=True,
+                **options
+            )
+
+            total = 0
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        started = True
+                        total += len(delta)
+                        yield delta
+            finally:
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+
+            logger.info(f"✅ Stream success: {total} chars")
+            return
+
+        except (GeneratorExit, DeadlineExceeded):
+            raise
+
+        except Exception as e:
+            logger.warning(f"⚠️  Stream try {attempt+1} failed: {e}")
+
+            wait = 1 * (2 ** attempt)
+            if started or attempt == max_retries - 1 or not _can_retry(deadline, wait):
+                logger.error(f"❌ Groq stream failed after {attempt+1} attempts")
+                raise Exception(f"Groq API failed: {str(e)[:200]}")
+
+            logger.info(f"⏳ Retry in {wait}s...")
+            LLM_RETRIES.inc()
+            time.sleep(wait)
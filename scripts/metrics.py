@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+metrics.py - 进程内指标（Prometheus 文本格式）
+无第三方依赖；线程安全。进程池模式下各子进程的指标不会汇总到 API 进程。
+导出：Counter, Gauge, Histogram, timed, count, request_trace, render_metrics 以及 QA 流水线使用的各项指标
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 秒级延迟桶：覆盖从毫秒级的打分循环到数十秒的 LLM 调用
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """指标基类：名称、说明、标签名，以及按标签值分组的数据"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[k]) for k in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not self.labelnames:
+            # 无标签的计数器从 0 开始导出
+            self._values[()] = 0.0
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """累积桶直方图"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [每个桶的计数..., 总和, 总数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def count(self, **labels: str) -> float:
+        with self._lock:
+            data = self._values.get(self._key(labels))
+            return data[-1] if data else 0.0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                for bound, n in zip(self.buckets, data):
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(n)}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {_format_value(data[-1])}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(data[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(data[-1])}")
+        return lines
+
+
+def render_metrics() -> str:
+    """所有已注册指标的 Prometheus 文本格式"""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============ QA 流水线指标 ============
+STAGE_LATENCY = Histogram(
+    "qa_stage_latency_seconds",
+    "Latency of each QA pipeline stage",
+    ["stage"],
+)
+REQUESTS = Counter("qa_requests_total", "QA requests received", ["endpoint"])
+CACHE_REQUESTS = Counter("qa_answer_cache_requests_total", "Answer cache lookups", ["result"])
+WEB_SEARCH_FALLBACKS = Counter("qa_web_search_fallbacks_total", "Web searches triggered by weak local results")
+LLM_RETRIES = Counter("qa_llm_retries_total", "Groq calls retried after a failure")
+ERRORS = Counter("qa_errors_total", "Errors by pipeline stage", ["stage"])
+ADMISSION_ACTIVE = Gauge("qa_admission_active", "QA requests currently admitted")
+ADMISSION_QUEUE_DEPTH = Gauge("qa_admission_queue_depth", "QA requests waiting for admission")
+ADMISSION_REJECTIONS = Counter("qa_admission_rejections_total", "QA requests shed with 503", ["reason"])
+DEADLINE_SKIPS = Counter("qa_deadline_skips_total", "Pipeline stages skipped or shortened to meet the request deadline", ["stage"])
+
+
+# ============ 单请求追踪 ============
+class RequestTrace:
+    """单个请求内各阶段的耗时（毫秒）与计数"""
+    __slots__ = ("timings", "counts")
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "stages_ms": {k: round(v, 2) for k, v in self.timings.items()},
+            **self.counts,
+        }
+
+
+_CURRENT_TRACE: ContextVar[Optional[RequestTrace]] = ContextVar("qa_request_trace", default=None)
+
+
+@contextmanager
+def request_trace() -> Iterator[RequestTrace]:
+    """
+    开启（或复用已开启的）请求追踪；期间 timed / count 的数据会记到该请求上
+
+    基于 contextvars，只在同一线程的同步调用链内有效。
+    """
+    current = _CURRENT_TRACE.get()
+    if current is not None:
+        yield current
+        return
+
+    trace = RequestTrace()
+    token = _CURRENT_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _CURRENT_TRACE.reset(token)
+
+
+def count(name: str, n: int = 1) -> None:
+    """给当前请求的计数项加 n（无追踪时忽略）"""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.counts[name] = trace.counts.get(name, 0) + n
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """记录一个流水线阶段的耗时（全局直方图 + 当前请求追踪）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        trace = _CURRENT_TRACE.get()
+        if trace is not None:
+            trace.timings[stage] = trace.timings.get(stage, 0.0) + elapsed * 1000
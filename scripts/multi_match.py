@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+multi_match.py - 多模式子串匹配（Aho–Corasick 自动机）
+把别名表、意图关键词、优先章节词等一次编译成自动机，对文本扫描一遍就找出所有命中，
+耗时与文本长度（加命中数）成正比，与模式个数无关；等价于对每个模式做一次 `pattern in text`。
+支持运行时 add()：在调用 add() 的线程中编译新自动机后整体替换，
+查询线程在编译期间继续使用旧自动机，从不在查询路径上编译。
+导出：MultiPatternMatcher
+"""
+
+import threading
+from collections import deque
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+
+class _Automaton:
+    """只读的已编译自动机：goto 转移、fail 链接、每个状态的输出（已合并 fail 链上的输出）"""
+    __slots__ = ("goto", "fail", "out")
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[Tuple[str, Any]]] = [[]]
+        for pattern, value in patterns:
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append((pattern, value))
+
+        # 广度优先计算 fail；第一层节点的 fail 为根
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+
+
+class MultiPatternMatcher:
+    """
+    多模式匹配器：模式 -> 值（同一模式可以对应多个值）
+
+    模式在 add 时转成小写；find / values 不再转换，调用方传入已小写的文本。
+    自动机只读，add() 编译好新自动机后一次赋值替换；查询不加锁。
+    """
+
+    def __init__(self, patterns: Optional[Iterable[Tuple[str, Any]]] = None) -> None:
+        self._patterns: List[Tuple[str, Any]] = []
+        self._seen: Set[Tuple[str, Hashable]] = set()
+        # 串行化写入（add）；查询只读取 _automaton 的当前引用
+        self._lock = threading.Lock()
+        for pattern, value in patterns or ():
+            self._append(pattern.lower(), value)
+        self._automaton = _Automaton(self._patterns)
+
+    def _append(self, pattern: str, value: Any) -> bool:
+        if not pattern or (pattern, value) in self._seen:
+            return False
+        self._seen.add((pattern, value))
+        self._patterns.append((pattern, value))
+        return True
+
+    def add(self, pattern: str, value: Any) -> bool:
+        """添加模式（空串或已存在的 (模式, 值) 忽略），返回是否新增；返回时新自动机已生效"""
+        with self._lock:
+            if not self._append(pattern.lower(), value):
+                return False
+            self._automaton = _Automaton(self._patterns)
+        return True
+
+    def find(self, text: str) -> List[Tuple[int, str, Any]]:
+        """文本中所有命中 [(起始位置, 模式, 值)]，按结束位置排序"""
+        automaton = self._automaton
+        goto, fail, out = automaton.goto, automaton.fail, automaton.out
+        hits = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern, value in out[state]:
+                hits.append((i - len(pattern) + 1, pattern, value))
+        return hits
+
+    def values(self, text: str, min_length: int = 0) -> Set[Any]:
+        """命中模式对应的值的集合（可只保留长度 >= min_length 的模式）"""
+        return {value for _, pattern, value in self.find(text) if len(pattern) >= min_length}
+
+    def __len__(self) -> int:
+        return len(self._patterns)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+passage_index.py - 章节级段落索引
+语料加载时把每个文档的章节（已清理空白）作为一个段落建索引：段落按文档顺序连续编号，
+倒排表记录 词 -> (段落编号, 该词在正文中的字符区间)，章节标题词与意图标签另建倒排表。
+检索结果的片段选择变成在该文档的段落编号区间内二分查找，返回的片段带预先算好的高亮区间；
+也可以直接按 BM25 在全部段落上检索（段落级检索单元）。
+所有数据都是数值列、字符串序列与 关键词 -> 列 的表，可以写进共享语料制品（export / from_artifact）。
+导出：Passage, PassageIndex
+"""
+
+import math
+import heapq
+import logging
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from scripts.documents import NormDoc
+from scripts.text_index import K1, tokenize_spans
+
+logger = logging.getLogger("passage_index")
+
+# ============ 配置 ============
+# 片段评分：命中优先章节（意图标签）/ 标题词 / 正文词
+TAG_SCORE = 20
+HEADING_SCORE = 3
+TEXT_SCORE = 1
+# 段落 BM25：标题命中折算的词频、长度归一化强度
+HEADING_TF = 2.0
+PASSAGE_B = 0.75
+
+# 表名与各列类型码（写入共享语料制品时使用）
+_TABLES = {"text": "iii", "spans": "i", "heading": "i", "tags": "i"}
+_COLUMNS = {"doc_ids": "i", "sections": "i", "lengths": "i", "doc_starts": "i"}
+_STRINGS = ("headings", "texts")
+
+Table = Mapping[str, Tuple[Sequence[int], ...]]
+
+
+class Passage:
+    """一个段落：所属文档编号 + 章节序号 + 清理后的标题与正文 + 词项数"""
+    __slots__ = ("doc_id", "section", "heading", "text", "length")
+
+    def __init__(self, doc_id: int, section: int, heading: str, text: str, length: int) -> None:
+        self.doc_id = doc_id
+        self.section = section
+        self.heading = heading
+        self.text = text
+        self.length = length
+
+
+class PassageIndex:
+    """
+    只读段落索引
+
+    段落按 (文档编号, 章节序号) 排列，文档 d 的段落编号为 [doc_starts[d], doc_starts[d + 1])；
+    各表中的段落编号递增，因此某个文档内的命中可以二分切出。
+    tables["text"][词] = (段落编号, 区间起, 区间止)：第 j 个命中段落的字符区间为
+    tables["spans"][词][0] 中第 起 ~ 止 对（起止交替），区间个数即词频。
+    tables["heading"] / tables["tags"][词或标签] = (段落编号,)。
+    """
+
+    def __init__(
+        self,
+        columns: Mapping[str, Sequence[int]],
+        strings: Mapping[str, Sequence[str]],
+        tables: Mapping[str, Table],
+        avg_length: float,
+    ) -> None:
+        self.doc_ids = columns["doc_ids"]
+        self.sections = columns["sections"]
+        self.lengths = columns["lengths"]
+        self.doc_starts = columns["doc_starts"]
+        self.headings = strings["headings"]
+        self.texts = strings["texts"]
+        self.text_postings = tables["text"]
+        self.span_table = tables["spans"]
+        self.heading_postings = tables["heading"]
+        self.tag_postings = tables["tags"]
+        self.avg_length = avg_length or 1.0
+        self._idf: Dict[str, float] = {}
+
+    @classmethod
+    def build(
+        cls,
+        norm_docs: Sequence[NormDoc],
+        tagger: Optional[Callable[[str], FrozenSet[str]]] = None
+    ) -> "PassageIndex":
+        """
+        norm_docs: 规范化文档（编号即下标）；tagger: 小写章节标题 -> 意图标签
+        正文为空的章节不建段落（不会作为片段返回）。
+        """
+        columns = {name: array(tc) for name, tc in _COLUMNS.items()}
+        columns["doc_starts"].append(0)
+        headings: List[str] = []
+        texts: List[str] = []
+        text_rows: Dict[str, Tuple[array, array, array]] = {}
+        span_rows: Dict[str, Tuple[array]] = {}
+        heading_rows: Dict[str, Tuple[array]] = {}
+        tag_rows: Dict[str, Tuple[array]] = {}
+
+        for doc_id, norm in enumerate(norm_docs):
+            for idx, section in enumerate(norm.sections):
+                if not section.text:
+                    continue
+                pid = len(texts)
+                positions: Dict[str, List[int]] = {}
+                for term, start, end in tokenize_spans(section.text):
+                    positions.setdefault(term, []).extend((start, end))
+                columns["doc_ids"].append(doc_id)
+                columns["sections"].append(idx)
+                columns["lengths"].append(len(section.text_tokens))
+                headings.append(section.heading)
+                texts.append(section.text)
+
+                for term, spans in positions.items():
+                    row = text_rows.get(term)
+                    if row is None:
+                        row = text_rows[term] = (array("i"), array("i"), array("i"))
+                        span_rows[term] = (array("i"),)
+                    flat = span_rows[term][0]
+                    row[0].append(pid)
+                    row[1].append(len(flat) // 2)
+                    flat.extend(spans)
+                    row[2].append(len(flat) // 2)
+                for term in section.heading_terms:
+                    heading_rows.setdefault(term, (array("i"),))[0].append(pid)
+                for tag in (tagger(section.heading_lower) if tagger else ()):
+                    tag_rows.setdefault(tag, (array("i"),))[0].append(pid)
+            columns["doc_starts"].append(len(texts))
+
+        num = len(texts)
+        avg_length = sum(columns["lengths"]) / num if num else 0.0
+        logger.info(f"📑 段落索引: {num} 个段落, {len(text_rows)} 个正文词项")
+        return cls(
+            columns,
+            {"headings": headings, "texts": texts},
+            {"text": text_rows, "spans": span_rows, "heading": heading_rows, "tags": tag_rows},
+            avg_length,
+        )
+
+    def export(self, writer, name: str = "passages") -> None:
+        """写入共享语料制品（writer 为 corpus_store.ArtifactWriter）"""
+        columns = {"doc_ids": self.doc_ids, "sections": self.sections, "lengths": self.lengths, "doc_starts": self.doc_starts}
+        for column, tc in _COLUMNS.items():
+            writer.column(f"{name}.{column}", tc, columns[column])
+        writer.strings(f"{name}.headings", self.headings)
+        writer.strings(f"{name}.texts", self.texts)
+        tables = {"text": self.text_postings, "spans": self.span_table, "heading": self.heading_postings, "tags": self.tag_postings}
+        for table, typecodes in _TABLES.items():
+            writer.table(f"{name}.{table}", tables[table], typecodes)
+        writer.json(f"{name}.meta", {"avg_length": self.avg_length})
+
+    @classmethod
+    def from_artifact(cls, corpus, name: str = "passages") -> "PassageIndex":
+        """从共享语料制品打开（数据留在 mmap 中，不复制到进程内）"""
+        return cls(
+            {column: corpus.column(f"{name}.{column}") for column in _COLUMNS},
+            {strings: corpus.strings(f"{name}.{strings}") for strings in _STRINGS},
+            {table: corpus.table(f"{name}.{table}") for table in _TABLES},
+            corpus.json(f"{name}.meta")["avg_length"],
+        )
+
+    def passage(self, pid: int) -> Passage:
+        return Passage(self.doc_ids[pid], self.sections[pid], self.headings[pid], self.texts[pid], self.lengths[pid])
+
+    def doc_range(self, doc_id: int) -> Tuple[int, int]:
+        """文档的段落编号区间 [lo, hi)"""
+        if not 0 <= doc_id < len(self.doc_starts) - 1:
+            return 0, 0
+        return self.doc_starts[doc_id], self.doc_starts[doc_id + 1]
+
+    @staticmethod
+    def _within(ids: Sequence[int], lo: int, hi: int) -> range:
+        """递增的段落编号中落在 [lo, hi) 内的下标"""
+        return range(bisect_left(ids, lo), bisect_left(ids, hi))
+
+    def idf(self, term: str) -> float:
+        """正文或标题含有该词的段落数 -> idf（按需计算并缓存）"""
+        value = self._idf.get(term)
+        if value is None:
+            pids = set()
+            entry = self.text_postings.get(term)
+            if entry is not None:
+                pids.update(entry[0])
+            entry = self.heading_postings.get(term)
+            if entry is not None:
+                pids.update(entry[0])
+            num = len(self.texts)
+            value = math.log(1 + (num - len(pids) + 0.5) / (len(pids) + 0.5)) if pids else 0.0
+            self._idf[term] = value
+        return value
+
+    def highlights(self, pid: int, terms: Iterable[str], max_chars: Optional[int] = None) -> List[List[int]]:
+        """段落正文中查询词项的字符区间 [[起, 止]]（按起点排序；max_chars 之后的区间不返回）"""
+        found = set()
+        for term in terms:
+            entry = self.text_postings.get(term)
+            if entry is None:
+                continue
+            ids, lo, hi = entry
+            j = bisect_left(ids, pid)
+            if j == len(ids) or ids[j] != pid:
+                continue
+            spans = self.span_table[term][0]
+            for k in range(lo[j], hi[j]):
+                start, end = spans[2 * k], spans[2 * k + 1]
+                if max_chars is None or end <= max_chars:
+                    found.add((start, end))
+        return [list(span) for span in sorted(found)]
+
+    def select(
+        self,
+        doc_id: int,
+        terms: Sequence[str],
+        groups: Iterable[str] = (),
+        limit: int = 5,
+        max_chars: int = 800
+    ) -> List[Dict]:
+        """
+        文档内与查询相关的段落（片段选择）
+
+        得分：意图标签命中 groups +TAG_SCORE，每个查询词命中标题 +HEADING_SCORE、命中正文 +TEXT_SCORE；
+        按得分降序（同分按章节顺序）取前 limit 个，返回 heading / text（截断到 max_chars）/ score / highlights。
+        """
+        lo, hi = self.doc_range(doc_id)
+        if lo == hi:
+            return []
+        scores: Dict[int, int] = {}
+        tagged = set()
+        for group in groups:
+            entry = self.tag_postings.get(group)
+            if entry is not None:
+                ids = entry[0]
+                tagged.update(ids[j] for j in self._within(ids, lo, hi))
+        for pid in tagged:
+            scores[pid] = TAG_SCORE
+
+        for term in terms:
+            entry = self.heading_postings.get(term)
+            if entry is not None:
+                ids = entry[0]
+                for j in self._within(ids, lo, hi):
+                    scores[ids[j]] = scores.get(ids[j], 0) + HEADING_SCORE
+            entry = self.text_postings.get(term)
+            if entry is not None:
+                ids = entry[0]
+                for j in self._within(ids, lo, hi):
+                    scores[ids[j]] = scores.get(ids[j], 0) + TEXT_SCORE
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [self._snippet(pid, score, terms, max_chars) for pid, score in ranked]
+
+    def _snippet(self, pid: int, score: float, terms: Sequence[str], max_chars: int) -> Dict:
+        return {
+            "heading": self.headings[pid],
+            "text": self.texts[pid][:max_chars],
+            "score": score,
+            "highlights": self.highlights(pid, terms, max_chars),
+        }
+
+    def search(self, terms: Mapping[str, float], limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        段落级 BM25 检索：terms 为 词项 -> 权重，返回 [(段落编号, 得分)]，按得分降序
+        正文词频取高亮区间个数，标题命中折算为 HEADING_TF 个词频。
+        """
+        scores: Dict[int, float] = {}
+        for term, weight in terms.items():
+            idf = self.idf(term)
+            if not idf:
+                continue
+            tfs: Dict[int, float] = {}
+            entry = self.text_postings.get(term)
+            if entry is not None:
+                for pid, start, end in zip(*entry):
+                    tfs[pid] = end - start
+            entry = self.heading_postings.get(term)
+            if entry is not None:
+                for pid in entry[0]:
+                    tfs[pid] = tfs.get(pid, 0) + HEADING_TF
+            for pid, tf in tfs.items():
+                norm = 1 - PASSAGE_B + PASSAGE_B * self.lengths[pid] / self.avg_length
+                scores[pid] = scores.get(pid, 0.0) + weight * idf * tf * (K1 + 1) / (tf + K1 * norm)
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+    def __len__(self) -> int:
+        return len(self.texts)
@@ -13,15 +13,34 @@ import os
 import re
 import json
 import time
+import heapq
 import logging
+import itertools
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Iterator, List, Mapping, Optional, Tuple, Union
 from collections import defaultdict
 
 # 基础日志配置
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("qa_wrapper")
 
+from scripts.deadline import (
+    LLM_MIN_BUDGET, LLM_RESERVE, LLM_TIGHT_BUDGET, WEB_SEARCH_MAX, WEB_SEARCH_MIN, Deadline, DeadlineExceeded
+)
+from scripts.metrics import ERRORS, WEB_SEARCH_FALLBACKS, count, request_trace, timed
+from scripts.documents import detect_degree, domain_vocab, normalize_document, unify_document
+from scripts.field_index import FieldIndex
+from scripts.multi_match import MultiPatternMatcher
+from scripts.passage_index import PassageIndex
+from scripts.segmenter import HAVE_JIEBA, get_segmenter
+from scripts.text_index import BM25FIndex, tokenize
+
 # 导入 Web 搜索
 try:
     from scripts.web_search import search_web
@@ -31,13 +50,10 @@ except Exception as e:
     logger.warning(f"⚠️ web_search 模块加载失败: {e}")
     HAVE_WEB_SEARCH = False
 
-# ✅ [本次修复] 导入 Jieba
-try:
-    import jieba
-    HAVE_JIEBA = True
+# ✅ [本次修复] 中文分词（jieba + 领域用户词典，见 scripts/segmenter.py）
+if HAVE_JIEBA:
     logger.info("✅ jieba 加载成功")
-except ImportError:
-    HAVE_JIEBA = False
+else:
     logger.warning("⚠️ jieba 未安装, 中文分词将回退到 n-gram")
 
 
@@ -46,9 +62,20 @@ ROOT = Path(__file__).resolve().parents[1] if "__file__" in globals() else Path.
 PROGRAMS_PATH = ROOT / "public" / "data" / "ucl_programs.json"
 SERVICES_PATH = ROOT / "public" / "data" / "ucl_services.json"
 
-# 全局缓存
-_GLOBAL_DOCS: List[Dict] = []
-_PROGRAM_INDEX: Dict[str, List[Dict]] = {} 
+# 多 worker 部署时改用共享的内存映射语料（auto：WEB_CONCURRENCY > 1 时启用）
+_CORPUS_MMAP = os.getenv("QA_CORPUS_MMAP", "auto").lower()
+USE_CORPUS_MMAP = _CORPUS_MMAP in ("1", "true") or (
+    _CORPUS_MMAP == "auto" and int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1
+)
+
+# 全局缓存：当前语料快照（热重载时整体替换，见 reload_corpus）
+_SNAPSHOT: Optional["CorpusSnapshot"] = None
+_SNAPSHOT_LOCK = threading.Lock()
+# 启动预热时按需创建（QA_WARMUP_EMBEDDINGS=1）
+_SEMANTIC_RETRIEVER = None
+# 语义检索线程（与关键词检索并发）
+_SEMANTIC_POOL: Optional[ThreadPoolExecutor] = None
+_SEMANTIC_POOL_LOCK = threading.Lock()
 
 # ✅ [本次修复] 中文别名映射
 PROGRAM_ALIASES = {
@@ -61,6 +88,69 @@ PROGRAM_ALIASES = {
     "modules": ["modules", "课程", "模块"],
     "fees": ["fees", "tuition", "学费"],
 }
+# 可由别名直接判定的意图（按 PROGRAM_ALIASES 顺序优先）
+ALIAS_INTENTS = ("language_requirements", "requirements", "modules", "fees")
+# 其余意图的关键词（按顺序优先）
+INTENT_PATTERNS = {
+    "career": ["career", "employment", "job", "prospect", "就业", "职业"],
+    "services": ["service", "support", "counseling", "咨询", "服务"],
+}
+
+# 按意图追加的检索扩展词（BM25F 检索时权重为 EXPANSION_WEIGHT）
+INTENT_EXPANSIONS = {
+    "modules": ["compulsory", "core", "optional", "elective", "curriculum"],
+    "requirements": ["ielts", "toefl", "gpa", "degree", "qualification", "a-level"],
+    "language_requirements": ["ielts", "toefl", "gpa", "degree", "qualification", "a-level"],
+    "fees": ["scholarship", "funding", "payment", "international", "uk", "overseas"],
+}
+EXPANSION_WEIGHT = 0.3
+# 全文检索得分的上限（低于专业名称精确匹配的 90 / 100 分档）
+KEYWORD_SCORE_SCALE = 60.0
+# 查询与文档学位类别一致时的加分
+LEVEL_BONUS = 10
+
+# 检索模式：keyword（仅 BM25F）/ semantic（仅向量）/ hybrid（两路并发后融合）
+# 语义检索器未就绪（未预计算向量 / 未安装 sentence-transformers）时一律退回 keyword
+RETRIEVAL_MODE = os.getenv("QA_RETRIEVAL_MODE", "hybrid").lower()
+# 融合方式：rrf（倒数排名融合）/ weighted（关键词得分与相似度加权）
+FUSION_METHOD = os.getenv("QA_FUSION", "rrf").lower()
+RRF_K = int(os.getenv("QA_RRF_K", "60"))
+# weighted 融合中语义相似度的权重（关键词得分按 0 ~ 100 归一化）
+SEMANTIC_WEIGHT = float(os.getenv("QA_SEMANTIC_WEIGHT", "0.5"))
+# 余弦相似度 -> 与关键词得分相同的 0 ~ 100 刻度（用于网络搜索兜底等阈值）
+SEMANTIC_SCORE_SCALE = 100.0
+# 等待语义检索的最长时间（秒），超时只用关键词结果；不超过请求剩余时间
+SEMANTIC_TIMEOUT = float(os.getenv("QA_SEMANTIC_TIMEOUT", "2"))
+# 查询分析结果的 LRU 缓存条数（分析只依赖查询文本，热重载语料后无需清空）
+QUERY_ANALYSIS_CACHE_SIZE = int(os.getenv("QA_QUERY_ANALYSIS_CACHE", "4096"))
+
+# 别名 -> 内部名称、意图关键词 -> 意图 的多模式匹配器（一次扫描找出全部命中）
+ALIAS_MATCHER = MultiPatternMatcher(
+    (alias, internal_name) for internal_name, aliases in PROGRAM_ALIASES.items() for alias in aliases
+)
+INTENT_MATCHER = MultiPatternMatcher(
+    (pattern, intent) for intent, patterns in INTENT_PATTERNS.items() for pattern in patterns
+)
+# 多个别名同时命中时按 PROGRAM_ALIASES 中的顺序取第一个
+_ALIAS_RANK = {name: rank for rank, name in enumerate(PROGRAM_ALIASES)}
+_INTENT_RANK = {intent: rank for rank, intent in enumerate(INTENT_PATTERNS)}
+
+
+def add_program_alias(internal_name: str, alias: str) -> bool:
+    """
+    运行时追加别名（如新专业的中文名），返回是否新增
+
+    对之后分析的查询生效；已缓存的查询分析会被清空。专业名称索引在下次重载语料时更新。
+    """
+    internal_name = internal_name.lower()
+    _ALIAS_RANK.setdefault(internal_name, len(_ALIAS_RANK))  # 先登记顺序，匹配器可能立即被其他线程使用
+    if not ALIAS_MATCHER.add(alias, internal_name):
+        return False
+    PROGRAM_ALIASES.setdefault(internal_name, []).append(alias.lower())
+    get_segmenter().add_words([alias])
+    analyze_query.cache_clear()
+    logger.info(f"➕ 新增别名: {alias} -> {internal_name}")
+    return True
 
 
 def _build_program_index(docs: List[Dict]) -> Dict[str, List[Dict]]:
@@ -79,27 +169,22 @@ def _build_program_index(docs: List[Dict]) -> Dict[str, List[Dict]]:
             if len(word) > 2:
                 index[word].append(doc)
         
-        # 缩写索引
-        if "msc" in title: index["msc"].append(doc); index["master"].append(doc)
-        if "ma" in title: index["ma"].append(doc); index["master"].append(doc)
-        if "bsc" in title: index["bsc"].append(doc); index["bachelor"].append(doc)
-        if "ba" in title: index["ba"].append(doc); index["bachelor"].append(doc)
+        # 缩写索引：按整词识别学位（子串判断会让 "data" / "management" 命中 "ba" / "ma"）
+        abbr, degree = detect_degree(title, str(doc.get("level") or ""))
+        if abbr and not (len(abbr) > 2 and abbr in words):
+            index[abbr].append(doc)
+        if degree:
+            index[degree].append(doc)
         
         # 特殊专业关键词
-        for internal_name, aliases in PROGRAM_ALIASES.items():
-            if any(alias in title for alias in aliases if len(alias) > 3): # 避免 "ba" 匹配 "data"
-                for kw in internal_name.split(): # 使用内部英文名建立索引
-                    index[kw].append(doc)
+        for internal_name in ALIAS_MATCHER.values(title, min_length=4): # 避免 "ba" 匹配 "data"
+            for kw in internal_name.split(): # 使用内部英文名建立索引
+                index[kw].append(doc)
     
     return dict(index)
 
-def _load_documents() -> List[Dict]:
-    """加载文档并建立索引"""
-    global _GLOBAL_DOCS, _PROGRAM_INDEX
-    
-    if _GLOBAL_DOCS:
-        return _GLOBAL_DOCS
-    
+def _read_source_documents() -> List[Dict]:
+    """从 public/data 读取原始文档"""
     docs = []
     for path in (PROGRAMS_PATH, SERVICES_PATH):
         if path.exists():
@@ -112,22 +197,328 @@ def _load_documents() -> List[Dict]:
                 logger.warning(f"⚠️ 加载 {path.name} 失败: {e}")
     
     logger.info(f"📚 总共加载 {len(docs)} 个文档")
-    
-    _GLOBAL_DOCS = docs
-    _PROGRAM_INDEX = _build_program_index(docs)
-    logger.info(f"📑 建立索引: {len(_PROGRAM_INDEX)} 个关键词")
-    
     return docs
 
+class CorpusSnapshot:
+    """
+    一份不可变的语料快照：文档 + 专业索引 + BM25F 全文索引 + 章节段落索引 + 结构化字段索引
+
+    检索只读索引与每个文档的标题 / 学位类别（titles / degrees），只有最终返回的前 top_k 个结果
+    才按编号取 docs[i]。共享语料制品（mmap）模式下这些索引与列都留在 mmap 中，
+    各 worker 不再各自解码全部文档或重建索引。
+    查询开始时取一次快照并一直使用它；热重载只替换全局引用，
+    正在执行的查询继续读旧快照，不会看到新旧混杂的文档与索引。
+    """
+    __slots__ = (
+        "docs", "program_index", "program_ids", "text_index", "passage_index", "field_index", "key_ids",
+        "titles", "degrees", "fingerprint", "version", "loaded_at", "source"
+    )
+
+    def __init__(
+        self,
+        docs,
+        program_index,
+        indexes: Dict[str, Any],
+        fingerprint: str = "",
+        version: int = 1,
+        source: str = "memory"
+    ) -> None:
+        self.docs = docs
+        self.program_index = program_index
+        self.program_ids = _program_ids(docs, program_index)
+        self.text_index: BM25FIndex = indexes["text_index"]
+        self.passage_index: PassageIndex = indexes["passage_index"]
+        self.field_index: FieldIndex = indexes["field_index"]
+        # 语义检索器的文档键（url，缺省为标题）-> (文档编号,)
+        self.key_ids = indexes["key_ids"]
+        self.titles = indexes["titles"]
+        self.degrees = indexes["degrees"]
+        self.fingerprint = fingerprint
+        self.version = version
+        self.loaded_at = time.time()
+        self.source = source
+
+    @classmethod
+    def from_documents(cls, docs: List[Dict], fingerprint: str = "", version: int = 1) -> "CorpusSnapshot":
+        docs = [unify_document(doc) for doc in docs]
+        return cls(docs, _build_program_index(docs), _build_search_indexes(docs), fingerprint, version)
+
+    @classmethod
+    def from_artifact(cls, corpus, fingerprint: str = "", version: int = 1) -> "CorpusSnapshot":
+        """打开共享语料制品（需要由 _ensure_artifact 构建，带检索索引）"""
+        return cls(corpus.docs, corpus.index, _open_search_indexes(corpus), fingerprint, version, "mmap")
+
+    def doc_id(self, key: str) -> Optional[int]:
+        """语义检索器的文档键 -> 文档编号"""
+        entry = self.key_ids.get(key)
+        return entry[0][0] if entry is not None else None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "fingerprint": self.fingerprint,
+            "documents": len(self.docs),
+            "index_keys": len(self.program_index),
+            "index_terms": len(self.text_index),
+            "passages": len(self.passage_index),
+            "source": self.source,
+            "loaded_at": round(self.loaded_at, 3),
+        }
+
+
+def _build_search_indexes(docs: List[Dict]) -> Dict[str, Any]:
+    """
+    统一结构的文档 -> 检索索引与每个文档的标题 / 学位类别
+
+    NormDoc 只在构建期间存在，不随快照保留。
+    """
+    # 先登记分词用户词典，语料与之后的查询按同一套词典切分
+    user_words = sorted(domain_vocab(docs))
+    _register_user_words(user_words)
+    norm_docs = [normalize_document(doc) for doc in docs]
+    key_ids: Dict[str, Tuple[array]] = {}
+    for i, doc in enumerate(docs):
+        key = doc.get("url") or doc.get("title")
+        if key and key not in key_ids:
+            key_ids[key] = (array("i", [i]),)
+    return {
+        "text_index": BM25FIndex.build(norm.index_record() for norm in norm_docs),
+        "passage_index": PassageIndex.build(norm_docs, _heading_groups),
+        "field_index": FieldIndex.build(norm_docs),
+        "key_ids": key_ids,
+        "titles": [norm.title for norm in norm_docs],
+        "degrees": [norm.degree for norm in norm_docs],
+        "user_words": user_words,
+    }
+
+
+def _write_search_indexes(docs: List[Dict], writer) -> None:
+    """构建共享语料制品时一并写入检索索引（corpus_store.ensure_artifact 的 extra）"""
+    indexes = _build_search_indexes(docs)
+    indexes["text_index"].export(writer)
+    indexes["passage_index"].export(writer)
+    indexes["field_index"].export(writer)
+    writer.table("key_ids", indexes["key_ids"], "i")
+    writer.strings("titles", indexes["titles"])
+    writer.strings("degrees", indexes["degrees"])
+    writer.json("user_words", indexes["user_words"])
+
+
+def _open_search_indexes(corpus) -> Dict[str, Any]:
+    """从共享语料制品打开检索索引（数据留在 mmap 中）"""
+    _register_user_words(corpus.json("user_words"))
+    return {
+        "text_index": BM25FIndex.from_artifact(corpus),
+        "passage_index": PassageIndex.from_artifact(corpus),
+        "field_index": FieldIndex.from_artifact(corpus),
+        "key_ids": corpus.table("key_ids"),
+        "titles": corpus.strings("titles"),
+        "degrees": corpus.strings("degrees"),
+    }
+
+
+def _register_user_words(words) -> int:
+    """分词用户词典：专业中文别名 + 语料标题中的领域词；有新词时清空查询分析缓存"""
+    aliases = (alias for aliases in PROGRAM_ALIASES.values() for alias in aliases)
+    added = get_segmenter().add_words(itertools.chain(aliases, words))
+    if added:
+        analyze_query.cache_clear()
+    return added
+
+
+class _MappedProgramIds:
+    """共享制品中的专业索引 关键词 -> 文档编号（按需读取，不在进程内展开）"""
+    __slots__ = ("_index",)
+
+    def __init__(self, index) -> None:
+        self._index = index
+
+    def get(self, key: str, default=()):
+        return self._index.ids(key) or default
+
+
+def _program_ids(docs, program_index):
+    """专业索引 关键词 -> 文档编号（共享制品的索引本身就按编号存储）"""
+    if hasattr(program_index, "ids"):
+        return _MappedProgramIds(program_index)
+    positions = {id(doc): i for i, doc in enumerate(docs)}
+    return {key: [positions[id(doc)] for doc in values] for key, values in program_index.items()}
+
+
+def _corpus_sources() -> Tuple[Path, Path]:
+    return (PROGRAMS_PATH, SERVICES_PATH)
+
+
+def _build_snapshot(version: int) -> CorpusSnapshot:
+    """从源文件构建新快照（不修改全局状态，可在后台线程中执行）"""
+    from scripts.corpus_store import source_fingerprint
+    fingerprint = source_fingerprint(_corpus_sources())
+
+    if USE_CORPUS_MMAP:
+        try:
+            corpus = _ensure_artifact()
+            logger.info(f"🗺️ 使用共享语料制品 {corpus.path}: {len(corpus.docs)} 个文档, {len(corpus.index)} 个关键词")
+            return CorpusSnapshot.from_artifact(corpus, corpus.manifest.get("fingerprint", fingerprint), version)
+        except Exception as e:
+            logger.warning(f"⚠️ 共享语料制品不可用，回退到进程内加载: {e}")
+
+    snapshot = CorpusSnapshot.from_documents(_read_source_documents(), fingerprint, version)
+    logger.info(f"📑 建立索引: {len(snapshot.program_index)} 个关键词")
+    return snapshot
+
+
+def _read_unified_documents() -> List[Dict]:
+    return [unify_document(doc) for doc in _read_source_documents()]
+
+
+def _ensure_artifact(embed=None):
+    """打开（必要时构建）共享语料制品：统一结构的文档 + 专业索引 + 检索索引，可选语义向量"""
+    from scripts.corpus_store import ensure_artifact
+    return ensure_artifact(
+        _corpus_sources(), _read_unified_documents, _build_program_index,
+        embed=embed, extra=_write_search_indexes
+    )
+
+
+def _current_snapshot() -> CorpusSnapshot:
+    """当前语料快照（首次调用时加载）"""
+    snapshot = _SNAPSHOT
+    if snapshot is not None:
+        return snapshot
+    with _SNAPSHOT_LOCK:
+        if _SNAPSHOT is None:
+            _install_snapshot(_build_snapshot(version=1))
+        return _SNAPSHOT
+
+
+def _install_snapshot(snapshot: CorpusSnapshot) -> None:
+    global _SNAPSHOT
+    _SNAPSHOT = snapshot
+
+
+def corpus_info() -> Optional[Dict[str, Any]]:
+    """当前快照的版本信息（尚未加载时为 None）"""
+    snapshot = _SNAPSHOT
+    return snapshot.info() if snapshot is not None else None
+
+
+def _load_documents() -> List[Dict]:
+    """加载文档并建立索引（返回当前快照的文档）"""
+    return _current_snapshot().docs
+
+
+_RELOAD_LOCK = threading.Lock()
+
+
+def reload_corpus(force: bool = False) -> Dict[str, Any]:
+    """
+    热重载语料：在调用线程中构建新快照与索引，完成后原子替换全局引用
+
+    源文件指纹未变化且 force=False 时跳过。已有语义检索器时一并重建，
+    新向量算好之前旧检索器继续服务。同一时间只允许一次重载。
+    """
+    global _SEMANTIC_RETRIEVER
+    from scripts.corpus_store import source_fingerprint
+
+    with _RELOAD_LOCK:
+        old = _SNAPSHOT
+        fingerprint = source_fingerprint(_corpus_sources())
+        if old is not None and not force and old.fingerprint == fingerprint:
+            return {"reloaded": False, "reason": "unchanged", **old.info()}
+
+        t0 = time.perf_counter()
+        snapshot = _build_snapshot(version=(old.version + 1) if old else 1)
+        report: Dict[str, Any] = {"reloaded": True, "previous_version": old.version if old else None}
+
+        if _SEMANTIC_RETRIEVER is not None:
+            try:
+                _SEMANTIC_RETRIEVER = _create_semantic_retriever(snapshot)
+            except Exception as e:
+                logger.warning(f"⚠️ 语义向量重建失败，继续使用旧向量: {e}")
+
+        with _SNAPSHOT_LOCK:
+            _install_snapshot(snapshot)
+        report.update(snapshot.info())
+        report["build_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    logger.info(f"🔄 语料已热重载: {report}")
+    return report
+
+
+def _document_keys(snapshot: CorpusSnapshot) -> List[str]:
+    """各文档的语义检索键（url，缺省为标题；重复的键只属于第一个文档）"""
+    keys = [""] * len(snapshot.docs)
+    for key, (ids,) in snapshot.key_ids.items():
+        keys[ids[0]] = key
+    return keys
+
+
+def _create_semantic_retriever(snapshot: CorpusSnapshot):
+    """为快照创建预计算好向量的语义检索器"""
+    from scripts.enhanced_retriever import create_retriever
+    if snapshot.source == "mmap":
+        # 向量随语料制品只算一次，各 worker 以 mmap 共享
+        retriever = create_retriever(enable_semantic=True)
+        corpus = _ensure_artifact(embed=retriever.embed_documents)
+        if corpus.embeddings is not None:
+            retriever.attach_embeddings(snapshot.docs, corpus.embeddings, _document_keys(snapshot))
+        return retriever
+    return create_retriever(enable_semantic=True, preload_documents=list(snapshot.docs))
+
+def warmup(precompute_embeddings: bool = False) -> Dict[str, Any]:
+    """
+    启动预热：加载语料、建立专业索引、加载分词词典，可选预计算语义向量
+
+    这些工作原本都推迟到第一个（中文）请求时才做。返回各步骤耗时（毫秒）。
+    """
+    global _SEMANTIC_RETRIEVER
+
+    report: Dict[str, Any] = {}
+    # 分词词典在后台线程加载，与读取语料并行
+    segmenter = get_segmenter()
+    segmenter.load_async()
+
+    t0 = time.perf_counter()
+    snapshot = _current_snapshot()
+    docs = snapshot.docs
+    report["documents"] = len(docs)
+    report["index_keys"] = len(snapshot.program_index)
+    report["index_terms"] = len(snapshot.text_index)
+    report["load_documents_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    t0 = time.perf_counter()
+    segmenter.load()
+    report["segmenter_wait_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    report["user_words"] = segmenter.user_words
+
+    # 走一遍检索，提前触发各代码路径的首次开销
+    t0 = time.perf_counter()
+    _batch_smart_search(["computer science msc", "计算机 语言要求"], snapshot, top_k=1)
+    report["search_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    if precompute_embeddings:
+        t0 = time.perf_counter()
+        try:
+            _SEMANTIC_RETRIEVER = _create_semantic_retriever(snapshot)
+            report["embeddings"] = len(_SEMANTIC_RETRIEVER._doc_embeddings_cache)
+        except Exception as e:
+            logger.warning(f"⚠️ 语义向量预计算失败: {e}")
+            report["embeddings"] = 0
+        report["embeddings_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    logger.info(f"🔥 预热完成: {report}")
+    return report
+
 def _extract_program_name(query: str) -> Optional[str]:
     """✅ [本次修复] 从查询中提取专业名称 (支持中文)"""
     query_lower = query.lower()
     
     # 1. 检查中文别名
-    for internal_name, aliases in PROGRAM_ALIASES.items():
-        if any(alias in query_lower for alias in aliases):
-            logger.info(f"💡 检测到别名，匹配到: {internal_name}")
-            return internal_name # 返回内部英文名
+    hits = ALIAS_MATCHER.values(query_lower)
+    if hits:
+        internal_name = min(hits, key=_ALIAS_RANK.__getitem__)
+        logger.info(f"💡 检测到别名，匹配到: {internal_name}")
+        return internal_name # 返回内部英文名
 
     # 2. 检查英文模式
     patterns = [
@@ -145,28 +536,68 @@ def _extract_program_name(query: str) -> Optional[str]:
     return None
 
 
-def _smart_search(query: str, docs: List[Dict], top_k: int = 10) -> List[Dict]:
-    """智能搜索：结合索引查找和相关性评分"""
-    query_lower = query.lower()
+class QueryAnalysis:
+    """
+    一次查询的分析结果：语言、意图、专业名称、学位类别与检索词项
+
+    每个查询只分析一次（analyze_query 带 LRU 缓存，相同查询跨请求复用），
+    检索、章节提取、网络搜索与生成各阶段都读取它。对象只读，可在线程间共享；
+    跨进程传递时只序列化查询文本，在接收方重新分析（见 __reduce__）。
+    """
+    __slots__ = ("query", "language", "intent", "program_name", "program_words", "degree", "terms", "keywords")
+
+    def __init__(self, query: str) -> None:
+        self.query = query
+        self.language = _detect_language(query)
+        self.intent = _detect_intent(query)
+        self.program_name = _extract_program_name(query)
+        self.program_words: Tuple[str, ...] = tuple(dict.fromkeys((self.program_name or "").split()))
+        self.degree = _query_degree(query)
+        # 词项 -> 权重（BM25F 用）；keywords 为按顺序排列的词项（查询本身的词在前）
+        self.terms: Mapping[str, float] = MappingProxyType(_query_terms(query, self.intent))
+        self.keywords: Tuple[str, ...] = tuple(self.terms)
+
+    def __reduce__(self):
+        # terms 是 mappingproxy，不能直接 pickle（进程池）
+        return analyze_query, (self.query,)
+
+
+@lru_cache(maxsize=QUERY_ANALYSIS_CACHE_SIZE)
+def analyze_query(query: str) -> QueryAnalysis:
+    """分析查询（LRU 缓存）"""
+    return QueryAnalysis(query)
+
+
+def _analysis(query: Union[str, QueryAnalysis]) -> QueryAnalysis:
+    return query if isinstance(query, QueryAnalysis) else analyze_query(query)
+
+
+def _program_match_results(
+    analysis: QueryAnalysis,
+    seen_titles: set,
+    snapshot: Optional[CorpusSnapshot] = None,
+    allowed: Optional[FrozenSet[int]] = None
+) -> List[Dict]:
+    """第 1 步：按专业名称索引精确匹配（snapshot 缺省时用当前快照；allowed 为字段过滤后允许的文档编号）"""
     results = []
-    seen_titles = set()
-    
-    # 1. 首先尝试精确匹配专业名称
-    program_name = _extract_program_name(query)
-    program_words = set((program_name or "").split())
+    program_name = analysis.program_name
+    program_words = analysis.program_words
     
     if program_name:
         logger.info(f"🎯 检测到专业名称: {program_name}")
         
-        candidate_docs = [] 
+        snapshot = snapshot or _current_snapshot()
+        candidate_ids = [] 
         for word in program_words:
-            if word in _PROGRAM_INDEX and _PROGRAM_INDEX[word]:
-                candidate_docs.extend(_PROGRAM_INDEX[word]) 
+            candidate_ids.extend(snapshot.program_ids.get(word, ()))
         
-        logger.info(f"📊 找到 {len(candidate_docs)} 个专业相关的候选")
+        logger.info(f"📊 找到 {len(candidate_ids)} 个专业相关的候选")
+        count("candidates", len(candidate_ids))
 
-        for doc in candidate_docs:
-            title = doc.get("title", "")
+        for doc_id in candidate_ids:
+            if allowed is not None and doc_id not in allowed:
+                continue
+            title = snapshot.titles[doc_id]
             if not title or title in seen_titles:
                 continue
             
@@ -182,187 +613,333 @@ def _smart_search(query: str, docs: List[Dict], top_k: int = 10) -> List[Dict]:
             
             if score > 0:
                 results.append({
-                    "doc": doc,
-                    "score": score + _calculate_relevance(doc, [], query), # 加上内容分
-                    "matched_sections": _extract_relevant_sections(doc, query, program_name) # 传入 program_name
+                    "_doc_id": doc_id,
+                    "title": title,
+                    "score": score + _level_bonus(snapshot.degrees[doc_id], analysis.degree), # 加上级别分
+                    "matched_sections": _extract_relevant_sections(snapshot, doc_id, analysis, program_name) # 传入 program_name
                 })
-
     
-    # 2. 关键词搜索
-    keywords = _extract_keywords(query)
-    logger.info(f"📝 关键词: {keywords[:10]}")
+    return results
+
+def _smart_search(
+    query: Union[str, QueryAnalysis],
+    snapshot: Optional[CorpusSnapshot] = None,
+    top_k: int = 10,
+    filters: Optional[Dict[str, Tuple[str, ...]]] = None,
+    deadline: Optional[Deadline] = None
+) -> List[Dict]:
+    """智能搜索：结合索引查找和相关性评分"""
+    return _batch_smart_search([query], snapshot, top_k, filters, deadline)[0]
+
+def _batch_smart_search(
+    queries: List[Union[str, QueryAnalysis]],
+    snapshot: Optional[CorpusSnapshot] = None,
+    top_k: int = 10,
+    filters: Optional[Dict[str, Tuple[str, ...]]] = None,
+    deadline: Optional[Deadline] = None
+) -> List[List[Dict]]:
+    """
+    批量智能搜索（snapshot 缺省时用当前快照；查询可以是文本或已有的 QueryAnalysis）
+
+    filters: 结构化字段过滤（字段 -> 取值，见 scripts/field_index.py），打分前先求出允许的文档，
+    三路检索都只保留这些文档
+
+    1. 专业名称索引精确匹配（90 / 100 分档）
+    2. BM25F 倒排索引检索：只对与查询共享词项的文档打分（MaxScore 剪枝，只保留可能进入前 top_k 的文档），
+       得分按查询上界归一化到 0 ~ KEYWORD_SCORE_SCALE，再加学位级别匹配分
+    3. 语义检索（RETRIEVAL_MODE 为 hybrid / semantic 且向量就绪时）：与 1、2 并发执行，
+       结果按 FUSION_METHOD 融合排序，融合后的结果带 "retrievers" 字段；
+       最多等待 min(SEMANTIC_TIMEOUT, deadline 剩余时间)，请求预算已用完时跳过（记为 "semantic"）
+    4. 有界堆取前 top_k，只为这些结果取文档（mmap 模式下才解码）并从段落索引中取相关章节（带高亮区间）
+
+    1 ~ 3 步的中间结果只带文档编号与标题（"_doc_id" / "title"），不取文档本身。
+    """
+    snapshot = snapshot or _current_snapshot()
+    analyses = [_analysis(query) for query in queries]
+    allowed = snapshot.field_index.allowed(filters)
+    all_results = []
     
-    for doc in docs:
-        title = doc.get("title", "")
-        if not title or title in seen_titles:
-            continue
-        
-        score = _calculate_relevance(doc, keywords, query)
-        if score > 0:
-            results.append({
-                "doc": doc,
-                "score": score,
-                "matched_sections": _extract_relevant_sections(doc, query)
-            })
-            seen_titles.add(title)
+    retriever = _semantic_retriever()
+    semantic_timeout = deadline.timeout(cap=SEMANTIC_TIMEOUT) if deadline is not None else SEMANTIC_TIMEOUT
+    if retriever is not None and deadline is not None and semantic_timeout <= 0:
+        deadline.skip("semantic")
+        retriever = None
+    semantic_future = None
+    if retriever is not None:
+        semantic_future = _semantic_pool().submit(retriever.semantic_scores, [a.query for a in analyses], top_k)
+    use_keyword = retriever is None or RETRIEVAL_MODE != "semantic"
     
-    # 3. 排序并返回
-    results.sort(key=lambda x: x["score"], reverse=True)
-    final_results = results[:top_k]
-    
-    top_score = results[0]['score'] if results else 0
-    logger.info(f"✅ 找到 {len(final_results)} 个相关结果 (Top score: {top_score})")
-    return final_results
-
-def _extract_keywords(query: str) -> List[str]:
-    """✅ [本次修复] 提取查询关键词 (使用 Jieba)"""
-    stopwords = {
-        "what", "how", "where", "when", "which", "who", "the", "a", "an",
-        "is", "are", "was", "were", "do", "does", "did", "about", "for",
-        "of", "in", "on", "at", "to",
-        "的", "是", "有", "在", "吗", "呢", "啊", "了", "和", "与", "什么", "要求", "专业"
-    }
+    keyword_lists = [
+        _keyword_candidates(analysis, snapshot, top_k, allowed) if use_keyword else None
+        for analysis in analyses
+    ]
     
-    keywords = []
-    query_lower = query.lower()
+    semantic_lists = _semantic_results(semantic_future, len(analyses), semantic_timeout)
     
-    # 提取英文单词
-    english_words = re.findall(r'\b[a-z]{3,}\b', query_lower) # 至少3个字母
-    keywords.extend([w for w in english_words if w not in stopwords])
-    
-    # ✅ [修复] 使用 Jieba 提取中文关键词
-    chinese_matches = re.findall(r"[\u4e00-\u9fff]+", query)
-    if HAVE_JIEBA:
-        for chunk in chinese_matches:
-            keywords.extend([
-                token for token in jieba.cut(chunk) 
-                if len(token) > 1 and token not in stopwords
-            ])
-    else:
-        # 降级：如果 jieba 失败
-        for chunk in chinese_matches:
-            for i in range(len(chunk) - 1):
-                keywords.append(chunk[i:i+2])
-
-    # 添加专业相关扩展词 (基于英文意图)
-    intent = _detect_intent(query_lower)
-    if intent == "modules":
-        keywords.extend(["compulsory", "core", "optional", "elective", "curriculum"])
-    if intent in ("requirements", "language_requirements"):
-        keywords.extend(["ielts", "toefl", "gpa", "degree", "qualification", "a-level"])
-    if intent == "fees":
-        keywords.extend(["scholarship", "funding", "payment", "international", "uk", "overseas"])
-    
-    return list(set(keywords))[:30]  # 限制关键词数量
-
-def _calculate_relevance(doc: Dict, keywords: List[str], query: str) -> float:
-    """计算文档相关性得分"""
-    score = 0.0
-    query_lower = query.lower()
+    for analysis, results, semantic_hits in zip(analyses, keyword_lists, semantic_lists):
+        # 3. 融合；4. 取前 top_k，只为最终返回的结果提取相关章节
+        if semantic_hits is None:
+            if results is None:
+                # semantic 模式下语义检索超时或失败：退回关键词检索，而不是返回空结果
+                logger.warning("⚠️ 语义检索不可用，改用关键词检索")
+                results = _keyword_candidates(analysis, snapshot, top_k, allowed)
+            final_results = heapq.nlargest(top_k, results, key=itemgetter("score"))
+        else:
+            final_results = _fuse_results(results or [], semantic_hits, snapshot, top_k, allowed)
+        final_results = [_final_result(result, snapshot, analysis) for result in final_results]
+        
+        top_score = final_results[0]['score'] if final_results else 0
+        logger.info(f"✅ 找到 {len(final_results)} 个相关结果 (Top score: {top_score})")
+        all_results.append(final_results)
     
-    title = (doc.get("title") or "").lower()
+    return all_results
+
+def _keyword_candidates(
+    analysis: QueryAnalysis,
+    snapshot: CorpusSnapshot,
+    top_k: int,
+    allowed: Optional[FrozenSet[int]]
+) -> List[Dict]:
+    """关键词侧候选：专业名称精确匹配 + BM25F 全文检索"""
+    seen_titles = set()
+    # 1. 首先尝试精确匹配专业名称
+    results = _program_match_results(analysis, seen_titles, snapshot, allowed)
     
-    # 关键词匹配
-    for kw in keywords:
-        if kw in title:
-            score += 5
-            if f" {kw} " in f" {title} ":
-                score += 3
+    # 2. 全文检索
+    logger.info(f"📝 检索词: {list(analysis.keywords[:10])}")
+    results.extend(_keyword_results(analysis, snapshot, seen_titles, top_k, allowed))
+    return results
+
+def _final_result(result: Dict, snapshot: CorpusSnapshot, analysis: QueryAnalysis) -> Dict:
+    """中间结果 -> 返回给调用方的结果：按编号取文档，补上相关章节"""
+    doc_id = result["_doc_id"]
+    sections = result["matched_sections"]
+    if sections is None:
+        sections = _extract_relevant_sections(snapshot, doc_id, analysis)
+    final = {"doc": snapshot.docs[doc_id], "score": result["score"], "matched_sections": sections}
+    if "retrievers" in result:
+        final["retrievers"] = result["retrievers"]
+    return final
+
+def _semantic_retriever():
+    """可用的语义检索器（keyword 模式或向量未就绪时为 None）"""
+    if RETRIEVAL_MODE == "keyword":
+        return None
+    retriever = _SEMANTIC_RETRIEVER
+    if retriever is None or not retriever.semantic_ready:
+        return None
+    return retriever
+
+def _semantic_pool() -> ThreadPoolExecutor:
+    global _SEMANTIC_POOL
+    if _SEMANTIC_POOL is None:
+        with _SEMANTIC_POOL_LOCK:
+            if _SEMANTIC_POOL is None:
+                _SEMANTIC_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="semantic")
+    return _SEMANTIC_POOL
+
+def _semantic_results(
+    future,
+    num_queries: int,
+    timeout: float = SEMANTIC_TIMEOUT
+) -> List[Optional[List[Tuple[str, float]]]]:
+    """等待并发的语义检索（最多 timeout 秒）；未执行、超时或失败时对应位置为 None（只用关键词结果）"""
+    if future is None:
+        return [None] * num_queries
+    try:
+        with timed("semantic_search"):
+            return future.result(timeout=timeout)
+    except FutureTimeout:
+        count("semantic_timeouts")
+        logger.warning(f"⏳ 语义检索超过 {timeout:.2f}s，只使用关键词结果")
+    except Exception as e:
+        ERRORS.inc(stage="semantic_search")
+        logger.error(f"❌ 语义检索失败: {e}")
+    return [None] * num_queries
+
+def _fuse_results(
+    keyword_results: List[Dict],
+    semantic_hits: List[Tuple[str, float]],
+    snapshot: CorpusSnapshot,
+    top_k: int,
+    allowed: Optional[FrozenSet[int]] = None
+) -> List[Dict]:
+    """
+    融合关键词与语义检索结果（按标题去重，语义结果只保留 allowed 中的文档），取前 top_k
+
+    rrf: 按 sum(1 / (RRF_K + 名次)) 排序；weighted: 按 (1 - w) * 关键词得分/100 + w * 相似度 排序。
+    结果的 score 取两路中较高的一个（相似度换算到 0 ~ 100），网络搜索兜底等阈值照常适用。
+    """
+    fused: Dict[str, Dict] = {}
+    ranked = sorted(keyword_results, key=itemgetter("score"), reverse=True)
+    for rank, result in enumerate(ranked):
+        if FUSION_METHOD == "weighted":
+            weight = (1 - SEMANTIC_WEIGHT) * min(result["score"] / 100.0, 1.0)
+        else:
+            weight = 1.0 / (RRF_K + rank + 1)
+        fused[result["title"]] = {**result, "retrievers": ["keyword"], "_fusion": weight}
     
-    # 级别匹配
-    level = str(doc.get("level", "")).lower()
-    if "msc" in query_lower or "master" in query_lower or "硕士" in query:
-        if "msc" in level or "master" in level:
-            score += 10
-    elif "bsc" in query_lower or "bachelor" in query_lower or "本科" in query:
-        if "bsc" in level or "bachelor" in level:
-            score += 10
-    
-    # 内容匹配
-    sections = doc.get("sections", [])
-    for section in sections[:20]:
-        if not isinstance(section, dict): continue
-        heading = (section.get("heading") or "").lower()
-        text = (section.get("text") or "").lower()
-        
-        section_score = 0
-        for kw in keywords[:15]:
-            if kw in heading: section_score += 3
-            if kw in text: section_score += 0.5
-        
-        score += min(section_score, 10)
+    for rank, (key, similarity) in enumerate(semantic_hits):
+        doc_id = snapshot.doc_id(key)
+        if doc_id is None or (allowed is not None and doc_id not in allowed):
+            continue
+        title = snapshot.titles[doc_id]
+        if not title:
+            continue
+        entry = fused.get(title)
+        if entry is None:
+            entry = fused[title] = {
+                "_doc_id": doc_id, "title": title, "score": 0.0, "matched_sections": None,
+                "retrievers": [], "_fusion": 0.0
+            }
+        if FUSION_METHOD == "weighted":
+            entry["_fusion"] += SEMANTIC_WEIGHT * similarity
+        else:
+            entry["_fusion"] += 1.0 / (RRF_K + rank + 1)
+        entry["score"] = max(entry["score"], round(SEMANTIC_SCORE_SCALE * similarity, 2))
+        entry["retrievers"].append("semantic")
     
-    return score
+    return heapq.nlargest(top_k, fused.values(), key=itemgetter("_fusion"))
 
-def _extract_relevant_sections(doc: Dict, query: str, program_name: Optional[str] = None) -> List[Dict]:
-    """提取相关章节"""
-    query_lower = query.lower()
-    keywords = _extract_keywords(query)
-    relevant_sections = []
+def _keyword_results(
+    analysis: QueryAnalysis,
+    snapshot: CorpusSnapshot,
+    seen_titles: set,
+    top_k: int,
+    allowed: Optional[FrozenSet[int]] = None
+) -> List[Dict]:
+    """
+    BM25F 检索结果（跳过 seen_titles 中已有的标题；allowed 给定时只为其中的文档打分）
+
+    向索引要 top_k + 已占用标题数 个结果，并把学位级别匹配分折算成 slack，
+    保证加分后可能进入前 top_k 的文档不被剪掉；重名文档过多导致不够 top_k 时不剪枝重查一次。
+    """
+    terms = analysis.terms
+    bound = snapshot.text_index.upper_bound(terms)
+    if bound <= 0:
+        return []
     
-    sections = doc.get("sections", [])
+    limit: Optional[int] = top_k + len(seen_titles)
+    # 归一化得分保留两位小数，slack 多留一点余量
+    slack = (LEVEL_BONUS + 0.01) * bound / KEYWORD_SCORE_SCALE if analysis.degree else 0.0
+    stats: Dict[str, int] = {}
+    while True:
+        hits = snapshot.text_index.search(terms, limit, slack, allowed, stats)
+        titles = set(seen_titles)
+        results = []
+        for doc_id, raw in hits:
+            title = snapshot.titles[doc_id]
+            if not title or title in titles:
+                continue
+            titles.add(title)
+            results.append({
+                "_doc_id": doc_id,
+                "title": title,
+                "score": round(KEYWORD_SCORE_SCALE * raw / bound, 2) + _level_bonus(snapshot.degrees[doc_id], analysis.degree),
+                "matched_sections": None
+            })
+        if limit is None or len(results) >= top_k or len(hits) < limit:
+            break
+        limit = None
     
+    count("docs_scored", stats.get("scored", 0))
+    count("candidates", len(results))
+    seen_titles.update(titles)
+    return results
+
+def _query_terms(query: str, intent: str) -> Dict[str, float]:
+    """查询 -> BM25F 检索词项及权重（意图扩展词降权）"""
+    terms = {term: 1.0 for term in tokenize(query)}
+    for word in INTENT_EXPANSIONS.get(intent, ()):
+        for term in tokenize(word):
+            terms.setdefault(term, EXPANSION_WEIGHT)
+    return terms
+
+def _query_degree(query: str) -> Optional[str]:
+    """查询中提到的学位类别：master / bachelor / None"""
+    query_lower = query.lower()
+    if "msc" in query_lower or "master" in query_lower or "硕士" in query:
+        return "master"
+    if "bsc" in query_lower or "bachelor" in query_lower or "本科" in query:
+        return "bachelor"
+    return None
+
+def _level_bonus(doc_degree: str, degree: Optional[str]) -> float:
+    """学位级别匹配分：查询提到硕士 / 本科且文档学位一致时 +LEVEL_BONUS"""
+    return LEVEL_BONUS if degree and doc_degree == degree else 0
+
+# 各意图优先的章节标题关键词
+SECTION_PRIORITY_TERMS = {
+    "module": ["module", "course", "curriculum", "syllabus", "课程", "模块", "compulsory", "optional"],
+    "requirement": ["requirement", "entry", "admission", "qualification", "要求", "入学", "a-level", "ib diploma"],
+    "fee": ["fee", "tuition", "cost", "scholarship", "学费", "费用", "funding"],
+    "language_requirement": ["ielts", "toefl", "language", "english", "语言", "雅思", "托福"],
+    "career": ["career", "employment", "job", "prospect", "就业", "职业"],
+}
+# 精确的专业搜索时额外优先的章节
+PROGRAM_PRIORITY_HEADINGS = ["about this degree"]
+
+# 章节标题 -> 命中的优先章节组（SECTION_PRIORITY_TERMS 的键，或 "program"）
+HEADING_MATCHER = MultiPatternMatcher(
+    [(term, group) for group, terms in SECTION_PRIORITY_TERMS.items() for term in terms]
+    + [(term, "program") for term in PROGRAM_PRIORITY_HEADINGS]
+)
+
+@lru_cache(maxsize=QUERY_ANALYSIS_CACHE_SIZE)
+def _heading_groups(heading_lower: str) -> FrozenSet[str]:
+    """章节标题命中的优先章节组（各文档的章节标题大量重复，按标题缓存）"""
+    return frozenset(HEADING_MATCHER.values(heading_lower))
+
+def _extract_relevant_sections(
+    snapshot: CorpusSnapshot,
+    doc_id: int,
+    analysis: QueryAnalysis,
+    program_name: Optional[str] = None
+) -> List[Dict]:
+    """
+    提取相关章节：在快照的段落索引中查该文档的段落（见 scripts/passage_index.py）
+
+    意图对应的优先章节 +20，查询词命中章节标题 +3、命中正文 +1，取前 5 个；
+    每个片段带 highlights（正文中查询词的字符区间，供前端高亮）。
+    """
     # [新] 优先章节 (匹配查询意图)
-    priority_headings = []
-    priority_terms = {
-        "module": ["module", "course", "curriculum", "syllabus", "课程", "模块", "compulsory", "optional"],
-        "requirement": ["requirement", "entry", "admission", "qualification", "要求", "入学", "a-level", "ib diploma"],
-        "fee": ["fee", "tuition", "cost", "scholarship", "学费", "费用", "funding"],
-        "language_requirement": ["ielts", "toefl", "language", "english", "语言", "雅思", "托福"],
-        "career": ["career", "employment", "job", "prospect", "就业", "职业"],
-    }
-    
-    intent = _detect_intent(query_lower)
-    if intent in priority_terms:
-        priority_headings = priority_terms[intent]
+    priority_groups = {analysis.intent}
 
     # ✅ [新] 如果是精确的专业搜索，"About this degree" 也是高优先级
     if program_name:
-        priority_headings.append("about this degree")
+        priority_groups.add("program")
 
-    for section in sections:
-        if not isinstance(section, dict):
-            continue
-        
-        heading = section.get("heading", "")
-        text = section.get("text", "")
-        
-        if not text:
-            continue
-        
-        relevance = 0
-        heading_lower = heading.lower()
-        text_lower = text.lower()
-        
-        # 1. 意图匹配 (最高权重)
-        if any(term in heading_lower for term in priority_headings):
-            relevance += 20
-        
-        # 2. 关键词匹配
-        for kw in keywords[:10]:
-            if kw in heading_lower:
-                relevance += 3
-            if kw in text_lower:
-                relevance += 1
-        
-        if relevance > 0:
-            relevant_sections.append({
-                "heading": heading,
-                "text": text[:800],
-                "score": relevance
-            })
-    
-    relevant_sections.sort(key=lambda x: x["score"], reverse=True)
-    return relevant_sections[:5] 
+    return snapshot.passage_index.select(doc_id, analysis.keywords[:10], priority_groups, limit=5, max_chars=800)
+
+def search_passages(
+    query: Union[str, QueryAnalysis],
+    top_k: int = 5,
+    snapshot: Optional[CorpusSnapshot] = None
+) -> List[Dict]:
+    """段落级检索：直接以章节为单位按 BM25 排序（结果带所属文档、片段与高亮区间）"""
+    snapshot = snapshot or _current_snapshot()
+    analysis = _analysis(query)
+    index = snapshot.passage_index
+    results = []
+    for pid, score in index.search(analysis.terms, top_k):
+        passage = index.passage(pid)
+        results.append({
+            "doc": snapshot.docs[passage.doc_id],
+            "heading": passage.heading,
+            "text": passage.text[:800],
+            "score": round(score, 4),
+            "highlights": index.highlights(pid, analysis.terms, 800),
+        })
+    return results
 
-def _format_context_for_llm(results: List[Dict]) -> str:
+def _format_context_for_llm(results: List[Dict], max_docs: int = 3, max_chars: int = 600) -> str:
     """为LLM准备本地文档的上下文 (移除 '本地' 字样)"""
     if not results:
         return ""
     
     context_parts = []
     
-    for i, result in enumerate(results[:3], 1): # 只取 Top 3 文档
+    for i, result in enumerate(results[:max_docs], 1): # 默认只取 Top 3 文档
         doc = result.get("doc", {})
         title = doc.get("title", "")
         sections = result.get("matched_sections", [])
@@ -379,11 +956,9 @@ def _format_context_for_llm(results: List[Dict]) -> str:
                 if heading:
                     context_parts.append(f"\n▸ {heading}")
                 
+                # 段落正文在建索引时已清理空白，这里只截断
                 if text:
-                    text = text.replace("\u00a0", " ")
-                    text = re.sub(r'\s+', ' ', text)
-                    text = text[:600]
-                    context_parts.append(f"  {text}")
+                    context_parts.append(f"  {text[:max_chars]}")
         
         context_parts.append("")
     
@@ -404,28 +979,24 @@ def _pick_best_snippets_from_web(results: List[Dict]) -> str:
     
     return "\n".join(parts)[:1500]
 
-def _generate_comprehensive_answer(context: str, query: str, language: str, has_high_score_local: bool) -> str:
+def _no_context_answer(language: str) -> str:
+    """没有任何上下文时的固定回复"""
+    if language == "zh":
+        return "抱歉，未找到与您查询相关的信息。请尝试使用更具体的关键词或查询其他专业。"
+    else:
+        return "Sorry, no relevant information found. Please try with more specific keywords or search for other programs."
+
+def _build_llm_messages(context: str, query: str, language: str, has_high_score_local: bool) -> List[Dict]:
     """
     ✅ [本次修复] 动态提示词
     """
-    
-    if not context:
+    # ✅ [新] 动态选择提示词
+    if has_high_score_local:
+        # 场景 1: 本地找到了高分匹配 (如 "Data Science MSc")
+        # 使用严格的、聚焦的提示词
+        logger.info("🤖 使用 [高分聚焦] 提示词...")
         if language == "zh":
-            return "抱歉，未找到与您查询相关的信息。请尝试使用更具体的关键词或查询其他专业。"
-        else:
-            return "Sorry, no relevant information found. Please try with more specific keywords or search for other programs."
-    
-    if os.getenv("GROQ_API_KEY"):
-        try:
-            from scripts.llm_client import chat_with_groq
-            
-            # ✅ [新] 动态选择提示词
-            if has_high_score_local:
-                # 场景 1: 本地找到了高分匹配 (如 "Data Science MSc")
-                # 使用严格的、聚焦的提示词
-                logger.info("🤖 使用 [高分聚焦] 提示词...")
-                if language == "zh":
-                    system_prompt = """你是UCL（伦敦大学学院）的AI助手。
+            system_prompt = """你是UCL（伦敦大学学院）的AI助手。
 你的**首要任务**是精准回答用户关于**特定专业**的查询。
 上下文可能包含多个文档，你**必须**优先使用标题与用户查询最匹配的文档。
 
@@ -435,8 +1006,8 @@ def _generate_comprehensive_answer(context: str, query: str, language: str, has_
 3.  **处理坏数据 (关键)**：如果一个文档中同时包含 `Compulsory modules` (模块列表) 和 `Teaching and learning` (教学描述)，你 **必须** 优先使用 `Compulsory modules` 里的列表。**必须忽略** `Teaching and learning` 中关于 "one compulsory module" 之类的模糊总结。
 4.  **格式**：使用要点，并在要点之间添加空行 (`\n\n`)。
 5.  **态度**：直接回答问题，不要说 "根据找到的信息" 或 "本地文档"。"""
-                else:
-                    system_prompt = """You are a UCL AI assistant.
+        else:
+            system_prompt = """You are a UCL AI assistant.
 Your **primary goal** is to answer the user's query about a **specific program**.
 The context contains multiple documents. You **MUST** prioritize the document whose title *best matches* the user's query.
 
@@ -446,12 +1017,12 @@ The context contains multiple documents. You **MUST** prioritize the document wh
 3.  **Handle Bad Data (Critical)**: If a document contains both a `Compulsory modules` section (a list) and a `Teaching and learning` section (a vague summary), you **MUST** use the `Compulsory modules` list. **You MUST IGNORE** vague summaries like "students will take one compulsory module" found in other sections.
 4.  **Format**: Use bullet points, with blank lines (`\n\n`) between them for readability.
 5.  **Tone**: Be direct. Do not say "Based on the information found" or "local documents"."""
-            else:
-                # 场景 2: 本地结果分数低，或使用了网络搜索 (如 "全球健康管理")
-                # 使用宽松的、总结性的提示词
-                logger.info("🤖 使用 [通用总结] 提示词...")
-                if language == "zh":
-                    system_prompt = """你是UCL（伦敦大学学院）的AI助手。
+    else:
+        # 场景 2: 本地结果分数低，或使用了网络搜索 (如 "全球健康管理")
+        # 使用宽松的、总结性的提示词
+        logger.info("🤖 使用 [通用总结] 提示词...")
+        if language == "zh":
+            system_prompt = """你是UCL（伦敦大学学院）的AI助手。
 你的任务是**友好地总结**上下文中与用户问题相关的**所有**信息。
 
 **规则：**
@@ -459,8 +1030,8 @@ The context contains multiple documents. You **MUST** prioritize the document wh
 2.  **必须回答**：**必须**根据上下文提供回答。不要说 "抱歉，我无法回答"，而是总结你找到的内容。
 3.  **格式**：使用要点，并在要点之间添加空行 (`\n\n`)。
 4.  **态度**：直接回答问题。如果信息来自知乎或百度，可以非正式地引用标题。"""
-                else:
-                    system_prompt = """You are a UCL AI assistant.
+        else:
+            system_prompt = """You are a UCL AI assistant.
 Your task is to **helpfully summarize ALL** information from the context that is relevant to the user's query.
 
 **Rules:**
@@ -469,36 +1040,131 @@ Your task is to **helpfully summarize ALL** information from the context that is
 3.  **Format**: Use bullet points, with blank lines (`\n\n`) between them for readability.
 4.  **Tone**: Be direct and helpful."""
 
-            
-            user_prompt = f"""Question: {query}
+    
+    user_prompt = f"""Question: {query}
 
 Available Information:
 {context}
 
 Please provide a focused and accurate answer based on these rules."""
+    
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _is_tight(deadline: Optional[Deadline]) -> bool:
+    """剩余时间紧张：缩短上下文与输出长度"""
+    return deadline is not None and not deadline.allows(LLM_TIGHT_BUDGET)
+
+def _llm_max_tokens(deadline: Optional[Deadline]) -> int:
+    return 512 if _is_tight(deadline) else 1024
+
+def _generate_comprehensive_answer(
+    context: str,
+    query: str,
+    language: str,
+    has_high_score_local: bool,
+    deadline: Optional[Deadline] = None
+) -> str:
+    """调用 LLM 生成完整回答，失败或来不及调用时降级为上下文原文"""
+    
+    if not context:
+        return _no_context_answer(language)
+    
+    if deadline is not None and not deadline.allows(LLM_MIN_BUDGET):
+        deadline.skip("llm")
+        return context
+    
+    if os.getenv("GROQ_API_KEY"):
+        try:
+            from scripts.llm_client import chat_with_groq
             
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
+            with timed("prompt_build"):
+                messages = _build_llm_messages(context, query, language, has_high_score_local)
             
-            answer = chat_with_groq(
-                messages=messages,
-                temperature=0.0,
-                max_retries=2,
-                model="llama-3.3-70b-versatile"
-            )
+            with timed("llm"):
+                answer = chat_with_groq(
+                    messages=messages,
+                    temperature=0.0,
+                    max_retries=2,
+                    model="llama-3.3-70b-versatile",
+                    max_tokens=_llm_max_tokens(deadline),
+                    deadline=deadline
+                )
             
             if answer and len(answer.strip()) > 30:
                 return answer.strip() 
             else:
                 logger.warning("LLM 返回过短，降级到简单格式化")
 
+        except DeadlineExceeded as e:
+            # 来不及（再）调用 LLM：与预算不足时一样，返回上下文原文
+            if deadline is not None:
+                deadline.skip("llm")
+            logger.warning(f"⏱️ LLM 调用超出截止时间，返回上下文: {e}")
         except Exception as e:
+            ERRORS.inc(stage="llm")
             logger.error(f"❌ LLM调用失败: {e}")
     
     return context 
 
+def _stream_comprehensive_answer(
+    context: str,
+    query: str,
+    language: str,
+    has_high_score_local: bool,
+    deadline: Optional[Deadline] = None
+) -> Iterator[str]:
+    """流式版本的 _generate_comprehensive_answer，逐段产出回答文本"""
+    
+    if not context:
+        yield _no_context_answer(language)
+        return
+    
+    if deadline is not None and not deadline.allows(LLM_MIN_BUDGET):
+        deadline.skip("llm")
+        yield context
+        return
+    
+    if os.getenv("GROQ_API_KEY"):
+        emitted = False
+        try:
+            from scripts.llm_client import stream_chat_with_groq
+            
+            messages = _build_llm_messages(context, query, language, has_high_score_local)
+            
+            with timed("llm_stream"):
+                for delta in stream_chat_with_groq(
+                    messages=messages,
+                    temperature=0.0,
+                    max_retries=2,
+                    model="llama-3.3-70b-versatile",
+                    max_tokens=_llm_max_tokens(deadline),
+                    deadline=deadline
+                ):
+                    emitted = True
+                    yield delta
+            
+            if emitted:
+                return
+            logger.warning("LLM 流式返回为空，降级到简单格式化")
+
+        except DeadlineExceeded as e:
+            if deadline is not None:
+                deadline.skip("llm")
+            logger.warning(f"⏱️ LLM 流式调用超出截止时间: {e}")
+            if emitted:
+                return
+        except Exception as e:
+            ERRORS.inc(stage="llm")
+            logger.error(f"❌ LLM流式调用失败: {e}")
+            if emitted:
+                # 已经输出了部分回答，不再追加上下文原文
+                return
+    
+    yield context
+
 def _detect_language(text: str) -> str:
     """检测语言"""
     if not text: return "en"
@@ -513,58 +1179,50 @@ def _detect_intent(query: str) -> str:
     q_lower = query.lower()
     
     # [新] 使用别名来检测意图
-    for intent, aliases in PROGRAM_ALIASES.items():
-        if any(alias in q_lower for alias in aliases):
-            # 这是一个 "known_entity" 意图，但我们按要求返回特定意图
-            if intent in ("language_requirements", "requirements", "modules", "fees"):
-                return intent
+    # 这是一个 "known_entity" 意图，但我们按要求返回特定意图
+    alias_intents = [name for name in ALIAS_MATCHER.values(q_lower) if name in ALIAS_INTENTS]
+    if alias_intents:
+        return min(alias_intents, key=_ALIAS_RANK.__getitem__)
     
     # 原始意图检测
-    intent_patterns = {
-        "career": ["career", "employment", "job", "prospect", "就业", "职业"],
-        "services": ["service", "support", "counseling", "咨询", "服务"]
-    }
-    for intent, patterns in intent_patterns.items():
-        if any(p in q_lower for p in patterns):
-            return intent
+    intents = INTENT_MATCHER.values(q_lower)
+    if intents:
+        return min(intents, key=_INTENT_RANK.__getitem__)
     
     return "general"
 
-def answer_enhanced(
-    query: str,
-    top_k: int = 10,
-    language: str = "auto",
-    **kwargs
-) -> Dict[str, Any]:
-    """主入口函数 - 终极优化版 (Web 搜索集成)"""
-    start_time = time.time()
-    
-    if language == "auto":
-        language = _detect_language(query)
-    
-    intent = _detect_intent(query)
-    
-    logger.info(f"🔍 查询: '{query[:100]}...' | 语言: {language} | 意图: {intent}")
-    
-    docs = _load_documents()
-    
-    local_results = _smart_search(query, docs, top_k)
-    
+def _web_fallback(
+    analysis: QueryAnalysis,
+    language: str,
+    local_results: List[Dict],
+    deadline: Optional[Deadline] = None
+) -> Tuple[bool, str, List[Dict]]:
+    """
+    本地结果不足时启动网络搜索，返回 (是否使用, 网络上下文, 网络引用)
+
+    超时取剩余时间减去留给 LLM 的时间（最多 WEB_SEARCH_MAX 秒），不足 WEB_SEARCH_MIN 时跳过。
+    """
+    query = analysis.query
+    intent = analysis.intent
     web_search_used = False
     web_context = ""
     web_citations: List[Dict] = []
 
-    top_score = 0
-    if local_results:
-        top_score = local_results[0].get("score", 0)
+    top_score = _top_score(local_results)
 
     # 触发条件：1. 本地没结果, 或 2. 本地最高分 < 30
     if (not local_results or top_score < 30) and HAVE_WEB_SEARCH:
+        timeout = deadline.timeout(cap=WEB_SEARCH_MAX, reserve=LLM_RESERVE) if deadline else WEB_SEARCH_MAX
+        if timeout < WEB_SEARCH_MIN:
+            deadline.skip("web_search")
+            return web_search_used, web_context, web_citations
+        
         logger.warning(f"⚠️ 本地结果不足 (Top score: {top_score}). 启动网络搜索 for '{query}'...")
+        WEB_SEARCH_FALLBACKS.inc()
         try:
             # ✅ [本次修复] 优化中文的网络搜索
             search_query = query
-            program_name = _extract_program_name(query)
+            program_name = analysis.program_name
             
             if language == 'zh' and program_name:
                 # 优先搜索英文术语，成功率更高
@@ -577,7 +1235,8 @@ def answer_enhanced(
                 search_query = " ".join(search_query_parts)
                 logger.info(f"🌐 中文查询映射到英文网络搜索: {search_query}")
             
-            web_results = search_web(search_query, language=language, max_results=3)
+            with timed("web_search"):
+                web_results = search_web(search_query, language=language, max_results=3, timeout=timeout)
             logger.info(f"🌐 网络搜索完成: {len(web_results)} 个结果")
             
             if web_results:
@@ -592,17 +1251,23 @@ def answer_enhanced(
                         "source": "web"
                     })
         except Exception as e:
+            ERRORS.inc(stage="web_search")
             logger.error(f"❌ 网络搜索失败: {e}")
 
-    local_context = _format_context_for_llm(local_results)
-    
-    final_context = (local_context + "\n\n" + web_context).strip()
-    
-    # ✅ [新] 告知 LLM 使用哪个提示词
-    use_strict_prompt = (top_score > 90) and (not web_search_used)
-    
-    answer = _generate_comprehensive_answer(final_context, query, language, use_strict_prompt)
-    
+    return web_search_used, web_context, web_citations
+
+def _semantic_used(local_results: List[Dict]) -> bool:
+    """检索结果中是否有来自语义检索的文档"""
+    return any("semantic" in result.get("retrievers", ()) for result in local_results)
+
+def _top_score(local_results: List[Dict]) -> float:
+    """本地结果最高分"""
+    if local_results:
+        return local_results[0].get("score", 0)
+    return 0
+
+def _local_citations(local_results: List[Dict]) -> List[Dict]:
+    """本地结果 -> 引用列表"""
     citations = []
     for result in local_results[:5]:
         doc = result.get("doc", {})
@@ -612,25 +1277,231 @@ def answer_enhanced(
             "relevance_score": float(result.get("score", 0)),
             "source": "local"
         })
+    return citations
+
+def _build_final_context(
+    local_results: List[Dict],
+    web_context: str,
+    web_search_used: bool,
+    deadline: Optional[Deadline] = None
+) -> Tuple[str, bool]:
+    """合并本地与网络上下文，并决定是否使用严格提示词；时间紧张时缩短上下文"""
+    with timed("format_context"):
+        if _is_tight(deadline):
+            deadline.skip("full_context")
+            local_context = _format_context_for_llm(local_results, max_docs=2, max_chars=300)
+            web_context = web_context[:600]
+        else:
+            local_context = _format_context_for_llm(local_results)
+    
+    final_context = (local_context + "\n\n" + web_context).strip()
     
-    citations.extend(web_citations)
+    # ✅ [新] 告知 LLM 使用哪个提示词
+    use_strict_prompt = (_top_score(local_results) > 90) and (not web_search_used)
     
-    response_time = f"{time.time() - start_time:.2f}s"
+    return final_context, use_strict_prompt
+
+def retrieve_batch(
+    queries: List[str],
+    top_k: int = 10,
+    languages: Optional[List[str]] = None,
+    deadline: Optional[Deadline] = None
+) -> List[Dict[str, Any]]:
+    """
+    批量检索：所有查询共享一次文档遍历
+
+    deadline 约束语义检索的等待时间；检索阶段被跳过的记录放进每个计划的 "skipped_stages"
+
+    Returns:
+        每个查询的检索计划（交给 answer_from_plan 生成答案）
+    """
+    start_time = time.time()
+    languages = languages or ["auto"] * len(queries)
     
-    logger.info(f"✅ 查询完成: {response_time}, {len(local_results)} (本地), {len(web_citations)} (网络)")
+    with timed("load_documents"):
+        snapshot = _current_snapshot()
+    analyses = [analyze_query(query) for query in queries]
+    with timed("batch_search"):
+        all_results = _batch_smart_search(analyses, snapshot, top_k, deadline=deadline)
+    skipped = list(deadline.skipped) if deadline is not None else []
     
-    return {
+    plans = []
+    for analysis, language, local_results in zip(analyses, languages, all_results):
+        # 计划要经 run_in_pool 发往子进程，只带可 pickle 的数据；分析结果在 answer_from_plan 中按 query 取缓存
+        plans.append({
+            "query": analysis.query,
+            "language": analysis.language if language == "auto" else language,
+            "intent": analysis.intent,
+            "local_results": local_results,
+            "start_time": start_time,
+            "skipped_stages": skipped
+        })
+    
+    logger.info(f"📦 批量检索完成: {len(queries)} 个查询, {time.time() - start_time:.2f}s")
+    return plans
+
+def answer_from_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    根据检索计划完成网络搜索兜底与 LLM 生成，返回与 answer_enhanced 相同的结构
+
+    plan["deadline"] 缺省时从现在开始计算一个完整的请求预算；plan["analysis"] 缺省时按 query 分析；
+    plan["skipped_stages"] 为检索阶段已跳过的阶段，并入返回的 skipped_stages。
+    """
+    with request_trace() as trace:
+        query = plan["query"]
+        analysis = plan.get("analysis") or analyze_query(query)
+        language = plan["language"]
+        intent = plan["intent"]
+        local_results = plan["local_results"]
+        start_time = plan.get("start_time", time.time())
+        deadline = plan.get("deadline") or Deadline()
+        deadline.skipped.extend(plan.get("skipped_stages", ()))
+        
+        web_search_used, web_context, web_citations = _web_fallback(analysis, language, local_results, deadline)
+        
+        final_context, use_strict_prompt = _build_final_context(local_results, web_context, web_search_used, deadline)
+        
+        answer = _generate_comprehensive_answer(final_context, query, language, use_strict_prompt, deadline)
+        # LLM 不可用时 answer 退化为上下文原文
+        degraded = bool(final_context) and answer == final_context
+        
+        citations = _local_citations(local_results)
+        citations.extend(web_citations)
+        
+        response_time = f"{time.time() - start_time:.2f}s"
+        
+        logger.info(f"✅ 查询完成: {response_time}, {len(local_results)} (本地), {len(web_citations)} (网络)")
+        
+        return {
+            "intent": intent,
+            "answer": answer,
+            "citations": citations,
+            "reranked": local_results,
+            "rewritten_queries": [],
+            "response_time": response_time,
+            "num_docs": len(local_results),
+            "language": language,
+            "semantic_used": _semantic_used(local_results),
+            "web_search_used": web_search_used,
+            "degraded": degraded,
+            "skipped_stages": list(deadline.skipped),
+            "timings": {**trace.as_dict(), "total_ms": round((time.time() - start_time) * 1000, 2)}
+        }
+
+def answer_enhanced(
+    query: str,
+    top_k: int = 10,
+    language: str = "auto",
+    deadline: Optional[Deadline] = None,
+    filters: Optional[Dict[str, Tuple[str, ...]]] = None,
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    主入口函数 - 终极优化版 (Web 搜索集成)
+
+    deadline: 请求截止时间（API 层在请求进入时创建）；缺省时从现在开始计算完整预算
+    filters: 结构化字段过滤（见 scripts/field_index.parse_filters）
+    """
+    with request_trace():
+        start_time = time.time()
+        deadline = deadline or Deadline()
+        
+        with timed("analyze_query"):
+            analysis = analyze_query(query)
+        if language == "auto":
+            language = analysis.language
+        intent = analysis.intent
+        
+        logger.info(f"🔍 查询: '{query[:100]}...' | 语言: {language} | 意图: {intent}")
+        
+        with timed("load_documents"):
+            snapshot = _current_snapshot()
+        
+        with timed("smart_search"):
+            local_results = _smart_search(analysis, snapshot, top_k, filters, deadline)
+        
+        return answer_from_plan({
+            "query": query,
+            "analysis": analysis,
+            "language": language,
+            "intent": intent,
+            "local_results": local_results,
+            "start_time": start_time,
+            "deadline": deadline
+        })
+
+def answer_enhanced_stream(
+    query: str,
+    top_k: int = 10,
+    language: str = "auto",
+    deadline: Optional[Deadline] = None,
+    **kwargs
+) -> Iterator[Dict[str, Any]]:
+    """
+    流式入口：按 citations -> token... -> done 的顺序产出事件
+
+    每个事件形如 {"event": 名称, "data": 字典}：
+    - citations: 本地检索结果（随后若触发网络搜索，再发一次 source=web 的 citations）
+    - token: LLM 增量文本
+    - done: 元数据（意图、文档数、耗时）
+
+    deadline 约束首个 token 之前的阶段（网络搜索、LLM 建连与重试）。
+    """
+    start_time = time.time()
+    deadline = deadline or Deadline()
+    
+    with timed("analyze_query"):
+        analysis = analyze_query(query)
+    if language == "auto":
+        language = analysis.language
+    intent = analysis.intent
+    
+    logger.info(f"🔍 [stream] 查询: '{query[:100]}...' | 语言: {language} | 意图: {intent}")
+    
+    with timed("load_documents"):
+        snapshot = _current_snapshot()
+    with timed("smart_search"):
+        local_results = _smart_search(analysis, snapshot, top_k, deadline=deadline)
+    
+    yield {"event": "citations", "data": {
         "intent": intent,
-        "answer": answer,
-        "citations": citations,
-        "reranked": local_results,
-        "rewritten_queries": [],
-        "response_time": response_time,
-        "num_docs": len(local_results),
         "language": language,
-        "semantic_used": False,
-        "web_search_used": web_search_used
-    }
+        "source": "local",
+        "citations": _local_citations(local_results)
+    }}
+    
+    web_search_used, web_context, web_citations = _web_fallback(analysis, language, local_results, deadline)
+    if web_citations:
+        yield {"event": "citations", "data": {"source": "web", "citations": web_citations}}
+    
+    final_context, use_strict_prompt = _build_final_context(local_results, web_context, web_search_used, deadline)
+    retrieval_ms = (time.time() - start_time) * 1000
+    
+    first_token_ms = None
+    num_chars = 0
+    for delta in _stream_comprehensive_answer(final_context, query, language, use_strict_prompt, deadline):
+        if first_token_ms is None:
+            first_token_ms = (time.time() - start_time) * 1000
+        num_chars += len(delta)
+        yield {"event": "token", "data": {"text": delta}}
+    
+    total_ms = (time.time() - start_time) * 1000
+    logger.info(f"✅ [stream] 查询完成: {total_ms:.0f}ms, 首 token {first_token_ms or 0:.0f}ms")
+    
+    yield {"event": "done", "data": {
+        "intent": intent,
+        "language": language,
+        "num_docs": len(local_results),
+        "num_chars": num_chars,
+        "semantic_used": _semantic_used(local_results),
+        "web_search_used": web_search_used,
+        "skipped_stages": list(deadline.skipped),
+        "timings": {
+            "retrieval_ms": round(retrieval_ms, 1),
+            "first_token_ms": round(first_token_ms or total_ms, 1),
+            "total_ms": round(total_ms, 1)
+        }
+    }}
 
 if __name__ == "__main__":
     # 测试
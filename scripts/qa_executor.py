@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+qa_executor.py - QA 执行池
+把同步的 QA 流水线（jieba / 线性扫描 / Groq / DDGS 阻塞 HTTP）放到有界线程池或进程池执行，
+事件循环只负责调度，不再被单个慢请求卡住。
+进程池模式下每个子进程各有一份语料快照，预热 / 热重载用 run_on_all_workers 广播到所有子进程。
+导出：get_executor, run_in_pool, run_on_all_workers, iterate_in_pool, wait_until_disconnected,
+      shutdown_executor, ClientDisconnected
+"""
+
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("qa_executor")
+
+# ============ 配置 ============
+# QA_EXECUTOR: thread（默认，适合以 I/O 等待为主的 Groq / DDGS 调用）| process（CPU 密集时使用）
+QA_EXECUTOR_KIND = os.getenv("QA_EXECUTOR", "thread").lower()
+QA_MAX_WORKERS = max(1, int(os.getenv("QA_MAX_WORKERS", "8")))
+# 同时提交到池中的请求上限；其余请求在事件循环上排队（排队期间可被取消）
+QA_MAX_INFLIGHT = max(1, int(os.getenv("QA_MAX_INFLIGHT", str(QA_MAX_WORKERS))))
+# 检查客户端是否断开的轮询间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.25
+# 广播任务等待所有子进程到齐的上限（秒；子进程正忙于长请求时需要等它空闲）
+BROADCAST_TIMEOUT = float(os.getenv("QA_BROADCAST_TIMEOUT", "120"))
+
+_executor: Optional[Executor] = None
+_inflight = None  # (loop, asyncio.Semaphore)
+
+
+class ClientDisconnected(Exception):
+    """客户端在结果返回前断开连接"""
+
+
+def get_executor() -> Executor:
+    """延迟创建全局执行池"""
+    global _executor
+
+    if _executor is not None:
+        return _executor
+
+    if QA_EXECUTOR_KIND == "process":
+        _executor = ProcessPoolExecutor(max_workers=QA_MAX_WORKERS)
+    else:
+        _executor = ThreadPoolExecutor(max_workers=QA_MAX_WORKERS, thread_name_prefix="qa-worker")
+
+    logger.info(f"✅ QA 执行池: {QA_EXECUTOR_KIND} x {QA_MAX_WORKERS} (inflight={QA_MAX_INFLIGHT})")
+    return _executor
+
+
+def _inflight_semaphore() -> asyncio.Semaphore:
+    """按事件循环创建信号量（测试客户端等场景会创建新的 loop）"""
+    global _inflight
+
+    loop = asyncio.get_running_loop()
+    if _inflight is None or _inflight[0] is not loop:
+        _inflight = (loop, asyncio.Semaphore(QA_MAX_INFLIGHT))
+    return _inflight[1]
+
+
+async def run_in_pool(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    在执行池中运行同步函数，并发数受 QA_MAX_INFLIGHT 限制
+
+    等待信号量时被取消的请求不会占用 worker。
+    """
+    async with _inflight_semaphore():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), partial(fn, *args, **kwargs))
+
+
+def _barrier_call(barrier, fn: Callable[..., Any], args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Any:
+    """子进程中执行：等所有子进程都领到一个广播任务后再运行 fn（保证每个子进程恰好一个）"""
+    barrier.wait(BROADCAST_TIMEOUT)
+    return fn(*args, **kwargs)
+
+
+async def run_on_all_workers(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> List[Any]:
+    """
+    在执行池的每个 worker 中各运行一次 fn，返回各自的结果
+
+    线程池共享进程内的全局状态，只运行一次；进程池提交 QA_MAX_WORKERS 个任务，
+    每个任务先在同一个屏障上等待，所有任务同时在运行时必然分布在不同子进程上
+    （尚未启动的子进程也会因此被拉起）。用于预热与语料热重载，不占用 inflight 名额。
+    """
+    executor = get_executor()
+    loop = asyncio.get_running_loop()
+    if not isinstance(executor, ProcessPoolExecutor):
+        return [await loop.run_in_executor(executor, partial(fn, *args, **kwargs))]
+
+    manager = multiprocessing.Manager()
+    try:
+        barrier = manager.Barrier(QA_MAX_WORKERS)
+        futures = [
+            loop.run_in_executor(executor, _barrier_call, barrier, fn, args, kwargs)
+            for _ in range(QA_MAX_WORKERS)
+        ]
+        return list(await asyncio.gather(*futures))
+    finally:
+        manager.shutdown()
+
+
+async def iterate_in_pool(gen_fn: Callable[..., Iterator[Any]], *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+    """
+    在线程中逐步驱动同步生成器，把产出的每一项交回事件循环（用于流式响应）
+
+    生成器对象无法跨进程传递，进程池模式下改用事件循环默认的线程池。
+    整个迭代期间占用一个 inflight 名额；消费方提前退出时会在 worker 中关闭生成器。
+    """
+    executor = get_executor()
+    if not isinstance(executor, ThreadPoolExecutor):
+        executor = None
+
+    sentinel = object()
+    gen = gen_fn(*args, **kwargs)
+    async with _inflight_semaphore():
+        loop = asyncio.get_running_loop()
+        pending = None
+
+        def _close(fut=None):
+            # 等正在执行的 next() 结束后再关闭，避免 "generator already executing"
+            if fut is not None and not fut.cancelled():
+                fut.exception()
+            loop.run_in_executor(executor, gen.close)
+
+        try:
+            while True:
+                pending = loop.run_in_executor(executor, next, gen, sentinel)
+                item = await asyncio.shield(pending)
+                if item is sentinel:
+                    break
+                yield item
+        finally:
+            if pending is None or pending.done():
+                _close()
+            else:
+                pending.add_done_callback(_close)
+
+
+async def wait_until_disconnected(
+    is_disconnected: Callable[[], Awaitable[bool]],
+    fut: "asyncio.Future[Any]",
+) -> Any:
+    """
+    等待 fut 完成，同时轮询客户端连接；客户端断开时抛出 ClientDisconnected
+
+    不会取消 fut 本身，是否取消由调用方决定（fut 可能被多个请求共享）。
+    """
+    while True:
+        done, _ = await asyncio.wait({fut}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return fut.result()
+        if await is_disconnected():
+            raise ClientDisconnected()
+
+
+def shutdown_executor(wait: bool = False) -> None:
+    """关闭执行池（取消尚未开始的任务）"""
+    global _executor
+
+    if _executor is None:
+        return
+    _executor.shutdown(wait=wait, cancel_futures=True)
+    _executor = None
+    logger.info("🛑 QA 执行池已关闭")
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rate_limit.py - 按客户端限流（令牌桶）
+每个客户端（已配置的 X-API-Key，否则按 IP）两个令牌桶：
+    cheap      所有 QA 相关请求（缓存命中、检索）都消耗，由中间件检查
+    expensive  真正调用 LLM 时才消耗，由接口在缓存未命中时检查
+每次检查 O(1)；默认进程内存储，设置 QA_RATE_LIMIT_SHARED=<文件路径> 时多个 worker
+通过同一个 mmap 文件共享桶状态（按槽位加 fcntl 字节锁）。
+导出：RateLimiter, RateLimitMiddleware, Decision, get_rate_limiter, client_key
+"""
+
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+    HAVE_FCNTL = True
+except ImportError:
+    HAVE_FCNTL = False
+
+logger = logging.getLogger("rate_limit")
+
+# ============ 配置 ============
+RATE_LIMIT_ENABLED = os.getenv("QA_RATE_LIMIT", "1") != "0"
+# 每分钟令牌数（同时也是桶容量，即允许的突发量）
+CHEAP_PER_MINUTE = float(os.getenv("QA_RATE_CHEAP_PER_MIN", "120"))
+EXPENSIVE_PER_MINUTE = float(os.getenv("QA_RATE_EXPENSIVE_PER_MIN", "20"))
+# 允许按 key 单独计额度的 API key（逗号分隔）；不在其中的 X-API-Key 一律按 IP 计
+API_KEYS = frozenset(k.strip() for k in os.getenv("QA_API_KEYS", "").split(",") if k.strip())
+# 反向代理层数（Railway 为 1）：取 X-Forwarded-For 倒数第 N 个地址作为客户端 IP
+TRUSTED_PROXIES = int(os.getenv("QA_TRUSTED_PROXIES", "1"))
+# 可选：多 worker 共享的桶文件
+SHARED_STORE_PATH = os.getenv("QA_RATE_LIMIT_SHARED", "")
+SHARED_STORE_SLOTS = int(os.getenv("QA_RATE_LIMIT_SLOTS", "65536"))
+# 进程内最多跟踪的客户端数（LRU 淘汰；被淘汰的客户端相当于满桶）
+MAX_TRACKED_KEYS = 100000
+
+TIERS = {
+    "cheap": CHEAP_PER_MINUTE,
+    "expensive": EXPENSIVE_PER_MINUTE,
+}
+
+
+class Decision:
+    """一次限流检查的结果"""
+    __slots__ = ("allowed", "limit", "remaining", "retry_after", "tier")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, retry_after: float, tier: str) -> None:
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.retry_after = retry_after
+        self.tier = tier
+
+    def headers(self) -> Dict[str, str]:
+        prefix = "X-RateLimit" if self.tier == "cheap" else f"X-RateLimit-{self.tier.capitalize()}"
+        headers = {
+            f"{prefix}-Limit": str(self.limit),
+            f"{prefix}-Remaining": str(self.remaining),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, int(self.retry_after + 0.999)))
+        return headers
+
+
+def _refill(tokens: float, last: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + (now - last) * rate)
+
+
+class MemoryBucketStore:
+    """进程内令牌桶：key -> (tokens, last)"""
+
+    def __init__(self, max_keys: int = MAX_TRACKED_KEYS) -> None:
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, now: float) -> Tuple[bool, float]:
+        """尝试取 cost 个令牌，返回 (是否成功, 剩余令牌)"""
+        with self._lock:
+            state = self._buckets.get(key)
+            tokens = capacity if state is None else _refill(state[0], state[1], now, capacity, rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+
+class FileBucketStore:
+    """
+    mmap 文件中的定长槽位表，多个 worker 共享
+
+    槽位 = hash(key) % slots，内容为 (key 哈希, tokens, last)；哈希冲突时覆盖旧客户端
+    （等价于把它当作满桶，只会放宽而不会误伤）。每个槽位用 fcntl 字节范围锁互斥。
+    """
+    _SLOT = struct.Struct("<Qdd")
+
+    def __init__(self, path: str, slots: int = SHARED_STORE_SLOTS) -> None:
+        self.slots = slots
+        size = slots * self._SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, now: float) -> Tuple[bool, float]:
+        digest = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+        offset = (digest % self.slots) * self._SLOT.size
+        with self._lock:
+            if HAVE_FCNTL:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, self._SLOT.size, offset)
+            try:
+                owner, tokens, last = self._SLOT.unpack_from(self._map, offset)
+                # 共享文件里用墙钟时间（各进程的 monotonic 起点不同）
+                tokens = capacity if owner != digest else _refill(tokens, last, now, capacity, rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                self._SLOT.pack_into(self._map, offset, digest, tokens, now)
+            finally:
+                if HAVE_FCNTL:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, self._SLOT.size, offset)
+        return allowed, tokens
+
+
+class RateLimiter:
+    """按客户端、按档位的令牌桶限流"""
+
+    def __init__(
+        self,
+        tiers: Optional[Dict[str, float]] = None,
+        store: Optional[Any] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.tiers = dict(tiers or TIERS)
+        self.store = store or MemoryBucketStore()
+        self.clock = clock
+        self.rejected: Dict[str, int] = {tier: 0 for tier in self.tiers}
+
+    def check(self, key: str, tier: str, cost: float = 1.0) -> Decision:
+        per_minute = self.tiers[tier]
+        rate = per_minute / 60.0
+        allowed, tokens = self.store.take(f"{tier}:{key}", per_minute, rate, cost, self.clock())
+        retry_after = 0.0 if allowed else (cost - tokens) / rate if rate > 0 else 60.0
+        if not allowed:
+            self.rejected[tier] += 1
+        return Decision(allowed, int(per_minute), int(tokens), retry_after, tier)
+
+
+def _key_digest(api_key: str) -> str:
+    return hashlib.sha1(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+_API_KEY_DIGESTS = frozenset(_key_digest(k) for k in API_KEYS)
+
+
+def client_key(
+    headers: Dict[str, str],
+    client_host: Optional[str],
+    trusted_proxies: int = TRUSTED_PROXIES,
+    api_keys: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    限流主体：X-API-Key 属于已配置的 key（api_keys，默认 QA_API_KEYS）时按 key，否则按客户端 IP
+
+    未配置的 key 不单独分桶，否则每换一个随意的 key 就能拿到一个新的满桶。
+    """
+    api_key = headers.get("x-api-key")
+    if api_key:
+        digest = _key_digest(api_key)
+        known = _API_KEY_DIGESTS if api_keys is None else {_key_digest(k) for k in api_keys}
+        if digest in known:
+            return "key:" + digest
+
+    forwarded = headers.get("x-forwarded-for")
+    if forwarded and trusted_proxies > 0:
+        hops = [h.strip() for h in forwarded.split(",") if h.strip()]
+        if hops:
+            return "ip:" + hops[-min(trusted_proxies, len(hops))]
+    return "ip:" + (client_host or "unknown")
+
+
+class RateLimitMiddleware:
+    """
+    ASGI 中间件：对指定前缀的请求检查 cheap 档，超限直接返回 429；
+    通过时把限流主体放到 request.state.rate_limit_key，并在响应头附上剩余额度。
+    """
+
+    def __init__(self, app: Any, limiter: "RateLimiter", paths: Sequence[str] = ("/api/",), exempt: Sequence[str] = ()) -> None:
+        self.app = app
+        self.limiter = limiter
+        self.paths = tuple(paths)
+        self.exempt = tuple(exempt)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        path = scope.get("path", "")
+        if (
+            scope["type"] != "http"
+            or scope.get("method") == "OPTIONS"  # CORS 预检不计数
+            or not path.startswith(self.paths)
+            or path.startswith(self.exempt)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        client = scope.get("client")
+        key = client_key(headers, client[0] if client else None)
+        decision = self.limiter.check(key, "cheap")
+
+        if not decision.allowed:
+            body = json.dumps({
+                "intent": "error",
+                "answer": "请求过于频繁，请稍后再试",
+                "citations": [],
+                "retry_after": decision.headers()["Retry-After"]
+            }, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                + [(k.lower().encode(), v.encode()) for k, v in decision.headers().items()],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        scope.setdefault("state", {})["rate_limit_key"] = key
+        extra = [(k.lower().encode(), v.encode()) for k, v in decision.headers().items()]
+
+        async def send_with_headers(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """全局限流器（按环境变量配置）"""
+    global _limiter
+    if _limiter is None:
+        store = None
+        if SHARED_STORE_PATH:
+            try:
+                store = FileBucketStore(SHARED_STORE_PATH)
+                logger.info(f"✅ 限流状态共享文件: {SHARED_STORE_PATH}")
+            except OSError as e:
+                logger.warning(f"⚠️ 限流共享文件不可用，改用进程内存储: {e}")
+        _limiter = RateLimiter(store=store)
+    return _limiter
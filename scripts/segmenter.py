@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+segmenter.py - 中文分词服务
+进程内唯一的 jieba 分词器：启动时在后台线程加载词典（不阻塞启动），并登记领域用户词典
+（专业中文别名、data/cn_en_stopwords.txt、语料标题中的领域词），让 "数据科学"、"全球健康管理"
+这类专业名切成完整的词，与索引一致。
+查询文本的分词结果带 LRU 缓存；语料在建索引时一次性分词，不进入缓存。
+jieba 未安装时回退到二元组切分。
+导出：Segmenter, get_segmenter, HAVE_JIEBA
+"""
+
+import os
+import logging
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import FrozenSet, Iterable, List, Optional, Set, Tuple
+
+try:
+    import jieba
+    HAVE_JIEBA = True
+except ImportError:
+    HAVE_JIEBA = False
+
+logger = logging.getLogger("segmenter")
+
+# ============ 配置 ============
+ROOT = Path(__file__).resolve().parents[1]
+STOPWORDS_PATH = Path(os.getenv("QA_STOPWORDS_PATH", str(ROOT / "data" / "cn_en_stopwords.txt")))
+# 查询分词结果的 LRU 缓存条数
+SEGMENT_CACHE_SIZE = int(os.getenv("QA_SEGMENT_CACHE", "8192"))
+
+
+def _is_cjk(word: str) -> bool:
+    return any("\u4e00" <= ch <= "\u9fff" for ch in word)
+
+
+def _load_stopwords(path: Path) -> Set[str]:
+    """停用词文件中的中文词（英文停用词含 msc / phd 等学位缩写，检索需要保留，不在这里使用）"""
+    try:
+        return {word for word in path.read_text(encoding="utf-8").split() if _is_cjk(word)}
+    except OSError as e:
+        logger.warning(f"⚠️ 停用词文件不可用: {e}")
+        return set()
+
+
+class Segmenter:
+    """
+    带用户词典与缓存的中文分词器
+
+    load() 幂等且线程安全；cut() 在词典未加载完时会等待加载完成。
+    add_words() 可在任何时候调用：加载前的词在加载时登记，加载后的词立即登记并清空缓存。
+    """
+
+    def __init__(self, stopwords_path: Path = STOPWORDS_PATH, cache_size: int = SEGMENT_CACHE_SIZE) -> None:
+        self.stopwords: FrozenSet[str] = frozenset(_load_stopwords(stopwords_path))
+        self._words: Set[str] = set(self.stopwords)
+        self._pending: List[str] = sorted(self._words)
+        self._tokenizer = jieba.Tokenizer() if HAVE_JIEBA else None
+        self._loaded = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._cached_cut = lru_cache(maxsize=cache_size)(self._cut)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    @property
+    def user_words(self) -> int:
+        return len(self._words)
+
+    def load(self) -> None:
+        """加载 jieba 词典并登记用户词（只做一次）"""
+        if self._loaded.is_set():
+            return
+        with self._lock:
+            if self._loaded.is_set():
+                return
+            if self._tokenizer is not None:
+                self._tokenizer.initialize()
+                for word in self._pending:
+                    self._tokenizer.add_word(word)
+            self._pending = []
+            self._loaded.set()
+        logger.info(f"✅ 分词器就绪: {len(self._words)} 个用户词")
+
+    def load_async(self) -> None:
+        """在后台线程加载（启动时调用，不阻塞事件循环）"""
+        with self._lock:
+            if self._thread is not None or self._loaded.is_set():
+                return
+            self._thread = threading.Thread(target=self.load, name="segmenter-load", daemon=True)
+            self._thread.start()
+
+    def add_words(self, words: Iterable[str]) -> int:
+        """登记用户词（只收中文词），返回新增个数"""
+        with self._lock:
+            new = [w for w in dict.fromkeys(words) if w and _is_cjk(w) and w not in self._words]
+            if not new:
+                return 0
+            self._words.update(new)
+            if self._loaded.is_set():
+                if self._tokenizer is not None:
+                    for word in new:
+                        self._tokenizer.add_word(word)
+                self._cached_cut.cache_clear()
+            else:
+                self._pending.extend(new)
+        return len(new)
+
+    def _cut(self, chunk: str) -> Tuple[str, ...]:
+        if self._tokenizer is not None:
+            self.load()
+            return tuple(self._tokenizer.cut(chunk))
+        if len(chunk) == 1:
+            return (chunk,)
+        return tuple(chunk[i:i + 2] for i in range(len(chunk) - 1))
+
+    def cut(self, chunk: str, cache: bool = True) -> Tuple[str, ...]:
+        """切分一段连续的中文；cache=False 用于语料（一次性分词，不占用查询缓存）"""
+        return self._cached_cut(chunk) if cache else self._cut(chunk)
+
+    def cache_info(self):
+        return self._cached_cut.cache_info()
+
+
+_segmenter: Optional[Segmenter] = None
+_segmenter_lock = threading.Lock()
+
+
+def get_segmenter() -> Segmenter:
+    """全局分词器"""
+    global _segmenter
+    if _segmenter is None:
+        with _segmenter_lock:
+            if _segmenter is None:
+                _segmenter = Segmenter()
+    return _segmenter
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+singleflight.py - 相同请求合并（single-flight）
+同一 key 的并发调用只执行一次底层计算，所有调用方拿到同一个结果。
+导出：SingleFlight
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from scripts.qa_executor import ClientDisconnected, wait_until_disconnected
+
+logger = logging.getLogger("singleflight")
+
+
+class _Call:
+    """一次进行中的计算及其等待者数量"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同 key 的并发调用
+
+    计算在独立任务中运行，不绑定到第一个调用方：某个调用方断开只会让它自己退出；
+    只有当所有等待者都离开时才取消计算。
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call] = {}
+        self.shared = 0  # 被合并掉的调用次数
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Tuple[Any, bool]:
+        """
+        执行（或加入）key 对应的计算
+
+        Returns:
+            (结果, 是否复用了其他请求的计算)
+
+        Raises:
+            ClientDisconnected: is_disconnected 报告客户端已断开
+        """
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+        else:
+            self.shared += 1
+            logger.info(f"🔗 合并进行中的相同请求 (waiters={call.waiters + 1})")
+
+        call.waiters += 1
+        try:
+            if is_disconnected is None:
+                result = await asyncio.shield(call.task)
+            else:
+                result = await wait_until_disconnected(is_disconnected, call.task)
+            return result, shared
+        except (ClientDisconnected, asyncio.CancelledError):
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def inflight(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: str) -> bool:
+        """key 是否有进行中的计算（加入它不会触发新的计算）"""
+        return key in self._calls
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+static_files.py - 前端与静态资源（预压缩 + 缓存头）
+文件读入内存后按 Accept-Encoding 返回，不再每次 stat 多个候选路径、不再返回未压缩的大文件。
+gzip / brotli 版本优先使用磁盘上的 .gz / .br（构建时生成），其余在启动预热（warm）时生成；
+请求路径上从不压缩：预热之后才出现或被修改的文件先以原文返回，压缩交给后台线程，完成后替换。
+
+- 带内容哈希的构建产物（index-DBEUlYDv.js）：Cache-Control: immutable，一年
+- index.html：no-cache + ETag，浏览器每次用 If-None-Match 验证，未变化时 304
+- 其他静态文件（含 /public/data/*.json）：短缓存 + ETag，文件修改后自动重新加载
+
+构建时可预先生成压缩文件：python -m scripts.static_files public/assets dist
+导出：StaticCache, StaticEntry, precompress_dir
+"""
+
+import re
+import sys
+import gzip
+import hashlib
+import logging
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import brotli
+    HAVE_BROTLI = True
+except ImportError:
+    HAVE_BROTLI = False
+
+logger = logging.getLogger("static_files")
+
+# ============ 配置 ============
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+SHORT_CACHE = "public, max-age=300"
+# 小于该大小的文件不压缩
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/xml")
+# Vite 产物文件名中的内容哈希：name-<hash>.ext，hash 为紧挨扩展名的 8 位 base64url，
+# 且至少含一个数字或大写字母（排除 react-dom.development.js、my-homepage.js 这类普通文件名）
+_HASHED_NAME = re.compile(
+    r"-(?=[A-Za-z0-9_-]{0,7}[0-9A-Z])[A-Za-z0-9_-]{8}\.(?:js|css|mjs|woff2?|ttf|png|jpe?g|gif|svg|webp|avif|ico|wasm)$"
+)
+# 各编码版本的 ETag 后缀（内容不同，强 ETag 不能共用）
+_ETAG_SUFFIX = {"identity": "", "gzip": "-gz", "br": "-br"}
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("application/javascript", ".mjs")
+
+
+def is_hashed_asset(path: Path) -> bool:
+    return bool(_HASHED_NAME.search(path.name))
+
+
+def _compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """解析 Accept-Encoding：编码 -> q 值"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip().lower()] = q
+    return accepted
+
+
+class StaticEntry:
+    """一个静态文件的内存副本：原始内容、压缩版本、ETag 与缓存策略"""
+    __slots__ = ("path", "stamp", "content_type", "etag", "cache_control", "variants")
+
+    def __init__(self, path: Path, cache_control: str, compress: bool = True) -> None:
+        """compress=False 时只读取磁盘上的预压缩文件，缺少的版本留给 compress_missing()"""
+        st = path.stat()
+        self.path = path
+        self.stamp = (st.st_mtime_ns, st.st_size)
+        self.cache_control = cache_control
+
+        content_type, _ = mimetypes.guess_type(path.name)
+        self.content_type = content_type or "application/octet-stream"
+        if self.content_type.startswith("text/") or self.content_type in ("application/javascript", "application/json"):
+            self.content_type += "; charset=utf-8"
+
+        raw = path.read_bytes()
+        # 原文的 ETag；压缩版本用 etag_for(encoding)
+        self.etag = '"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+        # 编码 -> 内容；"identity" 总是存在
+        self.variants: Dict[str, bytes] = {"identity": raw}
+        if self.compressible:
+            self._load_precompressed()
+            if compress:
+                self.compress_missing()
+
+    @property
+    def compressible(self) -> bool:
+        return len(self.variants["identity"]) >= MIN_COMPRESS_SIZE and _compressible(self.content_type)
+
+    @property
+    def missing_encodings(self) -> Tuple[str, ...]:
+        """还没有的压缩版本"""
+        if not self.compressible:
+            return ()
+        wanted = ("br", "gzip") if HAVE_BROTLI else ("gzip",)
+        return tuple(encoding for encoding in wanted if encoding not in self.variants)
+
+    def _load_precompressed(self) -> None:
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            pre = self.path.with_name(self.path.name + suffix)
+            if pre.exists() and pre.stat().st_mtime_ns >= self.stamp[0]:
+                self.variants[encoding] = pre.read_bytes()
+
+    def compress_missing(self) -> None:
+        """生成缺少的压缩版本（耗 CPU，只在预热或后台线程中调用），完成后整体替换 variants"""
+        missing = self.missing_encodings
+        if not missing:
+            return
+        raw = self.variants["identity"]
+        variants = dict(self.variants)
+        if "gzip" in missing:
+            variants["gzip"] = gzip.compress(raw, compresslevel=9, mtime=0)
+        if "br" in missing:
+            variants["br"] = brotli.compress(raw, quality=11)
+        self.variants = variants
+
+    def select(self, accept_encoding: str) -> Tuple[str, bytes]:
+        """按客户端支持的编码选出最小的版本"""
+        accepted = _accepted_encodings(accept_encoding)
+        best = ("identity", self.variants["identity"])
+        for encoding in ("br", "gzip"):
+            body = self.variants.get(encoding)
+            if body is not None and accepted.get(encoding, 0) > 0 and len(body) < len(best[1]):
+                best = (encoding, body)
+        return best
+
+    def etag_for(self, encoding: str) -> str:
+        """某个编码版本的 ETag：原文 "<hash>"，gzip "<hash>-gz"，brotli "<hash>-br" """
+        return self.etag[:-1] + _ETAG_SUFFIX[encoding] + '"'
+
+    def headers(self, encoding: str) -> Dict[str, str]:
+        headers = {
+            "ETag": self.etag_for(encoding),
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return headers
+
+
+class StaticCache:
+    """
+    带内存缓存的静态文件集合
+
+    带哈希的文件内容永不改变，加载后不再 stat；其他文件每次访问 stat 一次，
+    修改时间或大小变化时重新加载。请求路径（get）只读文件与磁盘上的预压缩版本，
+    缺少的压缩版本由后台线程生成；启动时用 warm() 预先加载并压缩。
+    get() 会 stat / 读文件，在事件循环中应通过 run_in_threadpool 调用。
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[Path, StaticEntry] = {}
+        self._lock = threading.Lock()
+        self._compressor: Optional[ThreadPoolExecutor] = None
+
+    def warm(self, paths: Iterable[Path], cache_control: Optional[str] = None) -> int:
+        """
+        预先加载文件（目录则递归）并生成全部压缩版本，返回加载的文件数
+        缓存键为传入的路径（目录下为 rglob 的结果），需与之后 get() 使用的路径一致。
+
+        阻塞且耗 CPU：在启动时于线程中调用，不要在事件循环中直接调用。
+        """
+        n = 0
+        for root in paths:
+            root = Path(root)
+            files = [root] if root.is_file() else sorted(p for p in root.rglob("*") if p.is_file())
+            for path in files:
+                if path.suffix in (".gz", ".br"):
+                    continue
+                entry = StaticEntry(path, cache_control or self._default_cache_control(path))
+                with self._lock:
+                    self._entries[path] = entry
+                n += 1
+        return n
+
+    def get(self, path: Path, cache_control: Optional[str] = None) -> Optional[StaticEntry]:
+        entry = self._entries.get(path)
+        if entry is not None and entry.cache_control == IMMUTABLE_CACHE:
+            return entry
+
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        if entry is not None and entry.stamp == (st.st_mtime_ns, st.st_size):
+            return entry
+        if not path.is_file():
+            return None
+
+        if cache_control is None:
+            cache_control = self._default_cache_control(path)
+        entry = StaticEntry(path, cache_control, compress=False)
+        with self._lock:
+            self._entries[path] = entry
+        if entry.missing_encodings:
+            self._compress_later(entry)
+        return entry
+
+    @staticmethod
+    def _default_cache_control(path: Path) -> str:
+        return IMMUTABLE_CACHE if is_hashed_asset(path) else SHORT_CACHE
+
+    def _compress_later(self, entry: StaticEntry) -> None:
+        """在后台线程中补齐压缩版本（完成前先返回原文）"""
+        with self._lock:
+            if self._compressor is None:
+                self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="static-compress")
+        self._compressor.submit(entry.compress_missing)
+
+    @staticmethod
+    def resolve(root: Path, relative: str) -> Optional[Path]:
+        """root 下的相对路径；越出 root（../）时返回 None"""
+        try:
+            path = (root / relative).resolve()
+            path.relative_to(root.resolve())
+        except (ValueError, OSError):
+            return None
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self._entries),
+            "bytes": sum(len(e.variants["identity"]) for e in self._entries.values()),
+        }
+
+
+def precompress_dir(directories: Iterable[Path]) -> int:
+    """为目录下可压缩的文件生成 .gz（以及安装了 brotli 时的 .br），返回处理的文件数"""
+    n = 0
+    for directory in directories:
+        for path in Path(directory).rglob("*"):
+            if not path.is_file() or path.suffix in (".gz", ".br"):
+                continue
+            content_type, _ = mimetypes.guess_type(path.name)
+            raw = path.read_bytes()
+            if len(raw) < MIN_COMPRESS_SIZE or not _compressible(content_type or ""):
+                continue
+            path.with_name(path.name + ".gz").write_bytes(gzip.compress(raw, compresslevel=9, mtime=0))
+            if HAVE_BROTLI:
+                path.with_name(path.name + ".br").write_bytes(brotli.compress(raw, quality=11))
+            n += 1
+    return n
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    targets = [Path(p) for p in sys.argv[1:]] or [Path("public/assets")]
+    count = precompress_dir(targets)
+    logger.info(f"🗜️ 预压缩完成: {count} 个文件 (brotli={'on' if HAVE_BROTLI else 'off'})")
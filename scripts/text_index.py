@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+text_index.py - BM25F 倒排索引
+语料加载时对每个文档的标题 / 章节标题 / 正文分字段分词，建立 词 -> (文档编号, 词频) 的倒排表。
+字段按权重与各自的长度归一化合并为一个伪词频（BM25F），建索引时就算好，
+查询时只遍历与查询共享词项的文档，不再逐个文档做子串匹配。
+
+分词：英文按单词切分（小写、去停用词、简单去复数），中文交给 segmenter（带领域用户词典的 jieba）。
+导出：BM25FIndex, tokenize, tokenize_spans, FIELD_WEIGHTS
+"""
+
+import re
+import math
+import heapq
+import logging
+from array import array
+from collections import Counter
+from operator import itemgetter
+from typing import Container, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from scripts.segmenter import get_segmenter
+
+logger = logging.getLogger("text_index")
+
+# ============ 配置 ============
+# 字段权重与长度归一化强度（b）
+FIELD_WEIGHTS = {"title": 3.0, "heading": 2.0, "text": 1.0}
+FIELD_B = {"title": 0.3, "heading": 0.5, "text": 0.75}
+# 词频饱和参数
+K1 = 1.2
+
+STOPWORDS = frozenset({
+    "what", "how", "where", "when", "which", "who", "the", "a", "an",
+    "is", "are", "was", "were", "do", "does", "did", "about", "for",
+    "of", "in", "on", "at", "to", "and", "or", "with", "by", "from",
+    "can", "you", "your", "my", "me", "it", "be", "this", "that", "as",
+    "的", "是", "有", "在", "吗", "呢", "啊", "了", "和", "与", "什么", "要求", "专业",
+})
+
+_WORD = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_CJK = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def _stem(word: str) -> str:
+    """极简去复数：modules -> module, studies -> study（不处理 ss / us / is 结尾）"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str, cache: bool = True) -> List[str]:
+    """
+    把文本切成索引词项（查询与文档使用同一套规则）
+
+    cache: 中文分词结果是否进入 LRU 缓存（查询为 True；建索引时语料传 False）
+    """
+    if not text:
+        return []
+    lowered = text.lower()
+    tokens = [
+        _stem(word) for word in _WORD.findall(lowered)
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+    chunks = _CJK.findall(lowered)
+    if chunks:
+        segmenter = get_segmenter()
+        stopwords = segmenter.stopwords
+        for chunk in chunks:
+            tokens.extend(
+                t for t in segmenter.cut(chunk, cache)
+                if (len(t) > 1 or len(chunk) == 1) and t not in STOPWORDS and t not in stopwords
+            )
+    return tokens
+
+
+def tokenize_spans(text: str, cache: bool = False) -> List[Tuple[str, int, int]]:
+    """
+    与 tokenize 相同的词项，附带在原文中的字符区间 [(词项, 起, 止)]（用于片段高亮）
+
+    词项顺序与 tokenize 一致（先英文后中文）；建索引时调用，默认不进入分词缓存。
+    """
+    if not text:
+        return []
+    lowered = text.lower()
+    spans = [
+        (_stem(m.group()), m.start(), m.end()) for m in _WORD.finditer(lowered)
+        if len(m.group()) > 1 and m.group() not in STOPWORDS
+    ]
+    segmenter = None
+    for m in _CJK.finditer(lowered):
+        if segmenter is None:
+            segmenter = get_segmenter()
+        chunk = m.group()
+        # 在 chunk 中定位每个词：jieba 的切分首尾相接，二元回退的切分互相重叠，
+        # 因此先看上一个词之后是否紧接着该词，否则从上一个词的起点之后查找
+        start, end = -1, 0
+        for t in segmenter.cut(chunk, cache):
+            if chunk.startswith(t, end):
+                start = end
+            else:
+                start = chunk.find(t, start + 1)
+                if start < 0:
+                    start, end = end, end
+                    continue
+            end = start + len(t)
+            if (len(t) > 1 or len(chunk) == 1) and t not in STOPWORDS and t not in segmenter.stopwords:
+                spans.append((t, m.start() + start, m.start() + end))
+    return spans
+
+
+class BM25FIndex:
+    """
+    只读 BM25F 倒排索引
+
+    postings[词] = (文档编号 array('i'), 伪词频 array('f'))，文档编号是 build 时记录的顺序；
+    也可以是共享语料制品中的 MappedTable（同样的两列，mmap 只读，见 export / from_artifact）。
+    单个词项的得分为 idf * tf / (K1 + tf)，小于 idf，因此 upper_bound 给出查询得分的上界。
+    idf 按需计算并缓存（只缓存查询用到的词项）。
+    """
+
+    def __init__(self, postings: Mapping[str, Tuple[Sequence[int], Sequence[float]]], num_docs: int, k1: float = K1) -> None:
+        self.postings = postings
+        self.num_docs = num_docs
+        self.k1 = k1
+        self._idf: Dict[str, float] = {}
+
+    def idf(self, term: str) -> float:
+        """词项的 idf（不在索引中时为 0）"""
+        value = self._idf.get(term)
+        if value is None:
+            entry = self.postings.get(term)
+            df = len(entry[0]) if entry is not None else 0
+            value = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5)) if df else 0.0
+            self._idf[term] = value
+        return value
+
+    def export(self, writer, name: str = "bm25") -> None:
+        """写入共享语料制品（writer 为 corpus_store.ArtifactWriter）"""
+        writer.table(name, self.postings, "if")
+        writer.json(f"{name}.meta", {"num_docs": self.num_docs, "k1": self.k1})
+
+    @classmethod
+    def from_artifact(cls, corpus, name: str = "bm25") -> "BM25FIndex":
+        """从共享语料制品打开（倒排表留在 mmap 中，不复制到进程内）"""
+        meta = corpus.json(f"{name}.meta")
+        return cls(corpus.table(name), meta["num_docs"], meta["k1"])
+
+    @classmethod
+    def build(
+        cls,
+        records: Iterable[Mapping[str, str]],
+        weights: Mapping[str, float] = FIELD_WEIGHTS,
+        b: Mapping[str, float] = FIELD_B,
+        k1: float = K1,
+    ) -> "BM25FIndex":
+        """records 中每一项是 字段名 -> 文本或已分好的词项列表（未列出的字段忽略）"""
+        field_tfs: List[Dict[str, Counter]] = []
+        total_len = {field: 0 for field in weights}
+        for record in records:
+            tfs = {}
+            for field in weights:
+                value = record.get(field) or ""
+                tokens = value if isinstance(value, list) else tokenize(value, cache=False)
+                tfs[field] = Counter(tokens)
+                total_len[field] += len(tokens)
+            field_tfs.append(tfs)
+
+        num_docs = len(field_tfs)
+        avg_len = {field: (total_len[field] / num_docs if num_docs else 0.0) or 1.0 for field in weights}
+
+        postings: Dict[str, Tuple[array, array]] = {}
+        for doc_id, tfs in enumerate(field_tfs):
+            combined: Dict[str, float] = {}
+            for field, tf in tfs.items():
+                if not tf:
+                    continue
+                length = sum(tf.values())
+                norm = weights[field] / (1 - b[field] + b[field] * length / avg_len[field])
+                for term, n in tf.items():
+                    combined[term] = combined.get(term, 0.0) + n * norm
+            for term, value in combined.items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = (array("i"), array("f"))
+                entry[0].append(doc_id)
+                entry[1].append(value)
+
+        logger.info(f"🔎 BM25F 索引: {num_docs} 个文档, {len(postings)} 个词项")
+        return cls(postings, num_docs, k1)
+
+    def upper_bound(self, terms: Mapping[str, float]) -> float:
+        """查询得分上界：各词项 权重 * idf 之和"""
+        return sum(weight * self.idf(term) for term, weight in terms.items())
+
+    def search(
+        self,
+        terms: Mapping[str, float],
+        limit: Optional[int] = None,
+        slack: float = 0.0,
+        allowed: Optional[Container[int]] = None,
+        stats: Optional[Dict[str, int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        terms: 查询词项 -> 权重；返回 [(文档编号, 得分)]，按得分降序
+
+        只累加与查询共享词项的文档。limit 为空时返回全部命中；给定 limit 时按 MaxScore 剪枝：
+        词项按得分上界从大到小处理，剩余词项上界之和（加 slack）已低于当前第 limit 名的得分时，
+        没出现过的文档不可能再进入前 limit 名，之后只给已有文档累加。
+        返回前 limit 名，以及与第 limit 名相差不超过 slack 的文档（调用方之后还会加分时用）。
+        allowed: 只为其中的文档打分（结构化字段过滤，见 scripts/field_index.py）；为空时不限制。
+        stats: 给定时累加 "scored"（实际打分的文档数，剪枝后可能远多于返回的结果数）。
+        """
+        k1 = self.k1
+        ordered = sorted(
+            ((self.idf(term) * weight, term) for term, weight in terms.items() if term in self.postings),
+            reverse=True
+        )
+        remaining = sum(bound for bound, _ in ordered)
+        threshold = -math.inf
+        scores: Dict[int, float] = {}
+        for bound, term in ordered:
+            ids, tfs = self.postings[term]
+            if remaining + slack < threshold:
+                for doc_id, tf in zip(ids, tfs):
+                    if doc_id in scores:
+                        scores[doc_id] += bound * tf / (k1 + tf)
+            elif allowed is None:
+                for doc_id, tf in zip(ids, tfs):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + bound * tf / (k1 + tf)
+            else:
+                for doc_id, tf in zip(ids, tfs):
+                    if doc_id in allowed:
+                        scores[doc_id] = scores.get(doc_id, 0.0) + bound * tf / (k1 + tf)
+            remaining -= bound
+            if limit and len(scores) >= limit:
+                threshold = heapq.nlargest(limit, scores.values())[-1]
+
+        if stats is not None:
+            stats["scored"] = stats.get("scored", 0) + len(scores)
+        if limit is None:
+            return sorted(scores.items(), key=itemgetter(1), reverse=True)
+        ranked = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+        if slack > 0 and len(ranked) == limit:
+            cutoff = ranked[-1][1] - slack
+            top = {doc_id for doc_id, _ in ranked}
+            near = [item for item in scores.items() if item[1] >= cutoff and item[0] not in top]
+            ranked.extend(sorted(near, key=itemgetter(1), reverse=True))
+        return ranked
+
+    def __len__(self) -> int:
+        return len(self.postings)
@@ -44,9 +44,11 @@ except ImportError:
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36'
 HEADERS = {'User-Agent': USER_AGENT}
 
-def search_web(query: str, language: str = "en", max_results: int = 5) -> List[Dict]:
+def search_web(query: str, language: str = "en", max_results: int = 5, timeout: float = 10) -> List[Dict]:
     """
     网络搜索函数 - 修复版 (使用 DDGS API)
+
+    timeout: 请求超时（秒），由调用方按请求剩余时间给出
     """
     
     if not HAVE_DDGS_API:
@@ -66,7 +68,7 @@ def search_web(query: str, language: str = "en", max_results: int = 5) -> List[D
         logger.info(f"🔍 [DDGS API] 搜索: {search_query} (区域: {region})")
         
         # 实例化 API
-        with DDGS(headers=HEADERS, timeout=10) as ddgs:
+        with DDGS(headers=HEADERS, timeout=max(1, int(timeout))) as ddgs:
             # 执行文本搜索
             api_results = ddgs.text(
                 search_query,
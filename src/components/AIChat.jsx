@@ -119,6 +119,76 @@ export default function AIChat() {
   const [res, setRes] = useState(null);
   const [err, setErr] = useState("");
 
+  const askOnce = async (q) => {
+    // 非流式兜底：GET /api/qa?query=...
+    const r = await fetch(`/api/qa?query=${encodeURIComponent(q)}`);
+    if (!r.ok) throw new Error(`HTTP ${r.status}`);
+    const data = await r.json();
+
+    setRes({
+      intent: data.intent,
+      answer: data.answer,
+      citations: data.citations || [],
+      num_queries: data.num_queries ?? 0,
+      num_docs: data.num_docs ?? (data.citations || []).length,
+      response_time: data.response_time ?? "-",
+    });
+  };
+
+  // 流式：GET /api/qa/stream（SSE），先到引用，再逐段到答案，最后到元数据
+  const askStream = (q) =>
+    new Promise((resolve, reject) => {
+      const es = new EventSource(`/api/qa/stream?query=${encodeURIComponent(q)}`);
+      let received = false;
+
+      const update = (patch) =>
+        setRes((prev) => ({
+          intent: undefined,
+          answer: "",
+          citations: [],
+          num_queries: 0,
+          num_docs: 0,
+          response_time: "-",
+          ...(prev || {}),
+          ...patch(prev || {}),
+        }));
+
+      es.addEventListener("citations", (e) => {
+        const d = JSON.parse(e.data);
+        received = true;
+        setLoading(false);
+        update((prev) => ({
+          intent: d.intent ?? prev.intent,
+          citations: [...(prev.citations || []), ...(d.citations || [])],
+        }));
+      });
+      es.addEventListener("token", (e) => {
+        const d = JSON.parse(e.data);
+        update((prev) => ({ answer: (prev.answer || "") + (d.text || "") }));
+      });
+      es.addEventListener("done", (e) => {
+        const d = JSON.parse(e.data);
+        es.close();
+        update(() => ({
+          num_docs: d.num_docs ?? 0,
+          response_time: d.response_time ?? "-",
+        }));
+        resolve();
+      });
+      es.addEventListener("error", (e) => {
+        es.close();
+        let msg = "请求失败";
+        try {
+          msg = JSON.parse(e.data).msg || msg;
+        } catch {
+          // 连接级错误（没有 data）
+        }
+        const error = new Error(msg);
+        error.beforeFirstFrame = !received;
+        reject(error);
+      });
+    });
+
   const ask = async (qForced) => {
     const q = (qForced ?? query).trim();
     if (!q) return;
@@ -128,20 +198,13 @@ export default function AIChat() {
     setRes(null);
 
     try {
-      // 直接调你的 FastAPI：GET /api/qa?query=...
-      // 开发期建议在 vite.config.js 里加 proxy 把 /api 转 5051
-      const r = await fetch(`/api/qa?query=${encodeURIComponent(q)}`);
-      if (!r.ok) throw new Error(`HTTP ${r.status}`);
-      const data = await r.json();
-
-      setRes({
-        intent: data.intent,
-        answer: data.answer,
-        citations: data.citations || [],
-        num_queries: data.num_queries ?? 0,
-        num_docs: data.num_docs ?? (data.citations || []).length,
-        response_time: data.response_time ?? "-",
-      });
+      try {
+        await askStream(q);
+      } catch (e) {
+        // 流式连接失败（如代理不支持 SSE）时回退到普通接口
+        if (!e.beforeFirstFrame) throw e;
+        await askOnce(q);
+      }
     } catch (e) {
       setErr(e.message || "请求失败");
     } finally {
@@ -0,0 +1,73 @@
+# 测试 QA 准入控制
+import asyncio
+
+import pytest
+from scripts.admission import AdmissionController, Overloaded
+
+
+def test_rejects_when_queue_is_full():
+    async def go():
+        ctl = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1.0)
+        await ctl.acquire()
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as exc:
+            await ctl.acquire()
+        assert exc.value.reason == "queue_full"
+        assert exc.value.retry_after >= 1
+        ctl.release(0.1)
+        await waiter
+        assert ctl.active == 1 and ctl.queue_depth == 0
+        ctl.release(0.1)
+        return ctl
+
+    ctl = asyncio.run(go())
+    assert ctl.active == 0
+    assert ctl.rejected == 1
+
+
+def test_queued_request_times_out():
+    async def go():
+        ctl = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        async with ctl.admit():
+            with pytest.raises(Overloaded) as exc:
+                await ctl.acquire()
+            assert exc.value.reason == "timeout"
+        return ctl
+
+    ctl = asyncio.run(go())
+    assert ctl.active == 0 and ctl.queue_depth == 0
+
+
+def test_slots_are_handed_over_in_fifo_order():
+    order = []
+
+    async def go():
+        ctl = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=1.0)
+
+        async def job(name):
+            async with ctl.admit():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(job(i) for i in range(4)))
+        return ctl
+
+    ctl = asyncio.run(go())
+    assert order == [0, 1, 2, 3]
+    assert ctl.active == 0
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def go():
+        ctl = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=1.0)
+        await ctl.acquire()
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        ctl.release()
+        return ctl
+
+    ctl = asyncio.run(go())
+    assert ctl.active == 0 and ctl.queue_depth == 0
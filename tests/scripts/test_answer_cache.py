@@ -0,0 +1,51 @@
+# 测试 QA 答案缓存
+import json
+import time
+
+from scripts import answer_cache as ac
+from scripts.answer_cache import AnswerCache, normalize_query
+
+
+def _make_corpus(tmp_path):
+    (tmp_path / "ucl_services.json").write_text(json.dumps([{"title": "A"}]), encoding="utf-8")
+    return tmp_path
+
+
+def test_normalize_query():
+    assert normalize_query("  Data  Science MSc modules？ ") == "data science msc modules"
+    assert normalize_query("雅思要求？") == normalize_query("雅思要求")
+
+
+def test_key_ignores_formatting_but_not_language():
+    k = AnswerCache.make_key
+    assert k("Data Science MSc", "en", 5) == k("data science msc?", "en", 5)
+    assert k("Data Science MSc", "en", 5) != k("Data Science MSc", "zh", 5)
+    assert k("Data Science MSc", "en", 5) != k("Data Science MSc", "en", 10)
+
+
+def test_lru_and_ttl(tmp_path):
+    cache = AnswerCache(max_size=2, ttl=0.2, data_dir=_make_corpus(tmp_path))
+    etag = cache.set("a", {"answer": "1"})
+    cache.set("b", {"answer": "2"})
+    assert cache.get("a") == ({"answer": "1"}, etag)
+    cache.set("c", {"answer": "3"})  # 淘汰最久未使用的 b
+    assert cache.get("b") is None
+    time.sleep(0.25)
+    assert cache.get("a") is None
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    corpus = _make_corpus(tmp_path)
+    db = str(tmp_path / "cache.sqlite3")
+    AnswerCache(sqlite_path=db, data_dir=corpus).set("k", {"answer": "persisted"})
+    hit = AnswerCache(sqlite_path=db, data_dir=corpus).get("k")
+    assert hit is not None and hit[0] == {"answer": "persisted"}
+
+
+def test_corpus_change_invalidates(tmp_path, monkeypatch):
+    monkeypatch.setattr(ac, "FINGERPRINT_CHECK_INTERVAL", 0.0)
+    corpus = _make_corpus(tmp_path)
+    cache = AnswerCache(data_dir=corpus)
+    cache.set("k", {"answer": "old"})
+    (corpus / "ucl_programs.json").write_text("[]", encoding="utf-8")
+    assert cache.get("k") is None
@@ -0,0 +1,89 @@
+# 测试内存映射语料制品
+import json
+import os
+
+import numpy as np
+from scripts.corpus_store import MappedCorpus, ensure_artifact
+from scripts.qa_enhanced_wrapper import _build_program_index
+
+DOCS = [
+    {"title": "Data Science MSc", "level": "Graduate", "sections": [{"heading": "Overview", "text": "数据科学"}]},
+    {"title": "Computer Science BSc", "level": "Undergraduate", "sections": []},
+    {"title": "Museum Studies MA", "level": "Graduate", "sections": []},
+]
+
+
+def _build(tmp_path, embed=None):
+    source = tmp_path / "programs.json"
+    if not source.exists():
+        source.write_text(json.dumps(DOCS, ensure_ascii=False), encoding="utf-8")
+    calls = []
+
+    def load():
+        calls.append(1)
+        return json.loads(source.read_text(encoding="utf-8"))
+
+    corpus = ensure_artifact([source], load, _build_program_index, out_dir=tmp_path / "artifact", embed=embed)
+    return source, corpus, calls
+
+
+def test_docs_and_index_round_trip(tmp_path):
+    _, corpus, _ = _build(tmp_path)
+    assert len(corpus.docs) == 3
+    assert list(corpus.docs) == DOCS
+    assert corpus.docs[-1]["title"] == "Museum Studies MA"
+
+    expected = _build_program_index(DOCS)
+    assert set(corpus.index) == set(expected)
+    for key, docs in expected.items():
+        assert corpus.index[key] == docs
+    assert "nonexistent" not in corpus.index
+
+
+def test_artifact_is_reused_until_sources_change(tmp_path):
+    source, _, calls = _build(tmp_path)
+    assert len(calls) == 1
+
+    _, _, calls = _build(tmp_path)
+    assert calls == []
+
+    source.write_text(json.dumps(DOCS[:1]), encoding="utf-8")
+    corpus = ensure_artifact([source], lambda: DOCS[:1], _build_program_index, out_dir=tmp_path / "artifact")
+    assert len(corpus.docs) == 1
+    assert len(MappedCorpus(tmp_path / "artifact").docs) == 1
+
+
+def test_embeddings_are_memory_mapped(tmp_path):
+    _, corpus, _ = _build(tmp_path, embed=lambda docs: np.eye(len(docs), 4))
+    assert isinstance(corpus.embeddings, np.memmap)
+    assert corpus.embeddings.shape == (3, 4)
+    assert corpus.embeddings[1, 1] == 1.0
+
+
+def test_snapshot_from_artifact_keeps_indexes_mapped(tmp_path):
+    from scripts import qa_enhanced_wrapper as w
+    from scripts.corpus_store import MappedTable
+
+    docs = [w.unify_document(doc) for doc in DOCS]
+    corpus = ensure_artifact(
+        [], lambda: docs, _build_program_index, out_dir=tmp_path / "artifact", extra=w._write_search_indexes
+    )
+    mapped = w.CorpusSnapshot.from_artifact(corpus)
+    memory = w.CorpusSnapshot.from_documents(DOCS)
+    assert isinstance(mapped.text_index.postings, MappedTable)
+    assert mapped.info()["source"] == "mmap" and len(mapped.passage_index) == len(memory.passage_index)
+    for query in ("data science", "museum ma", "数据科学"):
+        results = w._batch_smart_search([query], mapped)
+        assert results[0] and results == w._batch_smart_search([query], memory)
+
+
+def test_rebuild_swaps_generation_without_touching_open_corpus(tmp_path):
+    source, old, _ = _build(tmp_path)
+    for n in (1, 2):
+        source.write_text(json.dumps(DOCS[:n]), encoding="utf-8")
+        os.utime(source, ns=(n * 10**9, n * 10**9))
+        new = ensure_artifact([source], lambda: DOCS[:n], _build_program_index, out_dir=tmp_path / "artifact")
+        assert len(new.docs) == n and new.path != old.path
+    # 已打开的旧世代保持一致（文件已映射），旧世代目录只保留 KEEP_GENERATIONS 个
+    assert list(old.docs) == DOCS and old.index["data science msc"] == [DOCS[0]]
+    assert len(list((tmp_path / "artifact").glob("gen-*"))) == 2
@@ -0,0 +1,81 @@
+# 测试请求截止时间与各阶段预算
+import pytest
+from scripts import llm_client
+from scripts import qa_enhanced_wrapper as w
+from scripts.deadline import Deadline, DeadlineExceeded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_deadline_budget_and_timeout():
+    clock = FakeClock()
+    deadline = Deadline(10, clock=clock)
+    assert deadline.timeout(cap=4, reserve=5) == 4
+    clock.now += 7
+    assert deadline.timeout(cap=4, reserve=5) == 0
+    assert deadline.allows(2) and not deadline.allows(4)
+    with pytest.raises(DeadlineExceeded):
+        deadline.check("llm", 3)
+    clock.now += 5
+    assert deadline.expired() and deadline.remaining() == 0
+
+
+def test_tight_deadline_skips_web_search_and_llm(monkeypatch):
+    calls = []
+    monkeypatch.setattr(w, "HAVE_WEB_SEARCH", True)
+    monkeypatch.setattr(w, "search_web", lambda *a, **k: calls.append(k) or [], raising=False)
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+
+    local = [{"doc": {"title": "Museum Studies MA", "url": "u"}, "score": 5,
+              "matched_sections": [{"heading": "About", "text": "Museum theory"}]}]
+    result = w.answer_from_plan({
+        "query": "museum", "language": "en", "intent": "general",
+        "local_results": local, "deadline": Deadline(1.5),
+    })
+    assert calls == []
+    assert result["skipped_stages"] == ["web_search", "full_context", "llm"]
+    assert result["degraded"] is True
+
+
+def test_llm_does_not_retry_past_deadline(monkeypatch):
+    attempts = []
+
+    class FailingCompletions:
+        def create(self, **kwargs):
+            attempts.append(kwargs.get("timeout"))
+            raise RuntimeError("503")
+
+    class FakeClient:
+        chat = type("Chat", (), {"completions": FailingCompletions()})()
+
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setattr(llm_client, "_init_client", lambda: FakeClient())
+    monkeypatch.setattr(llm_client.time, "sleep", lambda s: pytest.fail("should not back off"))
+
+    with pytest.raises(Exception, match="Groq API failed"):
+        llm_client.chat_with_groq([{"role": "user", "content": "hi"}], deadline=Deadline(2.5))
+    assert len(attempts) == 1 and 0 < attempts[0] <= 2.5
+
+    with pytest.raises(DeadlineExceeded):
+        llm_client.chat_with_groq([{"role": "user", "content": "hi"}], deadline=Deadline(1))
+
+
+def test_llm_deadline_exceeded_falls_back_to_context(monkeypatch):
+    def late(*args, **kwargs):
+        raise DeadlineExceeded("llm", 0.5)
+
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setattr(llm_client, "chat_with_groq", late)
+    errors = w.ERRORS.value(stage="llm")
+    deadline = Deadline(30)
+    answer = w._generate_comprehensive_answer("context text", "q", "en", True, deadline)
+    assert answer == "context text"
+    # 按截止时间降级处理，不计为 LLM 错误
+    assert list(deadline.skipped) == ["llm"]
+    assert w.ERRORS.value(stage="llm") == errors
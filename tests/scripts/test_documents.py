@@ -0,0 +1,62 @@
+# 测试文档规范化（专业 / 服务统一结构）
+from scripts import qa_enhanced_wrapper as w
+from scripts.documents import detect_degree, normalize_document
+
+SERVICE = {
+    "id": "student-support", "name": "Student Support and Wellbeing", "type": "service",
+    "description": "Confidential  counselling\nand wellbeing support",
+    "services": ["Counselling", "Disability support"],
+    "booking": {"online": "Book via askUCL"},
+}
+
+
+def test_detect_degree_from_level_or_title():
+    assert detect_degree("Data Science MSc") == ("msc", "master")
+    assert detect_degree("Computer Science", "BSc") == ("bsc", "bachelor")
+    assert detect_degree("Mechanical Engineering MEng") == ("meng", "bachelor")
+    assert detect_degree("History", "Postgraduate taught") == ("", "master")
+    assert detect_degree("Marketing") == ("", "")
+
+
+def test_program_keeps_original_dict():
+    doc = {"title": "Museum Studies MA", "url": "u", "sections": [{"heading": " About ", "text": "Museum\n theory"}]}
+    norm = normalize_document(doc)
+    assert norm.doc is doc
+    assert norm.degree == "master" and norm.title_lower == "museum studies ma"
+    assert norm.sections[0].heading == "About" and norm.sections[0].text == "Museum theory"
+    assert "theory" in norm.sections[0].text_terms
+
+
+def test_service_is_unified_and_searchable(monkeypatch):
+    norm = normalize_document(SERVICE)
+    assert norm.doc["title"] == "Student Support and Wellbeing"
+    assert [s["heading"] for s in norm.doc["sections"]] == ["Description", "Services", "Booking"]
+    assert norm.sections[0].text == "Confidential counselling and wellbeing support"
+    assert "disability" in norm.sections[1].text_terms
+
+    monkeypatch.setattr(w, "_SNAPSHOT", w.CorpusSnapshot.from_documents([SERVICE]))
+    results = w._smart_search("disability support")
+    assert [r["doc"]["title"] for r in results] == ["Student Support and Wellbeing"]
+    assert results[0]["matched_sections"]
+
+
+def test_retriever_norm_cache_is_keyed_by_url_and_bounded(monkeypatch):
+    from scripts import enhanced_retriever as er
+    monkeypatch.setattr(er, "NORM_CACHE_SIZE", 2)
+    r = er.EnhancedRetriever(enable_semantic=False)
+    doc = {"title": "Data Science MSc", "url": "u1",
+           "sections": [{"heading": "Fees", "text": "Tuition fees"}, {"heading": "Modules", "text": "Core modules"},
+                        {"heading": "Campus", "text": "Free coffee"}]}
+    # mmap 模式下同一文档每次都是新 dict：按 url 命中
+    assert r._normalized(dict(doc)) is r._normalized(dict(doc))
+    # 内容变化（语料重载）时不复用旧记录
+    changed = {**doc, "title": "Data Science MA"}
+    assert r._normalized(changed).title_lower == "data science ma"
+    for i in range(5):
+        r._normalized({"title": f"T{i}", "url": f"x{i}"})
+    assert len(r._norm_cache) == 2
+    # 章节按词项匹配：modules 与 module 同词干，fee 不再命中 coffee
+    sections = r._normalized(doc).sections
+    assert r._section_has(sections[1], tuple(er.tokenize("module")))
+    assert r._section_has(sections[0], tuple(er.tokenize("tuition fee")))
+    assert not r._section_has(sections[2], tuple(er.tokenize("fee")))
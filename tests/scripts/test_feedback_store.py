@@ -0,0 +1,81 @@
+# 测试反馈批量写入与统计
+import gzip
+import json
+
+from scripts.feedback_store import FeedbackStore
+
+
+def test_entries_are_flushed_on_close(tmp_path):
+    store = FeedbackStore(tmp_path / "feedback.log", flush_size=100, flush_interval=60)
+    store.remember_intent("r1", "fees")
+    for helpful in (True, False, False):
+        assert store.submit({"request_id": "r1", "helpful": helpful})
+    store.close()
+
+    lines = (tmp_path / "feedback.log").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 3
+    assert all(json.loads(line)["intent"] == "fees" for line in lines)
+
+
+def test_stats_by_intent_and_worst_rated(tmp_path):
+    store = FeedbackStore(tmp_path / "feedback.log")
+    store.submit({"request_id": "a", "helpful": True, "intent": "modules"})
+    store.submit({"request_id": "b", "helpful": False, "intent": "modules"})
+    store.submit({"request_id": "b", "helpful": False, "intent": "modules"})
+    store.submit({"request_id": "c", "helpful": False, "intent": "fees"})
+    store.submit({"request_id": "d", "note": "no rating"})
+    stats = store.snapshot(worst=2)
+    store.close()
+
+    assert stats["total"] == 4
+    assert stats["by_intent"]["modules"]["helpful_rate"] == round(1 / 3, 4)
+    assert stats["by_intent"]["fees"]["helpful_rate"] == 0
+    assert [r["request_id"] for r in stats["worst_rated"]] == ["b", "c"]
+
+
+def test_rotation_compresses_and_stats_survive_restart(tmp_path):
+    path = tmp_path / "feedback.log"
+    store = FeedbackStore(path, flush_size=1, max_bytes=1, backup_count=2)
+    for i in range(3):
+        store.submit({"request_id": f"r{i}", "helpful": True})
+        store.close()
+
+    assert not path.exists()
+    assert (tmp_path / "feedback.log.1.gz").exists()
+    assert (tmp_path / "feedback.log.2.gz").exists()
+    assert not (tmp_path / "feedback.log.3.gz").exists()
+    with gzip.open(tmp_path / "feedback.log.1.gz", "rt", encoding="utf-8") as f:
+        assert json.loads(f.read())["request_id"] == "r2"
+
+    path.write_text(json.dumps({"request_id": "x", "helpful": False}) + "\n", encoding="utf-8")
+    restarted = FeedbackStore(path)
+    restarted.start()
+    assert restarted.replayed.wait(5)
+    assert restarted.snapshot()["total"] == 1
+    restarted.close()
+
+
+def test_workers_share_one_log_and_see_each_others_entries(tmp_path):
+    path = tmp_path / "feedback.log"
+    a = FeedbackStore(path, flush_size=1, flush_interval=60)
+    b = FeedbackStore(path, flush_size=1, flush_interval=60)
+    for store in (a, b):
+        store.start()
+        assert store.replayed.wait(5)
+
+    a.submit({"request_id": "x1", "helpful": True})
+    a.close()
+    b.submit({"request_id": "x2", "helpful": False})
+    b.close()
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+    assert b.snapshot()["total"] == 2
+    a._sync()
+    assert a.snapshot()["total"] == 2
+
+    # 其他 worker 轮转之后，仍能读到轮转前追加、尚未读过的条目
+    c = FeedbackStore(path, flush_size=1, max_bytes=1)
+    c.submit({"request_id": "x3", "helpful": True})
+    c.close()
+    assert not path.exists() and c.snapshot()["total"] == 3
+    a._sync()
+    assert a.snapshot()["total"] == 3
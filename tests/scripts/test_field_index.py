@@ -0,0 +1,49 @@
+# 测试结构化字段索引与检索过滤
+import pytest
+from scripts import qa_enhanced_wrapper as w
+from scripts.answer_cache import AnswerCache
+from scripts.documents import normalize_document
+from scripts.field_index import FieldIndex, parse_filters
+
+DOCS = [
+    {"title": "Data Science MSc", "url": "u1", "school": "ucl", "type": "program", "sections": [
+        {"heading": "About this degree", "text": "Data science and machine learning"},
+    ]},
+    {"title": "Data Management BA", "url": "u2", "school": "ucl", "type": "program", "sections": [
+        {"heading": "About this degree", "text": "Data governance and records"},
+    ]},
+    {"name": "Data Support Service", "url": "u3", "school": "ucl", "type": "service", "category": "it",
+     "description": "Help with data storage and research data"},
+]
+
+
+def test_program_index_matches_degree_words_not_substrings():
+    index = w._build_program_index(DOCS)
+    titles = lambda key: [d.get("title") for d in index.get(key, [])]
+    # "data" / "management" 不再命中 "ba" / "ma"
+    assert titles("master") == ["Data Science MSc"]
+    assert titles("bachelor") == ["Data Management BA"]
+    assert titles("ba") == ["Data Management BA"] and "ma" not in index
+    assert titles("msc") == ["Data Science MSc"]
+
+
+def test_filters_union_within_field_and_intersect_across_fields():
+    index = FieldIndex.build([normalize_document(d) for d in DOCS])
+    assert list(index.ids("degree", "master")) == [0]
+    assert index.allowed(None) is None
+    assert index.allowed(parse_filters({"type": "program", "level": "msc,ba"})) == {0, 1}
+    assert index.allowed(parse_filters({"type": "Service", "category": "it", "degree": None})) == {2}
+    assert index.allowed(parse_filters({"type": "service", "level": "msc"})) == frozenset()
+    with pytest.raises(ValueError):
+        parse_filters({"colour": "red"})
+
+
+def test_search_applies_filters_before_scoring(monkeypatch):
+    monkeypatch.setattr(w, "_SNAPSHOT", w.CorpusSnapshot.from_documents(DOCS))
+    assert len(w._smart_search("data", top_k=5)) == 3
+    services = w._smart_search("data", top_k=5, filters={"type": ("service",)})
+    assert [r["doc"]["url"] for r in services] == ["u3"]
+    masters = w._smart_search("data science", top_k=5, filters={"level": ("msc",)})
+    assert [r["doc"]["url"] for r in masters] == ["u1"]
+    # 过滤条件进入答案缓存键
+    assert AnswerCache.make_key("data", "en", 5) != AnswerCache.make_key("data", "en", 5, {"type": ("service",)})
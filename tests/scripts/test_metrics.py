@@ -0,0 +1,39 @@
+# 测试 Prometheus 指标
+from scripts.metrics import Counter, Histogram, count, render_metrics, request_trace, timed
+
+
+def test_counter_renders_labels():
+    c = Counter("test_things_total", "Things", ["kind"])
+    c.inc(kind="a")
+    c.inc(2, kind="a")
+    assert c.value(kind="a") == 3
+    assert 'test_things_total{kind="a"} 3' in render_metrics()
+
+
+def test_unlabelled_counter_starts_at_zero():
+    Counter("test_zero_total", "Zero")
+    assert "test_zero_total 0" in render_metrics()
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("test_latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        h.observe(v, stage="llm")
+    text = render_metrics()
+    assert 'test_latency_seconds_bucket{stage="llm",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="llm",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="llm",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{stage="llm"} 3' in text
+
+
+def test_request_trace_collects_stage_timings_and_counts():
+    with request_trace() as trace:
+        with timed("smart_search"):
+            count("docs_scored", 10)
+        with request_trace() as nested:
+            assert nested is trace
+            count("docs_scored", 5)
+    data = trace.as_dict()
+    assert data["docs_scored"] == 15
+    assert data["stages_ms"]["smart_search"] >= 0
+    count("docs_scored")  # 无追踪时忽略
@@ -0,0 +1,46 @@
+# 测试多模式匹配器（Aho–Corasick）
+from scripts import qa_enhanced_wrapper as w
+from scripts.multi_match import MultiPatternMatcher
+
+
+def test_finds_overlapping_patterns_in_one_pass():
+    matcher = MultiPatternMatcher([("he", 1), ("she", 2), ("hers", 3), ("his", 4)])
+    hits = matcher.find("ushers")
+    assert sorted((start, pattern) for start, pattern, _ in hits) == [(1, "she"), (2, "he"), (2, "hers")]
+    assert matcher.values("ushers", min_length=4) == {3}
+    assert matcher.find("xyz") == []
+
+
+def test_add_at_runtime_rebuilds():
+    matcher = MultiPatternMatcher([("计算机", "computer science")])
+    assert matcher.values("计算机科学入学要求") == {"computer science"}
+    assert matcher.add("Data Science", "data science")
+    assert not matcher.add("data science", "data science")
+    assert matcher.values("msc in data science") == {"data science"}
+    assert len(matcher) == 2
+
+
+def test_program_alias_and_intent_detection(monkeypatch):
+    # 运行时追加的别名不影响其他测试
+    monkeypatch.setattr(w, "ALIAS_MATCHER", MultiPatternMatcher(
+        (alias, name) for name, aliases in w.PROGRAM_ALIASES.items() for alias in aliases
+    ))
+    monkeypatch.setattr(w, "PROGRAM_ALIASES", {k: list(v) for k, v in w.PROGRAM_ALIASES.items()})
+    monkeypatch.setattr(w, "_ALIAS_RANK", dict(w._ALIAS_RANK))
+
+    assert w._extract_program_name("计算机科学的课程") == "computer science"
+    assert w._detect_intent("数据科学课程") == "modules"
+    assert w._detect_intent("career prospects") == "career"
+    assert w._extract_program_name("机器学习硕士") is None
+
+    assert w.add_program_alias("Machine Learning", "机器学习")
+    assert w._extract_program_name("机器学习硕士") == "machine learning"
+
+
+def test_queries_use_old_automaton_until_swap():
+    matcher = MultiPatternMatcher([("data", 1)])
+    old = matcher._automaton
+    matcher.add("science", 2)
+    # 旧自动机不被修改，新自动机整体替换
+    assert matcher._automaton is not old and len(old.out) == 5
+    assert matcher.values("data science") == {1, 2}
@@ -0,0 +1,49 @@
+# 测试章节段落索引（片段选择、高亮区间、段落级检索）
+from scripts import qa_enhanced_wrapper as w
+from scripts.documents import normalize_document
+from scripts.passage_index import PassageIndex
+
+DOCS = [
+    {"title": "Data Science MSc", "url": "u1", "sections": [
+        {"heading": "Compulsory modules", "text": "Statistical learning,  Machine\nlearning"},
+        {"heading": "Empty", "text": ""},
+        {"heading": "Entry requirements", "text": "IELTS 7.0 and a Bachelor's degree in statistics"},
+    ]},
+    {"title": "Museum Studies MA", "url": "u2", "sections": [
+        {"heading": "About this degree", "text": "Museum theory and learning in practice"},
+    ]},
+]
+
+
+def _index():
+    tags = {"compulsory modules": frozenset({"module"})}
+    return PassageIndex.build([normalize_document(d) for d in DOCS], lambda h: tags.get(h, frozenset()))
+
+
+def test_select_scores_passages_within_document():
+    index = _index()
+    assert len(index) == 3 and index.doc_range(1) == (2, 3)
+    snippets = index.select(0, ["statistic", "learning"], groups={"module"})
+    assert [s["heading"] for s in snippets] == ["Compulsory modules", "Entry requirements"]
+    assert [s["score"] for s in snippets] == [21, 1]
+    # 正文已清理空白，高亮区间指向原文中的词
+    text = snippets[0]["text"]
+    assert text == "Statistical learning, Machine learning"
+    assert [text[a:b] for a, b in snippets[0]["highlights"]] == ["learning", "learning"]
+    assert index.select(5, ["learning"]) == []
+
+
+def test_search_ranks_passages_across_documents():
+    index = _index()
+    hits = index.search({"museum": 1.0, "learning": 1.0})
+    assert [index.passage(pid).doc_id for pid, _ in hits] == [1, 0]
+
+
+def test_wrapper_snippets_come_from_passage_index(monkeypatch):
+    monkeypatch.setattr(w, "_SNAPSHOT", w.CorpusSnapshot.from_documents(DOCS))
+    results = w._smart_search("museum theory", top_k=1)
+    section = results[0]["matched_sections"][0]
+    assert section["heading"] == "About this degree"
+    assert [section["text"][a:b] for a, b in section["highlights"]] == ["Museum", "theory"]
+    passages = w.search_passages("machine learning", top_k=2)
+    assert passages[0]["doc"]["url"] == "u1" and passages[0]["heading"] == "Compulsory modules"
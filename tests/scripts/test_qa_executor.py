@@ -0,0 +1,63 @@
+# 测试 QA 执行池
+import asyncio
+import threading
+import time
+
+from scripts import qa_executor
+from scripts.qa_executor import iterate_in_pool, run_in_pool
+
+
+def test_run_in_pool_off_event_loop():
+    main_thread = threading.get_ident()
+
+    async def go():
+        return await run_in_pool(threading.get_ident)
+
+    assert asyncio.run(go()) != main_thread
+
+
+def test_event_loop_not_blocked():
+    async def go():
+        slow = asyncio.ensure_future(run_in_pool(time.sleep, 0.3))
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await slow
+        return elapsed
+
+    assert asyncio.run(go()) < 0.2
+
+
+def test_iterate_in_pool_streams_and_closes():
+    closed = []
+
+    def gen(n):
+        try:
+            for i in range(n):
+                yield i
+        finally:
+            closed.append(True)
+
+    async def go():
+        items = []
+        async for item in iterate_in_pool(gen, 5):
+            items.append(item)
+            if item == 2:
+                break
+        await asyncio.sleep(0.05)
+        return items
+
+    assert asyncio.run(go()) == [0, 1, 2]
+    assert closed == [True]
+
+
+def test_run_on_all_workers_reaches_every_process(monkeypatch):
+    import os
+    qa_executor.shutdown_executor()
+    monkeypatch.setattr(qa_executor, "QA_EXECUTOR_KIND", "process")
+    monkeypatch.setattr(qa_executor, "QA_MAX_WORKERS", 2)
+    try:
+        pids = asyncio.run(qa_executor.run_on_all_workers(os.getpid))
+    finally:
+        qa_executor.shutdown_executor(wait=True)
+    assert len(set(pids)) == 2 and os.getpid() not in pids
@@ -0,0 +1,173 @@
+# 测试 QA 检索流程（不调用 LLM / 网络）
+import os
+import json
+import pickle
+import pytest
+from scripts import qa_enhanced_wrapper as w
+
+DOCS = [
+    {"title": "Data Science MSc", "url": "u1", "level": "MSc", "type": "program", "sections": [
+        {"heading": "Compulsory modules", "text": "Statistical learning, Data engineering, Machine learning"},
+        {"heading": "Entry requirements", "text": "A minimum of an upper second-class UK Bachelor's degree. IELTS 7.0"},
+    ]},
+    {"title": "Computer Science BSc", "url": "u2", "level": "BSc", "type": "program", "sections": [
+        {"heading": "Entry requirements", "text": "A levels A*A*A including Mathematics"},
+        {"heading": "Careers", "text": "Graduates work as software engineers"},
+    ]},
+    {"title": "Museum Studies MA", "url": "u3", "level": "MA", "type": "program", "sections": [
+        {"heading": "About this degree", "text": "Museum theory and practice"},
+    ]},
+]
+
+
+@pytest.fixture(autouse=True)
+def corpus(monkeypatch):
+    monkeypatch.setattr(w, "_SNAPSHOT", w.CorpusSnapshot.from_documents(DOCS))
+    monkeypatch.setattr(w, "HAVE_WEB_SEARCH", False)
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+
+
+def _titles(results):
+    return [r["doc"]["title"] for r in results]
+
+
+def test_program_name_ranks_first():
+    results = w._smart_search("Data Science MSc modules", top_k=3)
+    assert _titles(results)[0] == "Data Science MSc"
+    assert results[0]["score"] >= 100
+
+
+def test_batch_search_matches_single_search():
+    queries = ["Data Science MSc modules", "computer science entry requirements", "museum"]
+    batch = w._batch_smart_search(queries, top_k=3)
+    for query, results in zip(queries, batch):
+        single = w._smart_search(query, top_k=3)
+        assert [(r["doc"]["url"], r["score"]) for r in results] == [(r["doc"]["url"], r["score"]) for r in single]
+
+
+def test_retrieve_batch_and_answer_from_plan():
+    plans = w.retrieve_batch(["Data Science MSc modules", "计算机科学入学要求"], top_k=3)
+    assert [p["language"] for p in plans] == ["en", "zh"]
+    result = w.answer_from_plan(plans[0])
+    assert result["citations"][0]["title"] == "Data Science MSc"
+    # 没有 GROQ_API_KEY 时回退为上下文原文
+    assert result["degraded"] is True
+    # 进程池模式下计划与查询分析要经 pickle 传给子进程
+    restored = pickle.loads(pickle.dumps(plans[1]))
+    assert w.answer_from_plan(restored)["citations"] == w.answer_from_plan(plans[1])["citations"]
+    analysis = pickle.loads(pickle.dumps(w.analyze_query("Data Science MSc modules")))
+    assert dict(analysis.terms) == dict(w.analyze_query("Data Science MSc modules").terms)
+
+
+def test_reload_corpus_swaps_snapshot(tmp_path, monkeypatch):
+    programs = tmp_path / "programs.json"
+    programs.write_text(json.dumps(DOCS[:1]), encoding="utf-8")
+    monkeypatch.setattr(w, "PROGRAMS_PATH", programs)
+    monkeypatch.setattr(w, "SERVICES_PATH", tmp_path / "missing.json")
+    monkeypatch.setattr(w, "USE_CORPUS_MMAP", False)
+
+    first = w.reload_corpus(force=True)
+    old = w._current_snapshot()
+    assert first["reloaded"] and first["documents"] == 1
+    assert w.reload_corpus()["reloaded"] is False
+
+    programs.write_text(json.dumps(DOCS), encoding="utf-8")
+    os.utime(programs, ns=(0, 10 ** 18))
+    second = w.reload_corpus()
+    assert second["reloaded"] and second["version"] == old.version + 1
+    assert len(w._current_snapshot().docs) == 3
+    # 进行中的查询持有的旧快照保持不变
+    assert len(old.docs) == 1
+    assert _titles(w._smart_search("museum", old, 3)) == []
+    assert _titles(w._smart_search("museum", top_k=3)) == ["Museum Studies MA"]
+
+
+def test_keyword_search_only_scores_matching_documents():
+    results = w._smart_search("museum theory", top_k=3)
+    assert _titles(results) == ["Museum Studies MA"]
+    assert 0 < results[0]["score"] <= w.KEYWORD_SCORE_SCALE
+    assert results[0]["matched_sections"][0]["heading"] == "About this degree"
+
+
+def test_query_is_analyzed_once_and_memoized(monkeypatch):
+    w.analyze_query.cache_clear()
+    calls = []
+    detect_intent = w._detect_intent
+    monkeypatch.setattr(w, "_detect_intent", lambda q: calls.append(q) or detect_intent(q))
+
+    w.answer_enhanced("Data Science MSc modules", top_k=3)
+    w.answer_enhanced("Data Science MSc modules", top_k=3)
+    assert calls == ["Data Science MSc modules"]
+
+    analysis = w.analyze_query("Data Science MSc modules")
+    assert (analysis.language, analysis.intent, analysis.degree) == ("en", "modules", "master")
+    assert analysis.program_name == "data science"
+    assert analysis.keywords[:3] == ("data", "science", "msc")
+
+
+class FakeSemanticRetriever:
+    semantic_ready = True
+
+    def __init__(self, hits):
+        self.hits = hits
+
+    def semantic_scores(self, queries, top_k):
+        return [self.hits[:top_k] for _ in queries]
+
+
+def test_hybrid_retrieval_fuses_semantic_hits(monkeypatch):
+    monkeypatch.setattr(w, "_SEMANTIC_RETRIEVER", FakeSemanticRetriever([("u3", 0.8), ("u1", 0.3)]))
+
+    results = w._smart_search("statistical learning", top_k=3)
+    assert _titles(results) == ["Data Science MSc", "Museum Studies MA"]
+    assert results[0]["retrievers"] == ["keyword", "semantic"]
+    assert results[1]["retrievers"] == ["semantic"] and results[1]["score"] == 80.0
+    assert results[1]["matched_sections"] is not None
+
+    result = w.answer_enhanced("statistical learning", top_k=3)
+    assert result["semantic_used"] is True
+
+    monkeypatch.setattr(w, "RETRIEVAL_MODE", "semantic")
+    assert _titles(w._smart_search("statistical learning", top_k=3)) == ["Museum Studies MA", "Data Science MSc"]
+
+    monkeypatch.setattr(w, "RETRIEVAL_MODE", "keyword")
+    results = w._smart_search("statistical learning", top_k=3)
+    assert _titles(results) == ["Data Science MSc"] and "retrievers" not in results[0]
+
+
+def test_semantic_mode_falls_back_to_keyword_on_failure(monkeypatch):
+    class BrokenSemanticRetriever(FakeSemanticRetriever):
+        def semantic_scores(self, queries, top_k):
+            raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(w, "_SEMANTIC_RETRIEVER", BrokenSemanticRetriever([]))
+    monkeypatch.setattr(w, "RETRIEVAL_MODE", "semantic")
+    assert _titles(w._smart_search("statistical learning", top_k=3)) == ["Data Science MSc"]
+
+
+def test_semantic_wait_is_bounded_by_deadline(monkeypatch):
+    import time
+    from scripts.deadline import Deadline
+    calls = []
+
+    class SlowSemanticRetriever(FakeSemanticRetriever):
+        def semantic_scores(self, queries, top_k):
+            calls.append(queries)
+            time.sleep(1.0)
+            return super().semantic_scores(queries, top_k)
+
+    monkeypatch.setattr(w, "_SEMANTIC_RETRIEVER", SlowSemanticRetriever([("u3", 0.8)]))
+    monkeypatch.setattr(w, "SEMANTIC_TIMEOUT", 5.0)
+
+    start = time.monotonic()
+    results = w._smart_search("statistical learning", top_k=3, deadline=Deadline(0.2))
+    assert time.monotonic() - start < 0.8
+    assert _titles(results) == ["Data Science MSc"]
+
+    # 预算已用完：不提交语义检索，记为跳过
+    calls.clear()
+    deadline = Deadline(0)
+    assert _titles(w._smart_search("statistical learning", top_k=3, deadline=deadline)) == ["Data Science MSc"]
+    assert calls == [] and deadline.skipped == ["semantic"]
+    plans = w.retrieve_batch(["statistical learning"], top_k=3, deadline=Deadline(0))
+    assert plans[0]["skipped_stages"] == ["semantic"]
@@ -0,0 +1,46 @@
+# 测试令牌桶限流
+from scripts.rate_limit import FileBucketStore, RateLimiter, client_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_burst_then_refills():
+    clock = FakeClock()
+    limiter = RateLimiter({"cheap": 60, "expensive": 2}, clock=clock)
+
+    assert limiter.check("ip:1", "expensive").allowed
+    assert limiter.check("ip:1", "expensive").allowed
+    denied = limiter.check("ip:1", "expensive")
+    assert not denied.allowed
+    assert denied.headers()["Retry-After"] == "30"
+    # 其他客户端与其他档位互不影响
+    assert limiter.check("ip:2", "expensive").allowed
+    assert limiter.check("ip:1", "cheap").remaining == 59
+
+    clock.now += 30
+    assert limiter.check("ip:1", "expensive").allowed
+
+
+def test_file_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "buckets")
+    clock = FakeClock()
+    a = RateLimiter({"expensive": 1}, store=FileBucketStore(path, slots=64), clock=clock)
+    b = RateLimiter({"expensive": 1}, store=FileBucketStore(path, slots=64), clock=clock)
+
+    assert a.check("ip:1", "expensive").allowed
+    assert not b.check("ip:1", "expensive").allowed
+
+
+def test_client_key_prefers_api_key_and_last_proxy_hop():
+    assert client_key({"x-api-key": "secret"}, "10.0.0.1", api_keys={"secret"}).startswith("key:")
+    # 未配置的 key 不单独分桶，按 IP 计
+    assert client_key({"x-api-key": "random"}, "10.0.0.1", api_keys={"secret"}) == "ip:10.0.0.1"
+    assert client_key({"x-api-key": "secret"}, "10.0.0.1", api_keys=()) == "ip:10.0.0.1"
+    assert client_key({"x-forwarded-for": "6.6.6.6, 1.2.3.4"}, "10.0.0.1", trusted_proxies=1) == "ip:1.2.3.4"
+    assert client_key({"x-forwarded-for": "1.2.3.4"}, "10.0.0.1", trusted_proxies=0) == "ip:10.0.0.1"
@@ -0,0 +1,31 @@
+# 测试中文分词服务（用户词典与缓存）
+import pytest
+from scripts.segmenter import HAVE_JIEBA, Segmenter
+from scripts.text_index import tokenize
+
+
+@pytest.mark.skipif(not HAVE_JIEBA, reason="jieba 未安装")
+def test_user_dictionary_keeps_program_names_whole():
+    segmenter = Segmenter()
+    segmenter.add_words(["数据科学", "全球健康管理", "msc"])
+    assert segmenter.user_words >= 2
+    assert segmenter.cut("全球健康管理") == ("全球健康管理",)
+    assert "数据科学" in segmenter.cut("数据科学的课程")
+
+    # 加载后追加的词立即生效（缓存已清空）
+    assert segmenter.cut("跨文化交流") != ("跨文化交流",)
+    assert segmenter.add_words(["跨文化交流"]) == 1
+    assert segmenter.cut("跨文化交流") == ("跨文化交流",)
+
+
+def test_query_segments_are_cached_and_corpus_segments_are_not():
+    segmenter = Segmenter(cache_size=16)
+    segmenter.cut("计算机科学")
+    segmenter.cut("计算机科学")
+    segmenter.cut("入学要求", cache=False)
+    info = segmenter.cache_info()
+    assert (info.hits, info.currsize) == (1, 1)
+
+
+def test_tokenize_drops_chinese_stopwords():
+    assert "的" not in tokenize("数据科学的课程")
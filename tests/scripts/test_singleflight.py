@@ -0,0 +1,61 @@
+# 测试 single-flight 请求合并
+import asyncio
+
+import pytest
+from scripts.qa_executor import ClientDisconnected
+from scripts.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": "42"}
+
+    async def go():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("q", compute) for _ in range(5)))
+        return flights, results
+
+    flights, results = asyncio.run(go())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == [{"answer": "42"}] * 5
+    assert sum(shared for _, shared in results) == 4
+    assert flights.inflight() == 0
+
+
+def test_errors_propagate_to_all_waiters():
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("groq down")
+
+    async def go():
+        flights = SingleFlight()
+        return await asyncio.gather(*(flights.do("q", boom) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(go()))
+
+
+def test_last_disconnect_cancels_computation():
+    async def go():
+        cancelled = []
+
+        async def compute():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def gone():
+            return True
+
+        flights = SingleFlight()
+        with pytest.raises(ClientDisconnected):
+            await flights.do("q", compute, gone)
+        await asyncio.sleep(0)
+        return cancelled
+
+    assert asyncio.run(go()) == [True]
@@ -0,0 +1,80 @@
+# 测试静态文件缓存与预压缩
+import gzip
+import os
+import time
+from pathlib import Path
+
+from scripts.static_files import IMMUTABLE_CACHE, SHORT_CACHE, StaticCache, StaticEntry, is_hashed_asset, precompress_dir
+
+
+def test_hashed_assets_are_immutable_and_compressed(tmp_path):
+    asset = tmp_path / "index-DBEUlYDv.js"
+    asset.write_text("console.log('hello');\n" * 100)
+    cache = StaticCache()
+    assert cache.warm([tmp_path]) == 1
+    entry = cache.get(asset)
+
+    assert entry.cache_control == IMMUTABLE_CACHE
+    encoding, body = entry.select("gzip, deflate")
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == asset.read_bytes()
+    assert entry.select("identity")[0] == "identity"
+    assert entry.select("gzip;q=0")[0] == "identity"
+
+
+def test_mutable_files_reload_after_change(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text('{"a": 1}')
+    cache = StaticCache()
+    first = cache.get(path)
+    assert first.cache_control == SHORT_CACHE
+    assert cache.get(path) is first
+
+    path.write_text('{"a": 22}')
+    os.utime(path, ns=(first.stamp[0] + 1_000_000, first.stamp[0] + 1_000_000))
+    second = cache.get(path)
+    assert second is not first
+    assert second.etag != first.etag
+
+
+def test_resolve_rejects_traversal(tmp_path):
+    assert StaticCache.resolve(tmp_path, "../etc/passwd") is None
+    assert StaticCache.resolve(tmp_path, "a/b.js") == (tmp_path / "a" / "b.js").resolve()
+
+
+def test_precompressed_files_on_disk_are_used(tmp_path):
+    asset = tmp_path / "app-1234567890.css"
+    asset.write_text("body { color: red; }\n" * 100)
+    assert precompress_dir([tmp_path]) == 1
+    (tmp_path / "app-1234567890.css.gz").write_bytes(b"from-disk")
+
+    entry = StaticCache().get(asset)
+    assert entry.variants["gzip"] == b"from-disk"
+
+
+def test_request_path_does_not_compress(tmp_path):
+    path = tmp_path / "late.json"
+    path.write_text('{"key": "value"}\n' * 100)
+    assert "gzip" not in StaticEntry(path, SHORT_CACHE, compress=False).variants
+    entry = StaticCache().get(path)
+    # 未预热的文件先以原文返回，压缩版本由后台线程补齐
+    for _ in range(100):
+        if "gzip" in entry.variants:
+            break
+        time.sleep(0.05)
+    assert gzip.decompress(entry.select("gzip")[1]) == path.read_bytes()
+
+
+def test_hashed_name_and_per_encoding_etag(tmp_path):
+    assert is_hashed_asset(Path("index-DBEUlYDv.js"))
+    assert is_hashed_asset(Path("vendor-a1b2c3d4.css"))
+    for name in ("react-dom.development.js", "my-homepage.js", "chunk-vendors.js", "app.js"):
+        assert not is_hashed_asset(Path(name))
+
+    path = tmp_path / "index-DBEUlYDv.js"
+    path.write_text("console.log('hello');\n" * 100)
+    entry = StaticEntry(path, IMMUTABLE_CACHE)
+    tags = {entry.headers(encoding)["ETag"] for encoding in entry.variants}
+    assert len(tags) == len(entry.variants)
+    assert entry.headers("identity")["ETag"] == entry.etag
+    assert entry.headers("gzip")["ETag"] == entry.etag[:-1] + '-gz"'
@@ -0,0 +1,61 @@
+# 测试 BM25F 倒排索引
+from scripts import segmenter, text_index
+from scripts.text_index import BM25FIndex, tokenize, tokenize_spans
+
+RECORDS = [
+    {"title": "Data Science MSc", "heading": "Compulsory modules", "text": "Machine learning and statistics"},
+    {"title": "Museum Studies MA", "heading": "About this degree", "text": "Museum theory and practice"},
+    {"title": "Computer Science BSc", "heading": "Careers", "text": "Graduates work in data engineering"},
+]
+
+
+def test_tokenize_english_and_chinese():
+    assert tokenize("What are the Modules for Data Science?") == ["module", "data", "science"]
+    assert "studies" not in tokenize("Museum Studies") and "study" in tokenize("Museum Studies")
+    assert tokenize("数据科学") != []
+
+
+def test_only_documents_sharing_a_term_are_scored():
+    index = BM25FIndex.build(RECORDS)
+    hits = index.search({"museum": 1.0})
+    assert [doc_id for doc_id, _ in hits] == [1]
+    assert 0 < hits[0][1] < index.upper_bound({"museum": 1.0})
+    assert index.search({"nonexistent": 1.0}) == []
+
+
+def test_title_field_outweighs_text():
+    index = BM25FIndex.build(RECORDS)
+    hits = index.search({"data": 1.0})
+    # "data" 出现在 0 号的标题与 2 号的正文中
+    assert [doc_id for doc_id, _ in hits] == [0, 2]
+
+
+def test_maxscore_pruning_keeps_exact_top_k():
+    records = [
+        {"title": f"Programme {i}", "heading": "Modules", "text": " ".join(["data"] * (i % 7) + ["museum"] * (i % 3) + ["rare"] * (i == 42))}
+        for i in range(200)
+    ]
+    index = BM25FIndex.build(records)
+    terms = {"rare": 1.0, "data": 1.0, "museum": 0.3}
+    full = index.search(terms)
+    for limit in (1, 5, 20):
+        assert index.search(terms, limit) == full[:limit]
+    # slack：另外返回与第 limit 名相差不超过 slack 的文档
+    near = index.search(terms, 5, slack=0.5)
+    assert near[:5] == full[:5]
+    assert [d for d, s in near[5:]] == [d for d, s in full[5:] if s >= full[4][1] - 0.5]
+    # stats 报告实际打分的文档数，而不是返回的结果数
+    stats = {}
+    assert len(index.search(terms, 5, stats=stats)) == 5
+    assert 5 < stats["scored"] <= len(full)
+
+
+def test_span_offsets_with_overlapping_bigram_fallback(monkeypatch):
+    # 没有 jieba 时回退到互相重叠的二元切分，区间仍须指向原文
+    fallback = segmenter.Segmenter()
+    monkeypatch.setattr(fallback, "_tokenizer", None)
+    monkeypatch.setattr(text_index, "get_segmenter", lambda: fallback)
+    text = "MSc 数据科学硕士"
+    spans = tokenize_spans(text)
+    assert [t for t, _, _ in spans] == ["msc", "数据", "据科", "科学", "学硕", "硕士"]
+    assert all(text.lower()[start:end] == t for t, start, end in spans)